@@ -1,7 +1,21 @@
-from .utils import decorators
-from .core import exceptions as gpm_exceptions
+import importlib
 
 __all__ = [
     "decorators",
     "gpm_exceptions",
 ]
+
+# Submodules are imported on first access so `import gpm_api_consumer`
+# (and the CLI startup) doesn't pay for requests and friends.
+_lazy_modules = {
+    "decorators": "gpm_api_consumer.utils.decorators",
+    "gpm_exceptions": "gpm_api_consumer.core.exceptions",
+}
+
+
+def __getattr__(name):
+    if name in _lazy_modules:
+        module = importlib.import_module(_lazy_modules[name])
+        globals()[name] = module
+        return module
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
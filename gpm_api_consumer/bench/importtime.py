@@ -0,0 +1,136 @@
+"""
+Cold-start guard for the CLI.
+
+Imports `gpm_api_consumer.cli` in fresh interpreters with `python -X importtime`
+and fails when its cumulative import time goes over budget or when any of
+the heavy modules (HTTP stack, dotenv, numpy...) is imported at startup.
+It also times a whole local command, `main(['config', 'show'])`, against a
+throwaway config directory: it must not probe for a `serve` daemon either.
+
+    python -m gpm_api_consumer.bench.importtime --budget-ms 30 --command-budget-ms 60
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import tempfile
+
+TARGET = 'gpm_api_consumer.cli'
+# Must only be imported by the subcommands that use them
+FORBIDDEN = ('requests', 'urllib3', 'dotenv', 'numpy', 'pyarrow', 'sqlite3')
+
+COMMAND = ['config', 'show']
+# Local commands never reach the daemon client
+COMMAND_FORBIDDEN = FORBIDDEN + ('socket', 'hashlib', 'gpm_api_consumer.daemon')
+
+_COMMAND_SCRIPT = """
+import contextlib, io, json, sys, time
+started = time.perf_counter()
+from gpm_api_consumer.core.ConfigManager import ConfigManager
+ConfigManager.base_config_dir = sys.argv[1]
+from gpm_api_consumer.cli import main
+with contextlib.redirect_stdout(io.StringIO()):
+    main(json.loads(sys.argv[2]))
+elapsed = time.perf_counter() - started
+print(json.dumps({'ms': elapsed * 1000, 'modules': sorted(sys.modules)}))
+"""
+
+
+def measure(target=TARGET):
+    '''
+    Import `target` in a fresh interpreter.
+    Returns (cumulative import time in ms, set of imported module names).
+    '''
+    completed = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {target}'],
+        capture_output=True, text=True, check=True,
+    )
+    cumulative_us = None
+    modules = set()
+    for line in completed.stderr.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        if not cumulative.strip().isdigit():
+            continue  # header line
+        module = name.strip()
+        modules.add(module)
+        if module == target:
+            cumulative_us = int(cumulative)
+    return (cumulative_us or 0) / 1000, modules
+
+
+def measure_command(argv=COMMAND):
+    '''
+    Import the CLI and run `main(argv)` in a fresh interpreter, with its
+    output discarded. Returns (elapsed ms, set of imported module names).
+    '''
+    with tempfile.TemporaryDirectory() as config_dir:
+        completed = subprocess.run(
+            [sys.executable, '-c', _COMMAND_SCRIPT, config_dir, json.dumps(list(argv))],
+            capture_output=True, text=True, check=True,
+        )
+    result = json.loads(completed.stdout.splitlines()[-1])
+    return result['ms'], set(result['modules'])
+
+
+def _forbidden(modules, forbidden):
+    return sorted(module for module in modules
+                  if module in forbidden or module.split('.')[0] in forbidden)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='CLI import-time benchmark')
+    parser.add_argument('--budget-ms', type=float, default=30.0,
+                        help='Maximum median cumulative import time of the CLI (default: 30)')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='Number of fresh interpreters to measure (default: 5)')
+    parser.add_argument('--command-budget-ms', type=float, default=60.0,
+                        help=f"Maximum median time to import the CLI and run "
+                             f"`{' '.join(COMMAND)}` (default: 60)")
+    args = parser.parse_args(argv)
+
+    timings = []
+    imported = set()
+    for _ in range(args.repeat):
+        elapsed, modules = measure()
+        timings.append(elapsed)
+        imported |= modules
+    median = statistics.median(timings)
+    heavy = _forbidden(imported, FORBIDDEN)
+
+    print(f"{TARGET}: median {median:.1f} ms, min {min(timings):.1f} ms, "
+          f"max {max(timings):.1f} ms over {args.repeat} runs (budget {args.budget_ms:.1f} ms)")
+    failed = False
+    if heavy:
+        print(f"FAIL: heavy modules imported at startup: {', '.join(heavy)}")
+        failed = True
+    if median > args.budget_ms:
+        print("FAIL: import time over budget")
+        failed = True
+
+    timings = []
+    imported = set()
+    for _ in range(args.repeat):
+        elapsed, modules = measure_command()
+        timings.append(elapsed)
+        imported |= modules
+    median = statistics.median(timings)
+    heavy = _forbidden(imported, COMMAND_FORBIDDEN)
+
+    print(f"main({COMMAND}): median {median:.1f} ms, min {min(timings):.1f} ms, "
+          f"max {max(timings):.1f} ms over {args.repeat} runs (budget {args.command_budget_ms:.1f} ms)")
+    if heavy:
+        print(f"FAIL: modules imported by a local command: {', '.join(heavy)}")
+        failed = True
+    if median > args.command_budget_ms:
+        print("FAIL: command time over budget")
+        failed = True
+    if not failed:
+        print("OK")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,467 @@
+"""
+Local simulator of the GPM API for benchmarks.
+
+Implements /api/Account/Token, /api/Account/Ping, /api/Plant, the Element and
+Datasource routes and /api/DataList/v2 with synthetic, deterministic data.
+Latency, error rate, token expiry (401), throttling (429) and a concurrency
+capacity beyond which the server slows down are configurable.
+Bodies are compressed as the client accepts (gzip, plus br/zstd when brotli or
+zstandard are installed) and DataList answers the delta-encoded representation
+of utils.compact when asked for it.
+
+    python -m gpm_api_consumer.bench.simulator --port 8080 --latency 0.05
+"""
+import argparse
+import base64
+import gzip
+import hashlib
+import json
+import math
+import random
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+from gpm_api_consumer.utils.compact import DELTA_MEDIA_TYPE, encode_datalist
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - optional dependency
+    brotli = None
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - optional dependency
+    zstandard = None
+
+GROUPING_MINUTES = {'minute': 1, 'hour': 60, 'day': 1440}
+EPOCH = datetime(1970, 1, 1)
+# Monday, where week buckets start
+WEEK_ORIGIN = datetime(1970, 1, 5)
+SIGNALS = ('active_power', 'active_energy', 'irradiance', 'temperature')
+ELEMENT_TYPES = ('Inverter', 'Meter', 'String', 'WeatherStation')
+
+
+def bucket_start(date, grouping, granularity=1):
+    '''
+    Start of the `grouping` x `granularity` bucket holding `date`.
+    '''
+    if grouping == 'month':
+        months = (date.year * 12 + date.month - 1) // granularity * granularity
+        return datetime(months // 12, months % 12 + 1, 1)
+    midnight = datetime(date.year, date.month, date.day)
+    if grouping == 'week':
+        weeks = (midnight - WEEK_ORIGIN).days // 7 // granularity * granularity
+        return WEEK_ORIGIN + timedelta(weeks=weeks)
+    if grouping == 'day':
+        return EPOCH + timedelta(days=(midnight - EPOCH).days // granularity * granularity)
+    step = timedelta(minutes=GROUPING_MINUTES[grouping] * granularity)
+    return midnight + (date - midnight) // step * step
+
+
+class SimulatorConfig:
+    '''
+    Knobs of the simulated API.
+    '''
+
+    def __init__(self, plants=3, elements=20, datasources=4, latency=0.0,
+                 jitter=0.0, error_rate=0.0, token_ttl=3600, rate_limit=None,
+                 retry_after=1, raw_interval=5, compression=True, compact=True,
+                 min_compress_size=1024, capacity=None, seed=0):
+        self.plants = plants
+        self.elements = elements            # per plant
+        self.datasources = datasources      # per element
+        self.latency = latency              # seconds added to every response
+        self.jitter = jitter                # random extra seconds, uniform [0, jitter]
+        self.error_rate = error_rate        # fraction of requests answered with 500
+        self.token_ttl = token_ttl          # seconds before tokens get 401
+        self.rate_limit = rate_limit        # requests per second before 429
+        self.retry_after = retry_after      # Retry-After header of the 429s
+        self.raw_interval = raw_interval    # minutes between raw samples
+        self.compression = compression      # honour Accept-Encoding (gzip, br, zstd)
+        self.compact = compact              # serve delta-encoded DataList when accepted
+        self.min_compress_size = min_compress_size
+        # Requests served at full speed at once: above it latency grows with
+        # the load, and above twice it requests get 429
+        self.capacity = capacity
+        self.seed = seed
+
+
+class SimulatorStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.requests = 0
+            self.logins = 0
+            self.unauthorized = 0
+            self.throttled = 0
+            self.errors = 0
+            self.bytes_sent = 0
+            self.records_sent = 0
+
+    def add(self, **amounts):
+        with self._lock:
+            for key, amount in amounts.items():
+                setattr(self, key, getattr(self, key) + amount)
+
+    def as_dict(self):
+        with self._lock:
+            return {key: value for key, value in vars(self).items() if not key.startswith('_')}
+
+
+def make_token(ttl):
+    '''
+    Unsigned JWT-like token with an `exp` claim, like the real API.
+    '''
+    def encode(data):
+        return base64.urlsafe_b64encode(json.dumps(data).encode()).decode().rstrip('=')
+    payload = {'exp': int(time.time() + ttl), 'jti': random.getrandbits(32)}
+    return f"{encode({'alg': 'none'})}.{encode(payload)}.sim"
+
+
+class GPMSimulator:
+    '''
+    Threaded HTTP server speaking a subset of the GPM API.
+    Use as a context manager or call start()/stop().
+    '''
+
+    def __init__(self, config=None, host='127.0.0.1', port=0, username='bench', password='bench'):
+        self.config = config or SimulatorConfig()
+        self.username = username
+        self.password = password
+        self.stats = SimulatorStats()
+        self._tokens = {}
+        self._lock = threading.Lock()
+        self._window = [time.monotonic(), 0]
+        self._in_flight = 0
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def expire_tokens(self):
+        '''
+        Invalidate every issued token, forcing clients to log in again.
+        '''
+        with self._lock:
+            self._tokens.clear()
+
+    # Synthetic data
+
+    def plants(self):
+        return [{'Id': p, 'Name': f'Simulated Plant {p}'} for p in range(1, self.config.plants + 1)]
+
+    def elements(self, plant_id):
+        return [{
+            'Id': plant_id * 1000 + e,
+            'Name': f'{ELEMENT_TYPES[e % len(ELEMENT_TYPES)]} {e}',
+            'Type': ELEMENT_TYPES[e % len(ELEMENT_TYPES)],
+            'PlantId': plant_id,
+        } for e in range(1, self.config.elements + 1)]
+
+    def datasources(self, plant_id, element_id=None):
+        element_ids = [element_id] if element_id else [e['Id'] for e in self.elements(plant_id)]
+        return [{
+            'DataSourceId': element * 100 + d,
+            'DataSourceName': SIGNALS[d % len(SIGNALS)],
+            'Signal': SIGNALS[d % len(SIGNALS)],
+            'ElementId': element,
+        } for element in element_ids for d in range(self.config.datasources)]
+
+    def datalist(self, query):
+        '''
+        Raw samples on the `raw_interval` grid between startDate and endDate
+        (both included), aggregated into buckets aligned like the real API's:
+        minutes and hours restart at midnight, days count from the epoch,
+        weeks start on Monday and months follow the calendar. Buckets cut by
+        the query range only hold the samples inside it.
+        '''
+        ids = [int(v) for value in query.get('dataSourceIds', query.get('datasourceIds', []))
+               for v in value.split(',') if v]
+        start = datetime.fromisoformat(query['startDate'][0])
+        end = datetime.fromisoformat(query['endDate'][0])
+        grouping = query.get('grouping', ['raw'])[0].lower()
+        granularity = int(query.get('granularity', ['1'])[0] or 1)
+        aggregation_type = int(query.get('aggregationType', ['1'])[0] or 1)
+        if grouping != 'raw' and grouping not in GROUPING_MINUTES and grouping not in ('week', 'month'):
+            raise ValueError(f"Unknown grouping {grouping}")
+        raw_step = timedelta(minutes=self.config.raw_interval)
+        # First sample of the raw grid at or after start
+        date = EPOCH + -((EPOCH - start) // raw_step) * raw_step
+        label, solars = None, []
+        while date <= end:
+            bucket = date if grouping == 'raw' else bucket_start(date, grouping, granularity)
+            if bucket != label:
+                yield from self._bucket(label, solars, ids, grouping, aggregation_type)
+                label, solars = bucket, []
+            solars.append(self._solar(date))
+            date += raw_step
+        yield from self._bucket(label, solars, ids, grouping, aggregation_type)
+
+    @staticmethod
+    def _bucket(label, solars, ids, grouping, aggregation_type):
+        if label is None:
+            return
+        iso = label.isoformat()
+        for datasource_id in ids:
+            values = [round(solar * (datasource_id % 97 + 1), 3) for solar in solars]
+            if grouping == 'raw':
+                value = values[0]
+            elif aggregation_type == 0:
+                # Sum without zeros
+                nonzero = [v for v in values if v]
+                value = round(sum(nonzero), 3) if nonzero else None
+            else:
+                value = round(sum(values) / len(values), 3)
+            yield {'DataSourceId': datasource_id, 'Date': iso, 'Value': value}
+
+    @staticmethod
+    def _solar(date):
+        day_fraction = (date.hour * 60 + date.minute) / 1440
+        return max(0.0, math.sin(math.pi * (day_fraction - 0.25) * 2))
+
+    # HTTP plumbing
+
+    def _handler_class(self):
+        simulator = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # Headers and body are separate writes; avoid Nagle/delayed-ACK stalls
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def handle(self):
+                try:
+                    super().handle()
+                except (BrokenPipeError, ConnectionResetError):
+                    # The client went away (e.g. a read timeout); nothing to answer
+                    self.close_connection = True
+
+            def _encode(self, data):
+                '''
+                Compress with the best coding accepted by the client.
+                '''
+                config = simulator.config
+                if not config.compression or len(data) < config.min_compress_size:
+                    return data, None
+                accepted = {c.split(';')[0].strip() for c in
+                            (self.headers.get('Accept-Encoding') or '').split(',')}
+                if zstandard is not None and 'zstd' in accepted:
+                    return zstandard.ZstdCompressor(level=3).compress(data), 'zstd'
+                if brotli is not None and 'br' in accepted:
+                    return brotli.compress(data, quality=4), 'br'
+                if 'gzip' in accepted:
+                    return gzip.compress(data, compresslevel=6), 'gzip'
+                return data, None
+
+            def _send(self, status, body=None, headers=(), content_type='application/json'):
+                data, coding = self._encode(b'' if body is None else body)
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                if coding:
+                    self.send_header('Content-Encoding', coding)
+                self.send_header('Content-Length', str(len(data)))
+                for key, value in headers:
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(data)
+                simulator.stats.add(bytes_sent=len(data))
+
+            def _json(self, status, obj, headers=(), content_type='application/json'):
+                self._send(status, json.dumps(obj, separators=(',', ':')).encode(), headers,
+                           content_type=content_type)
+
+            def _gate(self):
+                '''
+                Latency, throttling and random errors. Returns False if answered.
+                '''
+                config = simulator.config
+                simulator.stats.add(requests=1)
+                delay = config.latency + (random.uniform(0, config.jitter) if config.jitter else 0)
+                if config.capacity:
+                    with simulator._lock:
+                        load = simulator._in_flight / config.capacity
+                    if load > 2:
+                        simulator.stats.add(throttled=1)
+                        self._send(429, headers=[('Retry-After', str(config.retry_after))])
+                        return False
+                    delay *= max(1.0, load)
+                if delay:
+                    time.sleep(delay)
+                if config.rate_limit:
+                    with simulator._lock:
+                        now = time.monotonic()
+                        if now - simulator._window[0] >= 1:
+                            simulator._window = [now, 0]
+                        simulator._window[1] += 1
+                        throttled = simulator._window[1] > config.rate_limit
+                    if throttled:
+                        simulator.stats.add(throttled=1)
+                        self._send(429, headers=[('Retry-After', str(config.retry_after))])
+                        return False
+                if config.error_rate and random.random() < config.error_rate:
+                    simulator.stats.add(errors=1)
+                    self._send(500)
+                    return False
+                return True
+
+            def _authorized(self):
+                token = (self.headers.get('Authorization') or '')[len('Bearer '):]
+                with simulator._lock:
+                    expires = simulator._tokens.get(token)
+                if expires is None or expires < time.time():
+                    simulator.stats.add(unauthorized=1)
+                    self._send(401)
+                    return False
+                return True
+
+            def _counted(self, handler):
+                with simulator._lock:
+                    simulator._in_flight += 1
+                try:
+                    handler()
+                finally:
+                    with simulator._lock:
+                        simulator._in_flight -= 1
+
+            def do_POST(self):
+                self._counted(self._post)
+
+            def do_GET(self):
+                self._counted(self._get)
+
+            def _post(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+                if not self._gate():
+                    return
+                if urlparse(self.path).path != '/api/Account/Token':
+                    return self._send(404)
+                try:
+                    credentials = json.loads(body or b'{}')
+                except ValueError:
+                    return self._send(400)
+                if (credentials.get('username'), credentials.get('password')) != (simulator.username, simulator.password):
+                    return self._send(401)
+                token = make_token(simulator.config.token_ttl)
+                with simulator._lock:
+                    simulator._tokens[token] = time.time() + simulator.config.token_ttl
+                simulator.stats.add(logins=1)
+                self._json(200, {'AccessToken': token, 'ExpiresIn': simulator.config.token_ttl})
+
+            def _get(self):
+                url = urlparse(self.path)
+                if url.path == '/__stats':
+                    return self._json(200, simulator.stats.as_dict())
+                if not self._gate() or not self._authorized():
+                    return
+                query = parse_qs(url.query)
+                parts = url.path.strip('/').split('/')
+                if url.path == '/api/Account/Ping':
+                    return self._send(200)
+                if url.path == '/api/DataList/v2':
+                    return self._datalist(query)
+                if parts[:2] != ['api', 'Plant']:
+                    return self._send(404)
+                if len(parts) == 2:
+                    return self._json(200, simulator.plants())
+                plant_id = int(parts[2])
+                if plant_id > simulator.config.plants:
+                    return self._send(404)
+                if len(parts) == 3:
+                    return self._json(200, simulator.plants()[plant_id - 1])
+                if parts[3] == 'Datasource':
+                    return self._json(200, simulator.datasources(plant_id))
+                if parts[3] == 'Element' and len(parts) == 4:
+                    return self._elements(plant_id)
+                if parts[3] == 'Element' and len(parts) == 5:
+                    element = next((e for e in simulator.elements(plant_id) if e['Id'] == int(parts[4])), None)
+                    return self._json(200, element) if element else self._send(404)
+                if parts[3] == 'Element' and len(parts) == 6 and parts[5] == 'Datasource':
+                    return self._json(200, simulator.datasources(plant_id, int(parts[4])))
+                self._send(404)
+
+            def _elements(self, plant_id):
+                body = json.dumps(simulator.elements(plant_id), separators=(',', ':')).encode()
+                etag = '"%s"' % hashlib.sha1(body).hexdigest()
+                if self.headers.get('If-None-Match') == etag:
+                    return self._send(304, headers=[('ETag', etag)])
+                self._send(200, body, headers=[('ETag', etag)])
+
+            def _datalist(self, query):
+                try:
+                    records = list(simulator.datalist(query))
+                except (KeyError, ValueError):
+                    return self._send(400)
+                simulator.stats.add(records_sent=len(records))
+                if simulator.config.compact and DELTA_MEDIA_TYPE in (self.headers.get('Accept') or ''):
+                    return self._json(200, encode_datalist(records), content_type=DELTA_MEDIA_TYPE)
+                self._json(200, records)
+
+        return Handler
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Local GPM API simulator')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--plants', type=int, default=3)
+    parser.add_argument('--elements', type=int, default=20, help='Elements per plant')
+    parser.add_argument('--datasources', type=int, default=4, help='Datasources per element')
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds added to every response')
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--error_rate', type=float, default=0.0)
+    parser.add_argument('--token_ttl', type=int, default=3600)
+    parser.add_argument('--rate_limit', type=float, default=None, help='Requests per second before 429')
+    parser.add_argument('--capacity', type=int, default=None,
+                        help='Concurrent requests before latency grows (429 above twice it)')
+    parser.add_argument('--no_compression', action='store_true', help='Ignore Accept-Encoding')
+    parser.add_argument('--no_compact', action='store_true', help='Never serve delta-encoded DataList')
+    parser.add_argument('--username', default='bench')
+    parser.add_argument('--password', default='bench')
+    args = parser.parse_args(argv)
+
+    config = SimulatorConfig(plants=args.plants, elements=args.elements,
+                             datasources=args.datasources, latency=args.latency,
+                             jitter=args.jitter, error_rate=args.error_rate,
+                             token_ttl=args.token_ttl, rate_limit=args.rate_limit,
+                             compression=not args.no_compression, compact=not args.no_compact,
+                             capacity=args.capacity)
+    simulator = GPMSimulator(config, host=args.host, port=args.port,
+                             username=args.username, password=args.password)
+    # First line is the URL, so a parent process can read it
+    print(simulator.base_url, flush=True)
+    try:
+        simulator._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        simulator._server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,275 @@
+"""
+Benchmark suite running the consumer against the local GPM simulator.
+
+Every scenario runs in its own interpreter (so peak RSS is per scenario)
+against a simulator in a separate process, and reports requests/sec,
+p50/p99 request latency, peak RSS and bytes decoded.
+
+    python -m gpm_api_consumer.bench.suite --latency 0.02 --save bench.json
+    python -m gpm_api_consumer.bench.suite --baseline bench.json --tolerance 0.2
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from urllib.request import urlopen
+
+try:
+    import resource
+except ImportError:  # pragma: no cover - Windows
+    resource = None
+
+
+def bench_env(url):
+    '''
+    Point ConfigManager at a throwaway config dir using the simulator.
+    '''
+    from gpm_api_consumer.core.ConfigManager import ConfigManager
+    config_dir = tempfile.mkdtemp(prefix='gpm-bench-')
+    with open(os.path.join(config_dir, 'gpm.env'), 'w') as file:
+        file.write(f'API_BASE_URL={url}\nAPI_USERNAME=bench\nAPI_PASSWORD=bench\n')
+    ConfigManager.base_config_dir = config_dir
+    return config_dir
+
+
+class RequestTimer:
+    '''
+    Wraps a requests session to time every request (including the body
+    download for non-streamed requests).
+    '''
+
+    def __init__(self):
+        self.latencies = []
+
+    def instrument(self, session):
+        request = session.request
+
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return request(*args, **kwargs)
+            finally:
+                self.latencies.append(time.perf_counter() - start)
+        session.request = timed
+        return session
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def simulator_stats(url):
+    with urlopen(f'{url}/__stats') as response:
+        return json.load(response)
+
+
+def datalist_params(args, plant_id=1):
+    # Same ids the simulator generates for the first elements of plant 1
+    ids = [(plant_id * 1000 + e) * 100 + d
+           for e in range(1, args.elements + 1) for d in range(args.datasources_per_element)][:args.datasources]
+    return {
+        'dataSourceIds': ','.join(str(v) for v in ids),
+        'startDate': '2024-01-01T00:00:00',
+        'endDate': f'2024-01-{args.days:02d}T23:55:00' if args.days < 31 else '2024-01-31T23:55:00',
+        'grouping': 'minute',
+        'granularity': 5,
+        'aggregationType': 1,
+    }
+
+
+# Scenarios: each one gets (consumer, args) and returns the number of items produced
+
+def crawl_sequential(consumer, args):
+    elements = consumer.element(1)
+    for element in elements:
+        consumer.element(1, element['Id'])
+        consumer.datasources(1, element['Id'])
+    return len(elements)
+
+
+def crawl_async(consumer, args):
+    from gpm_api_consumer.core.AsyncConsumers import AsyncGPMConsumer
+
+    async def run():
+        async with AsyncGPMConsumer(max_concurrency=args.concurrency) as async_consumer:
+            args.timer.instrument(async_consumer.client.client.session)
+            return len(await async_consumer.crawl_plant(1))
+    return asyncio.run(run())
+
+
+def crawl_topology(consumer, args):
+    from gpm_api_consumer.core.Topology import TopologyStore
+    store = TopologyStore(consumer, max_workers=args.concurrency)
+    store.refresh(1)
+    return len(store.lookup(1))
+
+
+def datalist_eager(consumer, args):
+    return len(consumer.datalistv2(datalist_params(args)))
+
+
+def datalist_stream(consumer, args):
+    return sum(1 for _ in consumer.datalistv2(datalist_params(args), stream=True))
+
+
+def datalist_sharded(consumer, args):
+    from gpm_api_consumer.core.Sharding import ShardPlanner
+    planner = ShardPlanner(max_rows=args.shard_rows)
+    return sum(1 for _ in consumer.datalistv2_sharded(datalist_params(args), planner=planner,
+                                                       max_workers=args.concurrency))
+
+
+def datalist_frame(consumer, args):
+    return len(consumer.datalistv2_frame(datalist_params(args), stream=True))
+
+
+def datalist_compact(consumer, args):
+    consumer.compact = True
+    return sum(1 for _ in consumer.datalistv2(datalist_params(args), stream=True))
+
+
+SCENARIOS = {
+    'crawl_sequential': crawl_sequential,
+    'crawl_async': crawl_async,
+    'crawl_topology': crawl_topology,
+    'datalist_eager': datalist_eager,
+    'datalist_stream': datalist_stream,
+    'datalist_sharded': datalist_sharded,
+    'datalist_frame': datalist_frame,
+    'datalist_compact': datalist_compact,
+}
+
+
+def run_scenario(name, args):
+    '''
+    Run one scenario in this process and return its metrics.
+    '''
+    bench_env(args.url)
+    from gpm_api_consumer.core.Consumers import GPMConsumer
+    # Memoization would hide the transport being measured after the first repeat
+    consumer = GPMConsumer(pool_size=args.concurrency, memoize=False,
+                           compression=not args.no_compression)
+    consumer.tokens.refresh()
+    args.timer = RequestTimer()
+    args.timer.instrument(consumer.session)
+
+    before = simulator_stats(args.url)
+    start = time.perf_counter()
+    items = SCENARIOS[name](consumer, args)
+    elapsed = time.perf_counter() - start
+    after = simulator_stats(args.url)
+
+    latencies = args.timer.latencies
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 if resource else None
+    return {
+        'scenario': name,
+        'items': items,
+        'seconds': round(elapsed, 4),
+        'requests': after['requests'] - before['requests'],
+        'requests_per_sec': round((after['requests'] - before['requests']) / elapsed, 2) if elapsed else None,
+        'p50_ms': round(percentile(latencies, 0.5) * 1000, 2) if latencies else None,
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 2) if latencies else None,
+        'peak_rss_mb': round(peak_rss, 1) if peak_rss else None,
+        'wire_bytes': after['bytes_sent'] - before['bytes_sent'],
+    }
+
+
+def start_simulator(args):
+    command = [sys.executable, '-m', 'gpm_api_consumer.bench.simulator', '--port', '0',
+               '--plants', '1', '--elements', str(args.elements),
+               '--datasources', str(args.datasources_per_element),
+               '--latency', str(args.latency), '--error_rate', str(args.error_rate)]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+    url = process.stdout.readline().strip()
+    return process, url
+
+
+def worker_command(name, args, url):
+    command = [sys.executable, '-m', 'gpm_api_consumer.bench.suite', '--worker', name, '--url', url]
+    for key in ('elements', 'datasources_per_element', 'datasources', 'days',
+                'concurrency', 'shard_rows'):
+        command += [f'--{key}', str(getattr(args, key))]
+    if args.no_compression:
+        command.append('--no_compression')
+    return command
+
+
+def compare(results, baseline, tolerance):
+    '''
+    Return the regressions of `results` against a saved baseline.
+    '''
+    previous = {item['scenario']: item for item in baseline}
+    regressions = []
+    for item in results:
+        old = previous.get(item['scenario'])
+        if not old:
+            continue
+        for metric in ('seconds', 'peak_rss_mb', 'p99_ms'):
+            if old.get(metric) and item.get(metric) and item[metric] > old[metric] * (1 + tolerance):
+                regressions.append(f"{item['scenario']}.{metric}: {old[metric]} -> {item[metric]}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='GPM consumer benchmark suite')
+    parser.add_argument('--scenarios', type=str, default=','.join(SCENARIOS),
+                        help='Comma-separated scenarios to run')
+    parser.add_argument('--elements', type=int, default=200, help='Elements of the simulated plant')
+    parser.add_argument('--datasources_per_element', type=int, default=4)
+    parser.add_argument('--datasources', type=int, default=200, help='Datasources per datalistv2 pull')
+    parser.add_argument('--days', type=int, default=7, help='Days per datalistv2 pull')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--shard_rows', type=int, default=50000)
+    parser.add_argument('--latency', type=float, default=0.01, help='Simulated server latency (s)')
+    parser.add_argument('--error_rate', type=float, default=0.0)
+    parser.add_argument('--no_compression', action='store_true',
+                        help='Ask for uncompressed responses')
+    parser.add_argument('--save', type=str, default=None, help='Write the results as JSON')
+    parser.add_argument('--baseline', type=str, default=None, help='Fail on regressions against this JSON')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    parser.add_argument('--worker', type=str, default=None, help=argparse.SUPPRESS)
+    parser.add_argument('--url', type=str, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.worker:
+        print(json.dumps(run_scenario(args.worker, args)))
+        return 0
+
+    process, url = start_simulator(args)
+    results = []
+    try:
+        for name in args.scenarios.split(','):
+            completed = subprocess.run(worker_command(name, args, url), capture_output=True,
+                                       text=True, check=True)
+            results.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+    finally:
+        process.terminate()
+        process.wait()
+
+    columns = ('scenario', 'items', 'seconds', 'requests', 'requests_per_sec',
+               'p50_ms', 'p99_ms', 'peak_rss_mb', 'wire_bytes')
+    print(' '.join(f'{c:>16}' for c in columns))
+    for item in results:
+        print(' '.join(f'{str(item[c]):>16}' for c in columns))
+
+    if args.save:
+        with open(args.save, 'w') as file:
+            json.dump(results, file, indent=4)
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = compare(results, json.load(file), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,10 +1,75 @@
-from gpm_api_consumer.core.Operators import GPMOperator
-import logging
 import argparse
 import json
+import logging
+import os
+import sys
+import threading
+from gpm_api_consumer.utils import profiling
+
+# Formats accepted by --output (see core.Sinks), listed here so that
+# building the parser doesn't import the writers
+OUTPUT_FORMATS = ('ndjson', 'csv', 'parquet')
+
+# Objects kept between the commands of a `gpm-cli serve` daemon (see daemon.py);
+# None in a regular one-shot run
+WARM = None
+_WARM_LOCK = threading.Lock()
+
+# Options holding paths, made absolute before a command goes to the daemon
+PATH_OPTIONS = ('output', 'metrics_file', 'trace')
+
+# Operations that only touch local files: nothing warm to reuse, so they
+# never look for a daemon
+LOCAL_OPERATIONS = ('config', 'cache', 'serve')
+
+# Long-running operations stopped with Ctrl-C, some of them holding a lock
+# (the backfill job's, the sync watermarks'): in the daemon the signal would
+# reach the client only, leaving them running
+UNFORWARDED_OPERATIONS = ('backfill', 'sync', 'plant_data_pipeline_batch')
+
+
+def shared(key, factory):
+    '''
+    The object stored under `key` in the daemon, created with `factory` on
+    first use. Outside the daemon a new object is created every time.
+    '''
+    if WARM is None:
+        return factory()
+    with _WARM_LOCK:
+        if key not in WARM:
+            WARM[key] = factory()
+        return WARM[key]
+
 
+def emit(args, title, result, plant_id=None):
+    '''
+    Print the result as indented JSON, or write it to the --output sink.
+    `result` may also be an iterator of record batches when streaming.
+    '''
+    with profiling.stage('output'):
+        _emit(args, title, result, plant_id)
 
-def main():
+
+def _emit(args, title, result, plant_id):
+    if not args.output:
+        print(title)
+        print(json.dumps(result, indent=4))
+        return
+    from gpm_api_consumer.core.Sinks import open_sink, write_batches
+    if result is None:
+        batches = []
+    elif isinstance(result, dict):
+        batches = [[result]]
+    elif isinstance(result, list):
+        batches = [result]
+    else:
+        batches = result
+    sink = open_sink(args.output, args.format, plant_id=plant_id)
+    rows = write_batches(sink, batches)
+    logging.getLogger(__name__).info(f"{title.splitlines()[0].rstrip(':')}: {rows} rows written to {args.output}")
+
+
+def build_parser():
     parser = argparse.ArgumentParser(
         'python gpm_consumer_cli.py',
         description='GPM Consumer CLI',
@@ -18,6 +83,32 @@ def main():
                         help='Run in interactive mode')
     parser.add_argument('-f', '--file', action='store_true',
                         help='Load parameters from the config file')
+    parser.add_argument('-c', '--cache', action='store_true',
+                        help='Serve datalistv2 requests through the local cache')
+    parser.add_argument('-s', '--store', action='store_true',
+                        help='Also keep datalistv2 results in the memory-mapped result store,\n'
+                             'readable by other processes without parsing (see core.ResultStore)')
+    parser.add_argument('-o', '--output', type=str, default=None,
+                        help='Write results to a file (.ndjson, .csv, .parquet), to a directory\n'
+                             'partitioned by plant/date, or "-" for NDJSON on stdout')
+    parser.add_argument('--format', type=str, choices=OUTPUT_FORMATS, default=None,
+                        help='Output format for --output (default: from extension, or ndjson)')
+    parser.add_argument('--batch_size', type=int, default=10000,
+                        help='Records per streamed batch when writing datalistv2 to --output')
+    parser.add_argument('--metrics', type=str, choices=('json', 'prometheus'), default=None,
+                        help='Print request metrics (latency, bytes, retries, re-logins,\n'
+                             'cache hits) at the end of the run')
+    parser.add_argument('--metrics_file', type=str, default=None,
+                        help='Write the --metrics report to this file instead of stderr')
+    parser.add_argument('--trace', type=str, default=None,
+                        help='Write one JSON span per request to this file')
+    parser.add_argument('--profile', type=str, default=None, metavar='DIR',
+                        help='Profile each stage (wall and CPU time, top allocators, peak\n'
+                             'memory) and write the report, cProfile stats and collapsed\n'
+                             'stacks for flame graphs to DIR')
+    parser.add_argument('--no_daemon', action='store_true',
+                        help='Run in this process even if a `serve` daemon is running\n'
+                             '(also with GPM_NO_DAEMON=1)')
 
     subparsers = parser.add_subparsers(dest='operation', required=True,
                             help='Available operations:')
@@ -37,6 +128,34 @@ def main():
     config_reset = config_subparsers.add_parser('reset', help='Reset config to default values')
     config_reset.add_argument('keys', nargs='*', help='Keys to reset. If not provided, all keys will be reset.')
 
+    # Operation: cache
+    cache_parser = subparsers.add_parser('cache', help='Manage the local datalistv2 cache')
+    cache_subparsers = cache_parser.add_subparsers(dest='action', required=True)
+    cache_subparsers.add_parser('stats', help='Show cache size and hit/miss counters')
+    cache_subparsers.add_parser('clear', help='Remove every cached bucket')
+
+    # Operation: topology
+    topology_parser = subparsers.add_parser('topology',
+                                help='Cached plant/element/datasource topology')
+    topology_subparsers = topology_parser.add_subparsers(dest='action', required=True)
+    topology_refresh = topology_subparsers.add_parser('refresh', help='Fetch the topology of a plant again')
+    topology_refresh.add_argument('plant', type=str, help='ID or name of the plant')
+    topology_lookup = topology_subparsers.add_parser('lookup', help='Find datasources of a plant')
+    topology_lookup.add_argument('plant', type=str, help='ID or name of the plant')
+    topology_lookup.add_argument('--element_type', type=str, default=None,
+                            help='Element type (e.g., inverter, meter)')
+    topology_lookup.add_argument('--signal', type=str, default=None,
+                            help='Signal of the datasource (e.g., active_power)')
+    topology_lookup.add_argument('--ids', action='store_true',
+                            help='Only print the datasource IDs')
+    topology_types = topology_subparsers.add_parser('types', help='List the element types of a plant')
+    topology_types.add_argument('plant', type=str, help='ID or name of the plant')
+    topology_clear = topology_subparsers.add_parser('clear', help='Forget the cached topology')
+    topology_clear.add_argument('plant', type=str, nargs='?', default=None,
+                            help='ID or name of the plant. If not provided, everything is cleared.')
+    topology_parser.add_argument('--ttl', type=int, default=3600,
+                            help='Seconds before the cached topology is revalidated (default: 3600)')
+
     # Operation: plants
     plant_parser = subparsers.add_parser('plants', help='List all plants')
 
@@ -110,85 +229,282 @@ def main():
     plant_data_pipeline_parser.add_argument('endDate', type=str, nargs='?',
                             help='End date in YYYY-MM-DDTHH:MM:SS format')
 
-    args = parser.parse_args()
+    # Operation: plant_data_pipeline_batch
+    batch_parser = subparsers.add_parser('plant_data_pipeline_batch',
+                                help='Run the full data pipeline for several plants concurrently')
+    batch_group = batch_parser.add_mutually_exclusive_group(required=True)
+    batch_group.add_argument('--plant_ids', type=str, help='Comma-separated plant IDs')
+    batch_group.add_argument('--plant_names', type=str, help='Comma-separated plant names')
+    batch_group.add_argument('--all', action='store_true', help='Every plant of the account')
+    batch_parser.add_argument('startDate', type=str, nargs='?',
+                            help='Start date in YYYY-MM-DDTHH:MM:SS format')
+    batch_parser.add_argument('endDate', type=str, nargs='?',
+                            help='End date in YYYY-MM-DDTHH:MM:SS format')
+    batch_parser.add_argument('--workers', type=int, default=4,
+                            help='Plants processed at the same time (default: 4)')
+    batch_parser.add_argument('--rate', type=float, default=None,
+                            help='Maximum requests per second across all plants')
+    batch_parser.add_argument('--burst', type=int, default=None,
+                            help='Burst size of the rate limiter (default: rate)')
+    batch_parser.add_argument('--max_in_flight', type=int, default=None,
+                            help='Maximum concurrent requests to the GPM host')
 
-    # Logging setup
-    loglevel = getattr(logging, args.loglevel.upper(), logging.INFO)
-    logging.basicConfig(level=loglevel, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-    logger = logging.getLogger(__name__)
-    logger.setLevel(loglevel)
+    # Operation: sync
+    sync_parser = subparsers.add_parser('sync',
+                                help='Incrementally sync every datasource of a plant since its last watermark')
+    sync_parser.add_argument('plant_id', type=int, nargs='?', default=None,
+                            help='ID of the plant')
+    sync_parser.add_argument('--overlap', type=int, default=30,
+                            help='Minutes to refetch before each watermark for late values (default: 30)')
+    sync_parser.add_argument('--lookback', type=int, default=24,
+                            help='Hours to fetch for datasources without a watermark (default: 24)')
+
+    # Operation: backfill
+    backfill_parser = subparsers.add_parser('backfill',
+                                help='Resumable long-range datalistv2 downloads')
+    backfill_subparsers = backfill_parser.add_subparsers(dest='action', required=True)
+    backfill_start = backfill_subparsers.add_parser('start', help='Plan a new backfill job and run it')
+    backfill_start.add_argument('plant_id', type=int, help='ID of the plant')
+    backfill_start.add_argument('startDate', type=str, help='Start date in YYYY-MM-DDTHH:MM:SS format')
+    backfill_start.add_argument('endDate', type=str, help='End date in YYYY-MM-DDTHH:MM:SS format')
+    backfill_start.add_argument('--dataSourceIds', type=str, default=None,
+                            help='Comma-separated datasource IDs (default: every datasource of the plant)')
+    backfill_start.add_argument('--grouping', type=str, default=None,
+                            help='Grouping type (default: from config, or minute)')
+    backfill_start.add_argument('--granularity', type=int, default=None,
+                            help='Granularity (default: from config, or 5)')
+    backfill_start.add_argument('--aggregationType', type=int, default=None,
+                            help='Aggregation type (default: from config, or 1)')
+    backfill_start.add_argument('--max_rows', type=int, default=50000,
+                            help='Records per shard (default: 50000)')
+    backfill_start.add_argument('--job', type=str, default=None,
+                            help='Job ID (default: plant<id>-<timestamp>)')
+    backfill_resume = backfill_subparsers.add_parser('resume', help='Continue a backfill job where it stopped')
+    backfill_resume.add_argument('job', type=str, help='Job ID')
+    for backfill_run in (backfill_start, backfill_resume):
+        backfill_run.add_argument('--workers', type=int, default=4,
+                            help='Shards downloaded at the same time (default: 4)')
+        backfill_run.add_argument('--adaptive', action='store_true',
+                            help='Adapt the requests in flight (up to --workers) to the\n'
+                                 'server latency and throttling')
+    backfill_status = backfill_subparsers.add_parser('status', help='Show the progress of a backfill job')
+    backfill_status.add_argument('job', type=str, help='Job ID')
+    backfill_subparsers.add_parser('list', help='List the backfill jobs')
+
+    # Operation: serve
+    serve_parser = subparsers.add_parser('serve',
+                                help='Keep an authenticated consumer warm and run the commands\n'
+                                     'of other gpm-cli invocations over a Unix socket')
+    serve_parser.add_argument('--idle_timeout', type=int, default=None,
+                            help='Stop after this many seconds without commands')
+    serve_action = serve_parser.add_mutually_exclusive_group()
+    serve_action.add_argument('--status', action='store_true', help='Show the running daemon')
+    serve_action.add_argument('--stop', action='store_true', help='Stop the running daemon')
+
+    return parser
+
+
+def handle_config(args, parser):
+    # Only the config file is needed: no consumer, no env, no network
+    from gpm_api_consumer.core.settings import gpm_config_manager
+    config_manager = gpm_config_manager()
+    if args.action == 'set':
+        print(f"Set config: {args.pairs}")
+        if len(args.pairs) % 2 != 0:
+            print("Error: You must provide an even number of arguments (key value pairs).")
+            return
+        for i in range(0, len(args.pairs), 2):
+            key = args.pairs[i]
+            value = args.pairs[i + 1]
+            config_manager.set(key, value)
+        print("Config set successfully.")
+    elif args.action == 'show':
+        config_manager.show_config()
+    elif args.action == 'reset':
+        config_manager._reset_config(args.keys)
+        print("Config reset successfully.")
+    else:
+        print(f"Usage: {parser.format_help()}")
 
-    operator = GPMOperator()
-    if args.operation != 'config':
-        operator.check_auth()
-
-    if args.operation == 'config':
-        if args.action == 'set':
-            print(f"Set config: {args.pairs}")
-            if len(args.pairs) % 2 != 0:
-                print("Error: You must provide an even number of arguments (key value pairs).")
-                return
-            for i in range(0, len(args.pairs), 2):
-                key = args.pairs[i]
-                value = args.pairs[i + 1]
-                operator.consumer.config_manager.set(key, value)
-            print("Config set successfully.")
-        elif args.action == 'show':
-            operator.consumer.config_manager.show_config()
-        elif args.action == 'reset':
-            operator.consumer.config_manager._reset_config(args.keys)
-            print("Config reset successfully.")
+
+def handle_cache(args, parser):
+    from gpm_api_consumer.core.Cache import DataListCache
+    cache = DataListCache()
+    if args.action == 'stats':
+        print(json.dumps(cache.stats(), indent=4))
+    elif args.action == 'clear':
+        cache.clear()
+        print("Cache cleared successfully.")
+    cache.close()
+
+
+def handle_topology(args, parser):
+    # Served from the local store; the API is only hit when it is stale
+    from gpm_api_consumer.core.Consumers import GPMConsumer
+    from gpm_api_consumer.core.Sharding import DATASOURCE_KEY
+    from gpm_api_consumer.core.Topology import TopologyStore
+    consumer = shared('consumer', GPMConsumer)
+    store = shared('topology', lambda: TopologyStore(consumer))
+    store.ttl = args.ttl
+    if args.action == 'refresh':
+        entry = store.refresh(args.plant)
+        print(f"Topology of plant {args.plant} refreshed: {len(entry['elements'])} elements.")
+    elif args.action == 'lookup':
+        result = store.lookup(args.plant, element_type=args.element_type, signal=args.signal)
+        if args.ids:
+            result = [ds[DATASOURCE_KEY] for ds in result]
+        emit(args, f"Datasources of plant {args.plant} (element type {args.element_type}, signal {args.signal}):",
+             result, plant_id=args.plant)
+    elif args.action == 'types':
+        emit(args, f"Element types of plant {args.plant}:", store.element_types(args.plant))
+    elif args.action == 'clear':
+        store.invalidate(args.plant)
+        print("Topology cleared successfully.")
+
+
+def handle_backfill(args, parser):
+    from gpm_api_consumer.core.Backfill import BackfillJob, list_jobs
+    if args.action == 'list':
+        print(json.dumps([BackfillJob(job).status() for job in list_jobs()], indent=4))
+        return
+    if args.action == 'status':
+        print(json.dumps(BackfillJob(args.job).status(), indent=4))
+        return
+
+    from gpm_api_consumer.core.Consumers import GPMConsumer
+    from gpm_api_consumer.core.Sharding import DATASOURCE_KEY, ShardPlanner
+    adaptive = False
+    if args.adaptive:
+        from gpm_api_consumer.core.Adaptive import AdaptiveController
+        adaptive = AdaptiveController(initial=min(4, args.workers), max_limit=args.workers)
+    consumer = GPMConsumer(auto_refresh=True, adaptive=adaptive)
+    try:
+        if args.action == 'start':
+            config = consumer.config_manager
+            datasource_ids = args.dataSourceIds or [
+                ds[DATASOURCE_KEY] for ds in consumer.datasources(args.plant_id)]
+            params = {
+                'startDate': args.startDate,
+                'endDate': args.endDate,
+                'grouping': args.grouping or config.get('grouping') or 'minute',
+                'granularity': args.granularity or config.get('granularity') or 5,
+                'aggregationType': next(v for v in (args.aggregationType, config.get('aggregationType'), 1)
+                                        if v is not None),
+            }
+            job = BackfillJob.create(args.plant_id, datasource_ids, params,
+                                     planner=ShardPlanner(max_rows=args.max_rows),
+                                     fmt=args.format or 'ndjson', job_id=args.job)
+            print(f"Backfill job {job.id} created with {len(job.shards)} shards.")
         else:
-            print(f"Usage: {parser.format_help()}")
-    elif args.operation == 'plants':
+            job = BackfillJob(args.job)
+        status = job.run(consumer, max_workers=args.workers)
+    except KeyboardInterrupt:
+        # Finished shards are journaled; `backfill resume` picks up the rest
+        return 130
+    finally:
+        consumer.close()
+    print(json.dumps(status, indent=4))
+    return 0 if status['state'] == 'complete' else 1
+
+
+def handle_serve(args, parser):
+    from gpm_api_consumer.daemon import Daemon, control
+    if args.status or args.stop:
+        answer = control('stop' if args.stop else 'ping')
+        if answer is None:
+            print("No gpm-cli daemon is running.")
+            return 1
+        print(json.dumps(answer, indent=4))
+        return 0
+    try:
+        Daemon(idle_timeout=args.idle_timeout).serve_forever()
+    except KeyboardInterrupt:
+        pass
+    except RuntimeError as e:
+        logging.getLogger(__name__).error(str(e))
+        return 1
+    return 0
+
+
+def handle_operation(args, parser):
+    '''
+    Operations served through GPMOperator.
+    '''
+    from gpm_api_consumer.core.Operators import GPMOperator
+    logger = logging.getLogger(__name__)
+
+    with profiling.stage('consumer_init'):
+        operator = shared('operator', GPMOperator)
+    if not operator.consumer.tokens.is_valid():
+        # The cached token is checked locally; only round-trip when unknown or expiring
+        with profiling.stage('auth'):
+            operator.check_auth()
+
+    if args.operation == 'plants':
         plants = operator.handle_plants()
-        print("Plants:")
-        print(json.dumps(plants, indent=4))
+        emit(args, "Plants:", plants)
 
     elif args.operation == 'plant_detail':
         kwargs = operator.args_handler(args, ['plant_id'])
         result = operator.handle_plant_details(**kwargs)
-        print(f"Details of plant {kwargs['plant_id']}:")
-        print(json.dumps(result, indent=4))
+        emit(args, f"Details of plant {kwargs['plant_id']}:", result, plant_id=kwargs['plant_id'])
 
     elif args.operation == 'elements':
         kwargs = operator.args_handler(args, ['plant_id'])
         result, element_types = operator.handle_elements(**kwargs)
-        print(f"Elements in plant {kwargs['plant_id']}:")
+        title = f"Elements in plant {kwargs['plant_id']}:"
         for element_type in element_types:
-            print(f"\t{element_type}")
-        print(json.dumps(result, indent=4))
+            title += f"\n\t{element_type}"
+        emit(args, title, result, plant_id=kwargs['plant_id'])
 
     elif args.operation == 'element_detail':
         kwargs = operator.args_handler(args, ['plant_id', 'element_id'])
         result = operator.handle_element_details(**kwargs)
-        print(f"Details of element {kwargs['element_id']} in plant {kwargs['plant_id']}:")
-        print(json.dumps(result, indent=4))
+        emit(args, f"Details of element {kwargs['element_id']} in plant {kwargs['plant_id']}:", result, plant_id=kwargs['plant_id'])
 
     elif args.operation == 'datasources':
         kwargs = operator.args_handler(args, ['plant_id', 'element_id', 'signals'])
         result = operator.handle_datasources(**kwargs)
-        print(f"Datasources of signals {kwargs['signals']} in plant {kwargs['plant_id']} and element {kwargs['element_id']}:")
-        print(json.dumps(result, indent=4))
+        emit(args, f"Datasources of signals {kwargs['signals']} in plant {kwargs['plant_id']} and element {kwargs['element_id']}:", result, plant_id=kwargs['plant_id'])
 
     elif args.operation == 'plant_datasources':
         kwargs = operator.args_handler(args, ['plant_id', 'signals'])
         result = operator.handle_datasources(**kwargs)
-        print(f"Datasources of signals {kwargs['signals']} in plant {kwargs['plant_id']}:")
-        print(json.dumps(result, indent=4))
+        emit(args, f"Datasources of signals {kwargs['signals']} in plant {kwargs['plant_id']}:", result, plant_id=kwargs['plant_id'])
 
     elif args.operation == 'datasources_map':
         kwargs = operator.args_handler(args, ['plant_id', 'table'])
         result = operator.handle_datasources_map(**kwargs)
-        print(f"Datasources map for table {kwargs['table']} in plant {kwargs['plant_id']}:")
-        print(json.dumps(result, indent=4))
+        emit(args, f"Datasources map for table {kwargs['table']} in plant {kwargs['plant_id']}:", result, plant_id=kwargs['plant_id'])
 
     elif args.operation == 'datalistv2':
         kwargs = operator.args_handler(args, ['dataSourceIds', 'startDate',
                         'endDate', 'grouping', 'granularity', 'aggregationType'])
-        result = operator.handle_datalistv2(**kwargs)
-        print(f"Datalistv2 with dataSourceIds {kwargs['dataSourceIds']}, startDate {kwargs['startDate']}, endDate {kwargs['endDate']}, grouping {kwargs['grouping']}, granularity {kwargs['granularity']} and aggregationType {kwargs['aggregationType']}:")
-        print(json.dumps(result, indent=4))
+        if args.cache:
+            result = operator.consumer.datalistv2_cached(params=kwargs)
+        elif args.output:
+            # Stream batches straight into the sink instead of building the list
+            result = operator.consumer.datalistv2(params=kwargs, stream=True,
+                                                  chunk_size=args.batch_size)
+        else:
+            result = operator.handle_datalistv2(**kwargs)
+        plant_id = operator.consumer.config_manager.get('plant_id')
+        if args.store:
+            from gpm_api_consumer.core.ResultStore import ResultStore
+            from gpm_api_consumer.core.Sharding import step_seconds
+            if plant_id is None:
+                logger.error("--store needs the plant of the datasources: set it with `config set plant_id <id>`")
+                return 1
+            store = ResultStore()
+            step = store.check_step(step_seconds(kwargs['grouping'], kwargs['granularity']))
+            if args.output and not args.cache:
+                # Streamed batches are stored as they go to the sink
+                result = store.tee(plant_id, result, step)
+            else:
+                rows = store.write(plant_id, result, step)
+                logger.info(f"{rows} samples stored for plant {plant_id} in {store.root}")
+        emit(args, f"Datalistv2 with dataSourceIds {kwargs['dataSourceIds']}, startDate {kwargs['startDate']}, endDate {kwargs['endDate']}, grouping {kwargs['grouping']}, granularity {kwargs['granularity']} and aggregationType {kwargs['aggregationType']}:", result,
+             plant_id=plant_id)
 
     elif args.operation == 'plant_data_pipeline':
         arg_keys = []
@@ -199,8 +515,158 @@ def main():
         arg_keys += ['startDate', 'endDate']
         kwargs = operator.args_handler(args, arg_keys)
         result = operator.handle_plant_id_name_data_pipeline(**kwargs)
-        print(f"Full data pipeline with startDate {kwargs['startDate']} and endDate {kwargs['endDate']}:")
-        print(json.dumps(result, indent=4))
+        emit(args, f"Full data pipeline with startDate {kwargs['startDate']} and endDate {kwargs['endDate']}:", result,
+             plant_id=kwargs.get('plant_id') or kwargs.get('plant_name'))
+
+    elif args.operation == 'plant_data_pipeline_batch':
+        kwargs = operator.args_handler(args, ['startDate', 'endDate'])
+        if args.plant_ids:
+            plants, key = [int(v) for v in args.plant_ids.split(',')], 'plant_id'
+        elif args.plant_names:
+            plants, key = [v.strip() for v in args.plant_names.split(',')], 'plant_name'
+        else:
+            plants, key = None, 'plant_id'
+        from gpm_api_consumer.core.Batch import BatchRunner
+        runner = BatchRunner(
+            operator.consumer,
+            lambda plant: operator.handle_plant_id_name_data_pipeline(**{key: plant}, **kwargs),
+            max_workers=args.workers, rate=args.rate, burst=args.burst,
+            max_in_flight=args.max_in_flight,
+        )
+        summary = []
+        for plant_result in runner.run(plants):
+            summary.append(plant_result.summary())
+            if plant_result.ok:
+                emit(args, f"Full data pipeline of plant {plant_result.plant} with startDate {kwargs['startDate']} and endDate {kwargs['endDate']}:",
+                     plant_result.result, plant_id=plant_result.plant)
+        failed = [item for item in summary if item['status'] != 'ok']
+        print(f"Batch finished: {len(summary) - len(failed)} succeeded, {len(failed)} failed.")
+        print(json.dumps(summary, indent=4))
+        return 1 if failed else 0
+
+    elif args.operation == 'sync':
+        from datetime import timedelta
+        from gpm_api_consumer.core.Sharding import DATASOURCE_KEY
+        from gpm_api_consumer.core.Sync import IncrementalSync
+        kwargs = operator.args_handler(args, ['plant_id'])
+        consumer = operator.consumer
+        config = consumer.config_manager
+        datasource_ids = [ds[DATASOURCE_KEY] for ds in consumer.datasources(kwargs['plant_id'])]
+        sync = IncrementalSync(
+            consumer,
+            grouping=config.get('grouping') or 'minute',
+            granularity=config.get('granularity') or 5,
+            aggregationType=config.get('aggregationType') if config.get('aggregationType') is not None else 1,
+            overlap=timedelta(minutes=args.overlap),
+            initial_lookback=timedelta(hours=args.lookback),
+        )
+        if args.output:
+            from gpm_api_consumer.core.Sinks import open_sink
+            sink = open_sink(args.output, args.format, plant_id=kwargs['plant_id'])
+            try:
+                summary = sync.run(datasource_ids, sink=sink.write_batch, commit=sink.commit)
+            except BaseException:
+                sink.abort()
+                raise
+            logger.info(f"Sync summary: {json.dumps(summary)}")
+            logger.info(f"{sink.rows} rows written to {args.output}")
+            return
+        result = []
+        # The records are printed before the watermarks move past them
+        summary = sync.run(datasource_ids, sink=result.extend, commit=lambda: emit(
+            args, f"Incremental sync of {len(datasource_ids)} datasources in plant {kwargs['plant_id']}:",
+            result, plant_id=kwargs['plant_id']))
+        logger.info(f"Sync summary: {json.dumps(summary)}")
+
+
+# Handlers of the operations that don't need a GPMOperator
+HANDLERS = {
+    'config': handle_config,
+    'cache': handle_cache,
+    'topology': handle_topology,
+    'backfill': handle_backfill,
+    'serve': handle_serve,
+}
+
+
+def forwardable(args):
+    '''
+    Whether this command may run on a `serve` daemon instead of here.
+    '''
+    if args.operation in LOCAL_OPERATIONS or args.operation in UNFORWARDED_OPERATIONS:
+        return False
+    # Profiles describe this process, so --profile runs stay here
+    return (not args.interactive and not args.no_daemon and not args.profile
+            and not os.environ.get('GPM_NO_DAEMON'))
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+
+    if forwardable(args):
+        from gpm_api_consumer.daemon import forward
+        for option in PATH_OPTIONS:
+            value = getattr(args, option)
+            if value and value != '-':
+                setattr(args, option, os.path.abspath(value))
+        code = forward(args)
+        if code is not None:
+            return code
+
+    # Logging setup
+    loglevel = getattr(logging, args.loglevel.upper(), logging.INFO)
+    logging.basicConfig(level=loglevel, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    logger = logging.getLogger(__name__)
+    logger.setLevel(loglevel)
+
+    return run(args, parser)
+
+
+def run(args, parser):
+    '''
+    Run a parsed command, here or on behalf of another invocation in the daemon.
+    '''
+    if args.profile:
+        from gpm_api_consumer.utils.profiling import StageProfiler
+        with StageProfiler(args.profile):
+            return _run(args, parser)
+    return _run(args, parser)
+
+
+def _dispatch(args, parser):
+    handler = HANDLERS.get(args.operation, handle_operation)
+    with profiling.stage(f'dispatch:{args.operation}'):
+        return handler(args, parser)
+
+
+def _run(args, parser):
+    if not (args.metrics or args.trace):
+        return _dispatch(args, parser)
+
+    from gpm_api_consumer.core.Client import APIClient
+    from gpm_api_consumer.core.Metrics import MetricsCollector, RequestTracer
+    hooks = []
+    collector = MetricsCollector() if args.metrics else None
+    if collector is not None:
+        hooks.append(collector)
+    trace_file = open(args.trace, 'a') if args.trace else None
+    if trace_file is not None:
+        hooks.append(RequestTracer(trace_file))
+    try:
+        # Scoped to this command: the daemon runs several at the same time
+        with APIClient.hooked(*hooks):
+            return _dispatch(args, parser)
+    finally:
+        if trace_file is not None:
+            trace_file.close()
+        if collector is not None:
+            report = collector.to_json() if args.metrics == 'json' else collector.to_prometheus()
+            if args.metrics_file:
+                with open(args.metrics_file, 'w') as file:
+                    file.write(report)
+            else:
+                sys.stderr.write(report + '\n')
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
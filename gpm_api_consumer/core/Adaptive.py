@@ -0,0 +1,196 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from .Metrics import endpoint_template
+from .Sharding import ShardPlanner
+
+logger = logging.getLogger(__name__)
+
+
+class AdaptiveController:
+    '''
+    AIMD limit on the requests in flight against the GPM host.
+    Acts as the APIClient limiter (slot()) and as a request hook, so every
+    response adjusts the limit: it grows by about one request per round of
+    successful, fast responses, and is cut by `decrease` on throttling
+    (429, including the ones urllib3 retried), server errors, timeouts or
+    a time to first byte above `latency_factor` times the baseline of the
+    endpoint and payload size. Only one cut is applied per `cooldown` seconds, so a burst of
+    slow responses to the same overload counts once.
+    `limiter` is an optional RequestLimiter applied inside the slot.
+    '''
+
+    def __init__(self, initial=4, min_limit=1, max_limit=32, decrease=0.5,
+                 latency_factor=2.0, latency_floor=0.05, cooldown=1.0, limiter=None):
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.decrease = decrease
+        self.latency_factor = latency_factor
+        self.latency_floor = latency_floor
+        self.cooldown = cooldown
+        self.limiter = limiter
+        self.in_flight = 0
+        self.increases = 0
+        self.decreases = 0
+        self.client = None
+        self._baselines = {}
+        self._last_decrease = 0.0
+        self._condition = threading.Condition()
+
+    def attach(self, client):
+        '''
+        Gate and observe every request of an APIClient.
+        '''
+        if client.limiter is not None and self.limiter is None:
+            self.limiter = client.limiter
+        client.limiter = self
+        client.hooks.append(self)
+        self.client = client
+        self._publish()
+        return self
+
+    @contextmanager
+    def slot(self):
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                self._condition.wait()
+            self.in_flight += 1
+        try:
+            with self.limiter.slot() if self.limiter is not None else nullcontext():
+                yield
+        finally:
+            with self._condition:
+                self.in_flight -= 1
+                self._condition.notify()
+
+    def __call__(self, event, data):
+        if event != 'request':
+            return
+        status = data.get('status')
+        if data.get('throttled') or status == 429:
+            reason = 'throttled'
+        elif status is None or status >= 500:
+            reason = data.get('error') or f'status {status}'
+        else:
+            reason = self._slow(data)
+        if reason:
+            self._on_congestion(reason)
+        elif status < 400:
+            self._on_success()
+
+    def _slow(self, data):
+        '''
+        Compare the time to first byte with a slowly rising minimum of the
+        endpoint for payloads of that size (within a factor of 4), so bigger
+        responses being slower to produce and download don't count.
+        '''
+        latency = data.get('headers')
+        if latency is None:
+            return None
+        size_class = int(data.get('bytes') or 0).bit_length() // 2
+        key = (data.get('method'), endpoint_template(data.get('endpoint', '')), size_class)
+        with self._condition:
+            baseline = self._baselines.get(key)
+            if baseline is None or latency < baseline:
+                self._baselines[key] = latency
+                return None
+            # Let the baseline follow a server that got durably slower
+            self._baselines[key] = baseline + 0.01 * (latency - baseline)
+        threshold = max(baseline * self.latency_factor, baseline + self.latency_floor)
+        return f'latency {latency:.3f}s > {threshold:.3f}s' if latency > threshold else None
+
+    def _on_success(self):
+        with self._condition:
+            if self.in_flight + 1 < int(self.limit):
+                # The limit is not what holds requests back: don't grow it
+                return
+            previous = int(self.limit)
+            self.limit = min(self.max_limit, self.limit + 1.0 / max(self.limit, 1.0))
+            grown = int(self.limit) > previous
+            if grown:
+                self.increases += 1
+                self._condition.notify_all()
+        if grown:
+            logger.debug(f"Adaptive concurrency raised to {int(self.limit)}")
+            self._publish(increases=1)
+
+    def _on_congestion(self, reason):
+        now = time.monotonic()
+        with self._condition:
+            if now - self._last_decrease < self.cooldown:
+                return
+            self._last_decrease = now
+            previous = int(self.limit)
+            self.limit = max(float(self.min_limit), self.limit * self.decrease)
+            self.decreases += 1
+        logger.info(f"Adaptive concurrency {previous} -> {int(self.limit)} ({reason})")
+        self._publish(decreases=1)
+
+    def _publish(self, **counters):
+        if self.client is None:
+            return
+        if counters:
+            self.client.emit('adaptive', **counters)
+        self.client.emit('gauge', adaptive_concurrency_limit=int(self.limit))
+
+    def stats(self):
+        with self._condition:
+            return {
+                'limit': int(self.limit),
+                'in_flight': self.in_flight,
+                'increases': self.increases,
+                'decreases': self.decreases,
+            }
+
+
+class AdaptivePlanner(ShardPlanner):
+    '''
+    ShardPlanner whose window size follows the measured downloads.
+    `max_rows` is cut by `decrease` when a shard fails, and scaled down
+    when a shard takes longer than `target_seconds`; it grows by
+    `increase` of its initial value while full shards come back faster than
+    the target. It stays within [min_rows, max_rows_limit].
+    '''
+
+    def __init__(self, max_rows=50000, max_datasources=100, raw_interval=60,
+                 target_seconds=10.0, min_rows=1000, max_rows_limit=500000,
+                 increase=0.1, decrease=0.5, client=None):
+        super().__init__(max_rows, max_datasources, raw_interval)
+        self.target_seconds = target_seconds
+        self.min_rows = min_rows
+        self.max_rows_limit = max_rows_limit
+        self.step = max(1, int(max_rows * increase))
+        self.decrease = decrease
+        self.client = client
+        self._lock = threading.Lock()
+
+    def observe(self, shard, rows, seconds, error=None):
+        with self._lock:
+            previous = self.max_rows
+            if error is not None:
+                self.max_rows = int(self.max_rows * self.decrease)
+                reason = type(error).__name__
+            elif seconds > self.target_seconds * 1.5:
+                self.max_rows = int(self.max_rows * self.target_seconds / seconds)
+                reason = f'{rows} rows in {seconds:.1f}s'
+            elif rows >= 0.8 * previous and seconds < self.target_seconds:
+                self.max_rows += self.step
+                reason = None
+            else:
+                return
+            self.max_rows = min(self.max_rows_limit, max(self.min_rows, self.max_rows))
+            current = self.max_rows
+        if current == previous:
+            return
+        if reason:
+            logger.info(f"Adaptive shard size {previous} -> {current} rows ({reason})")
+        else:
+            logger.debug(f"Adaptive shard size raised to {current} rows")
+        if self.client is not None:
+            self.client.emit('gauge', adaptive_shard_rows=current)
+
+    def window_size(self, params, n_datasources):
+        with self._lock:
+            return super().window_size(params, n_datasources)
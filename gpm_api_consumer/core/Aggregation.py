@@ -0,0 +1,131 @@
+import logging
+from datetime import datetime
+from zoneinfo import ZoneInfo
+from .Frames import DataListFrame, np, require_numpy
+from .Sharding import GROUPING_SECONDS, step_seconds
+
+logger = logging.getLogger(__name__)
+
+# datalistv2 aggregationType codes and the frame reduction reproducing each
+AGGREGATION_TYPES = {
+    0: 'sum_nonzero',   # sum without zeros: buckets with only zeros are empty
+    1: 'mean',          # average of the valid samples
+}
+
+# Monday 1970-01-05 in epoch seconds, where week buckets start
+WEEK_ORIGIN = 4 * 86400
+
+# Seconds between UTC offset lookups; every DST rule in use changes on a
+# quarter of an hour
+OFFSET_RESOLUTION = 900
+
+
+def reduction(aggregation_type):
+    '''
+    Frame reduction matching a datalistv2 aggregationType code.
+    '''
+    try:
+        return AGGREGATION_TYPES[int(aggregation_type)]
+    except (KeyError, TypeError, ValueError):
+        raise ValueError(f"Unsupported aggregationType {aggregation_type!r}, "
+                         f"expected one of {sorted(AGGREGATION_TYPES)}")
+
+
+def local_timestamps(timestamps, tz):
+    '''
+    Convert UTC epoch seconds to wall-clock epoch seconds in `tz`
+    (a zone name or tzinfo). Offsets are looked up once per distinct
+    quarter of an hour instead of once per sample.
+    '''
+    require_numpy()
+    tz = ZoneInfo(tz) if isinstance(tz, str) else tz
+    timestamps = np.asarray(timestamps, dtype=np.int64)
+    slots, inverse = np.unique(timestamps // OFFSET_RESOLUTION, return_inverse=True)
+    offsets = np.fromiter(
+        (datetime.fromtimestamp(int(slot) * OFFSET_RESOLUTION, tz).utcoffset().total_seconds()
+         for slot in slots),
+        dtype=np.int64, count=len(slots))
+    return timestamps + offsets[inverse]
+
+
+def bucket_starts(timestamps, grouping, granularity=1, tz=None):
+    '''
+    Start of the datalistv2 bucket of every timestamp, as wall-clock epoch
+    seconds. Timestamps are plant local time like the API dates, unless `tz`
+    is given, in which case they are UTC and buckets follow `tz` local time
+    (so days have 23 or 25 hours across DST changes).
+    Minute and hour buckets restart at midnight, weeks start on Monday and
+    months follow the calendar.
+    '''
+    require_numpy()
+    timestamps = np.asarray(timestamps, dtype=np.int64)
+    if tz is not None:
+        timestamps = local_timestamps(timestamps, tz)
+    grouping = (grouping or 'raw').lower()
+    granularity = int(granularity or 1)
+    if grouping == 'raw':
+        return timestamps
+    if grouping == 'month':
+        months = timestamps.astype('datetime64[s]').astype('datetime64[M]').astype(np.int64)
+        months = months // granularity * granularity
+        return months.astype('datetime64[M]').astype('datetime64[s]').astype(np.int64)
+    step = step_seconds(grouping, granularity)
+    if grouping == 'week':
+        return (timestamps - WEEK_ORIGIN) // step * step + WEEK_ORIGIN
+    if grouping == 'day':
+        return timestamps // step * step
+    days = timestamps // 86400 * 86400
+    return days + (timestamps - days) // step * step
+
+
+def aggregate(frame, grouping, granularity=1, aggregationType=1, tz=None):
+    '''
+    Aggregate a DataListFrame the way datalistv2 does for the given
+    grouping, granularity and aggregationType. Buckets are labelled by
+    their (wall-clock) start.
+    '''
+    how = reduction(aggregationType)
+    if not len(frame):
+        return DataListFrame.empty()
+    return frame.reduce_buckets(bucket_starts(frame.timestamps, grouping, granularity, tz), how)
+
+
+def check_derivable(source, target):
+    '''
+    Raise ValueError unless the `target` query (grouping, granularity,
+    aggregationType) can be computed from data fetched with `source`.
+    '''
+    source_how = reduction(source.get('aggregationType', 1))
+    target_how = reduction(target.get('aggregationType', 1))
+    source_grouping = (source.get('grouping') or 'raw').lower()
+    if source_grouping != 'raw' and source_how != target_how:
+        raise ValueError(f"Cannot derive '{target_how}' buckets from '{source_how}' ones")
+    if source_grouping == 'raw':
+        return
+    source_step = step_seconds(source_grouping, source.get('granularity'))
+    target_grouping = (target.get('grouping') or 'raw').lower()
+    if target_grouping == 'raw':
+        raise ValueError("Cannot derive raw data from grouped data")
+    if target_grouping == 'month':
+        # Months are made of whole days
+        target_step = GROUPING_SECONDS['day']
+    else:
+        target_step = step_seconds(target_grouping, target.get('granularity'))
+    if target_step % source_step:
+        raise ValueError(f"{target_grouping} x{target.get('granularity') or 1} buckets are not "
+                         f"made of whole {source_grouping} x{source.get('granularity') or 1} buckets")
+
+
+def derive(frame, source, target, tz=None):
+    '''
+    Compute the `target` view (a dict with grouping, granularity and
+    aggregationType) of a frame fetched with the `source` query, instead of
+    downloading it again.
+    Averages of grouped data are averages of bucket averages, which match
+    the server when the buckets hold the same number of samples; derive
+    from raw data when they don't.
+    '''
+    check_derivable(source, target)
+    logger.debug(f"Deriving {target} from {source} locally")
+    return aggregate(frame, target.get('grouping'), target.get('granularity'),
+                     target.get('aggregationType', 1), tz=tz)
@@ -0,0 +1,68 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from gpm_api_consumer.utils import bind_context
+from .Client import APIClient
+
+
+class AsyncAPIClient:
+    '''
+    Asyncio counterpart of APIClient.
+    Requests run on a dedicated thread pool over a single pooled session, and
+    a semaphore bounds how many of them are in flight at the same time.
+    '''
+
+    def __init__(self, base_url, max_concurrency=16, **client_options):
+        self.base_url = base_url
+        self.max_concurrency = max_concurrency
+        client_options.setdefault('pool_size', max_concurrency)
+        self.client = APIClient(base_url, **client_options)
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency,
+                                            thread_name_prefix='gpm-async')
+        self._semaphore = None
+
+    @property
+    def semaphore(self):
+        # Created lazily so it binds to the running event loop
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    def emit(self, event, **data):
+        self.client.emit(event, **data)
+
+    async def run(self, func, *args, **kwargs):
+        '''
+        Call the blocking `func` on the worker threads, within the
+        concurrency limit and the caller's context (e.g. APIClient.hooked).
+        '''
+        loop = asyncio.get_running_loop()
+        async with self.semaphore:
+            return await loop.run_in_executor(self._executor,
+                                              bind_context(partial(func, *args, **kwargs)))
+
+    async def get(self, endpoint, headers=None, params=None, timeout=None):
+        return await self.run(self.client.get, endpoint, headers=headers,
+                              params=params, timeout=timeout)
+
+    async def post(self, endpoint, json=None, headers=None, timeout=None):
+        return await self.run(self.client.post, endpoint, json=json,
+                              headers=headers, timeout=timeout)
+
+    async def close(self):
+        '''
+        Release the pooled connections and the worker threads.
+        The requests still running are waited for without blocking the loop.
+        '''
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, partial(self._executor.shutdown, wait=True))
+        self.client.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    def __str__(self):
+        return f"AsyncAPIClient with base URL: {self.base_url}"
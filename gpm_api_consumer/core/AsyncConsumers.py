@@ -0,0 +1,135 @@
+import asyncio
+from .AsyncClient import AsyncAPIClient
+from .settings import GPM_CONFIG_KEYS, gpm_config_manager
+from .TokenManager import TokenManager
+from gpm_api_consumer.utils.decorators import handle_authentication_async
+
+
+class AsyncGPMConsumer:
+    '''
+    Asyncio API Consumer for GPM (Green Power Monitor) API.
+    Same endpoints as GPMConsumer, meant to fan out many requests concurrently.
+    Tokens come from the same TokenManager (and token cache) as GPMConsumer's;
+    its blocking calls run on the client's worker threads.
+    '''
+
+    configKeys = GPM_CONFIG_KEYS
+
+    def __init__(self, prefix='gpm', max_concurrency=16, auto_refresh=False, **client_options):
+        self.config_manager = gpm_config_manager(prefix)
+        self.client = AsyncAPIClient(self.config_manager._env['API_BASE_URL'],
+                                     max_concurrency=max_concurrency,
+                                     **client_options)
+        self.tokens = TokenManager(self, background=auto_refresh, login=self._login)
+
+    @property
+    def token(self):
+        return self.tokens.token
+
+    def _authorized(self, method, endpoint, **kwargs):
+        # Runs on a worker thread, where refreshing the token may block
+        headers = { 'Authorization': f'Bearer {self.tokens.get_token()}' }
+        return method(endpoint, headers=headers, **kwargs)
+
+    @handle_authentication_async
+    async def get(self, endpoint, params=None):
+        '''
+        Get data from the GPM API.
+        '''
+        return await self.client.run(self._authorized, self.client.client.get, endpoint,
+                                     params=params)
+
+    @handle_authentication_async
+    async def post(self, endpoint, data=None):
+        '''
+        Post data to the GPM API.
+        '''
+        return await self.client.run(self._authorized, self.client.client.post, endpoint,
+                                     json=data)
+
+    def _login(self):
+        username = self.config_manager._env['API_USERNAME']
+        password = self.config_manager._env['API_PASSWORD']
+        data = { 'username': username, 'password': password }
+        # Don't use existing token for login request
+        response = self.client.client.post('/api/Account/Token', json=data)
+
+        if response and 'AccessToken' in response:
+            self.config_manager.set('api_token', response['AccessToken'])
+            return response['AccessToken']
+        else:
+            raise Exception("Failed to login and get token.")
+
+    async def login(self):
+        '''
+        Login to the API and get a token.
+        '''
+        return await self.refresh_token(self.token)
+
+    async def refresh_token(self, stale_token):
+        '''
+        Login again unless another task already replaced `stale_token`.
+        Concurrent 401s wait on the token manager's lock, so only the first
+        one logs in.
+        '''
+        return await self.client.run(self.tokens.refresh, stale_token=stale_token)
+
+    async def ping(self):
+        '''
+        Check if the API is reachable and the token is valid.
+        '''
+        return await self.get('/api/Account/Ping')
+
+    async def datalistv2(self, params=None):
+        '''
+        Get the list of data from the API.
+        '''
+        return await self.get('/api/DataList/v2', params=params)
+
+    async def plant(self, plant_id=None, params=None):
+        '''
+        Get the plants data from the API. Or get a specific plant by ID.
+        '''
+        return await (self.get(f'/api/Plant/{plant_id}', params=params) if
+                      plant_id else self.get('/api/Plant', params=params))
+
+    async def element(self, plant_id, element_id=None, params=None):
+        '''
+        Get the elements data for a specific plant. Or get a specific element by ID.
+        '''
+        return await (self.get(f'/api/Plant/{plant_id}/Element/{element_id}', params=params) if
+                      element_id else self.get(f'/api/Plant/{plant_id}/Element', params=params))
+
+    async def datasources(self, plant_id, element_id=None, params=None):
+        '''
+        Get the data source for an element or plant.
+        '''
+        return await (self.get(f'/api/Plant/{plant_id}/Element/{element_id}/Datasource', params=params) if
+                      element_id else self.get(f'/api/Plant/{plant_id}/Datasource', params=params))
+
+    async def crawl_plant(self, plant_id, id_key='Id'):
+        '''
+        Fetch every element of a plant together with its datasources.
+        Element details and datasources are requested concurrently.
+        '''
+        elements = await self.element(plant_id) or []
+        element_ids = [element[id_key] for element in elements]
+        details = asyncio.gather(*(self.element(plant_id, element_id)
+                                   for element_id in element_ids))
+        datasources = asyncio.gather(*(self.datasources(plant_id, element_id)
+                                       for element_id in element_ids))
+        details, datasources = await asyncio.gather(details, datasources)
+        return [
+            { 'element': detail, 'datasources': element_datasources }
+            for detail, element_datasources in zip(details, datasources)
+        ]
+
+    async def close(self):
+        self.tokens.stop()
+        await self.client.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
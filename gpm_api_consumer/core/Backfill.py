@@ -0,0 +1,301 @@
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from datetime import timedelta
+from gpm_api_consumer.utils import atomic_write, bind_context
+from .ConfigManager import ConfigManager
+from .exceptions import BackfillJobException
+from .Sharding import (DATE_KEY, Shard, ShardPlanner, ShardedDataList, format_date,
+                       parse_date, split_ids)
+from .Sinks import WRITERS
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Seconds between progress reports while a job runs
+PROGRESS_INTERVAL = 10
+
+
+def jobs_dir():
+    return os.path.join(ConfigManager.base_config_dir, 'jobs')
+
+
+def _shard_to_json(shard):
+    return [shard.index, shard.window, list(shard.datasource_ids),
+            format_date(shard.start), format_date(shard.end), shard.last]
+
+
+def _shard_from_json(item):
+    index, window, datasource_ids, start, end, last = item
+    return Shard(index, window, tuple(datasource_ids), parse_date(start), parse_date(end), last)
+
+
+def list_jobs():
+    '''
+    IDs of the jobs in the jobs directory, oldest first.
+    '''
+    root = jobs_dir()
+    if not os.path.isdir(root):
+        return []
+    manifests = {name: os.path.join(root, name, 'manifest.json') for name in os.listdir(root)}
+    jobs = [name for name, path in manifests.items() if os.path.exists(path)]
+    return sorted(jobs, key=lambda name: os.path.getmtime(manifests[name]))
+
+
+class BackfillJob:
+    '''
+    Long-range datalistv2 download that survives crashes, Ctrl-C and token
+    expiry. Lives in `<config dir>/jobs/<job id>/`:
+
+        manifest.json    plant, datasources, query, shard plan (never changes)
+        journal.ndjson   one line per finished or failed shard, fsync'd
+        results/         one file per shard, written atomically
+
+    A shard is only journaled as done after its file is in place, and
+    rerunning a shard rewrites the same file, so resuming after a crash at
+    any point never loses or duplicates records.
+    '''
+
+    def __init__(self, job_id, path=None):
+        self.id = job_id
+        self.path = path or os.path.join(jobs_dir(), job_id)
+        manifest_path = os.path.join(self.path, 'manifest.json')
+        if not os.path.exists(manifest_path):
+            raise BackfillJobException(f"No backfill job '{job_id}' in {os.path.dirname(self.path)}")
+        with open(manifest_path, 'r') as file:
+            self.manifest = json.load(file)
+        self.shards = [_shard_from_json(item) for item in self.manifest['shards']]
+        self.journal_path = os.path.join(self.path, 'journal.ndjson')
+        self.results_path = os.path.join(self.path, 'results')
+        self._journal_lock = threading.Lock()
+
+    @classmethod
+    def create(cls, plant_id, datasource_ids, params, planner=None, fmt='ndjson', job_id=None):
+        '''
+        Plan a job and write its manifest. `params` holds startDate, endDate,
+        grouping, granularity and aggregationType.
+        '''
+        if fmt not in WRITERS:
+            raise BackfillJobException(f"Unknown format '{fmt}', expected one of {tuple(WRITERS)}")
+        planner = planner or ShardPlanner()
+        params = dict(params, dataSourceIds=','.join(str(v) for v in split_ids(datasource_ids)))
+        shards = planner.plan(params)
+        job_id = job_id or f"plant{plant_id}-{time.strftime('%Y%m%dT%H%M%S')}"
+        path = os.path.join(jobs_dir(), job_id)
+        if os.path.exists(os.path.join(path, 'manifest.json')):
+            raise BackfillJobException(f"Backfill job '{job_id}' already exists")
+        os.makedirs(path, exist_ok=True)
+        manifest = {
+            'id': job_id,
+            'plant_id': plant_id,
+            'params': params,
+            'format': fmt,
+            'planner': {'max_rows': planner.max_rows, 'max_datasources': planner.max_datasources,
+                        'raw_interval': planner.raw_interval},
+            'created_at': time.time(),
+            'shards': [_shard_to_json(shard) for shard in shards],
+        }
+        with atomic_write(os.path.join(path, 'manifest.json')) as file:
+            json.dump(manifest, file, indent=1)
+        logger.info(f"Backfill job {job_id}: {len(shards)} shards planned")
+        return cls(job_id, path)
+
+    def journal(self):
+        '''
+        Latest journal entry of every shard: {index: entry}.
+        A truncated last line (crash while writing it) is ignored.
+        '''
+        entries = {}
+        if not os.path.exists(self.journal_path):
+            return entries
+        with open(self.journal_path, 'r') as file:
+            for line in file:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                entries[entry['shard']] = entry
+        return entries
+
+    def _record(self, entry):
+        with self._journal_lock:
+            with open(self.journal_path, 'a') as file:
+                file.write(json.dumps(entry, separators=(',', ':')) + '\n')
+                file.flush()
+                os.fsync(file.fileno())
+
+    def result_path(self, shard):
+        return os.path.join(self.results_path, f'shard-{shard.index:06d}.{self.manifest["format"]}')
+
+    def status(self):
+        '''
+        Progress of the job as a JSON-serializable dict.
+        '''
+        entries = self.journal()
+        done = [e for e in entries.values() if e['status'] == 'done']
+        failed = [e for e in entries.values() if e['status'] == 'failed']
+        seconds = sum(e.get('seconds', 0.0) for e in done)
+        rows = sum(e.get('rows', 0) for e in done)
+        total = len(self.shards)
+        return {
+            'id': self.id,
+            'plant_id': self.manifest['plant_id'],
+            'startDate': self.manifest['params']['startDate'],
+            'endDate': self.manifest['params']['endDate'],
+            'datasources': len(split_ids(self.manifest['params']['dataSourceIds'])),
+            'shards': total,
+            'done': len(done),
+            'failed': len(failed),
+            'percent': round(100 * len(done) / total, 1) if total else 100.0,
+            'rows': rows,
+            'state': 'complete' if len(done) == total else ('failed' if failed else 'incomplete'),
+            'results': self.results_path,
+            # Throughput of the shard downloads themselves, across runs
+            'rows_per_second': round(rows / seconds, 1) if seconds else None,
+        }
+
+    @contextmanager
+    def _run_lock(self):
+        if fcntl is None:
+            yield
+            return
+        with open(os.path.join(self.path, 'lock'), 'a') as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                raise BackfillJobException(f"Backfill job '{self.id}' is already running")
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _run_shard(self, fetcher, shard):
+        start = time.perf_counter()
+        records = [record for record in fetcher.fetch_shard(shard, self.manifest['params'])
+                   if shard.contains(parse_date(record[DATE_KEY]))]
+        writer = WRITERS[self.manifest['format']](self.result_path(shard))
+        try:
+            writer.write_batch(records)
+            writer.commit()
+        except BaseException:
+            writer.abort()
+            raise
+        return len(records), time.perf_counter() - start
+
+    def run(self, consumer, max_workers=4, retry_failed=True, max_attempts=3):
+        '''
+        Download every shard not yet journaled as done. Stopping at any point
+        (Ctrl-C included) keeps the finished shards for the next run.
+        Returns the status of the job.
+        '''
+        with self._run_lock():
+            entries = self.journal()
+            pending = [shard for shard in self.shards
+                       if entries.get(shard.index, {}).get('status') != 'done'
+                       and (retry_failed or shard.index not in entries)]
+            total = len(self.shards)
+            done = total - len(pending)
+            logger.info(f"Backfill job {self.id}: {done}/{total} shards done, {len(pending)} to go")
+            if not pending:
+                return self.status()
+
+            fetcher = ShardedDataList(consumer, max_attempts=max_attempts)
+            progress = _Progress(self.id, total, done, len(pending))
+            queue = iter(pending)
+            executor = ThreadPoolExecutor(max_workers=max_workers)
+            run_shard = bind_context(self._run_shard)
+            in_flight = {}
+            try:
+                # Only keep max_workers shards submitted, so Ctrl-C stops quickly
+                for shard in queue:
+                    in_flight[executor.submit(run_shard, fetcher, shard)] = shard
+                    if len(in_flight) >= max_workers:
+                        break
+                while in_flight:
+                    finished, _ = wait(in_flight, timeout=PROGRESS_INTERVAL, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        shard = in_flight.pop(future)
+                        try:
+                            rows, seconds = future.result()
+                        except Exception as e:
+                            logger.error(f"Backfill job {self.id}: shard {shard.index} failed: {e}")
+                            self._record({'shard': shard.index, 'status': 'failed',
+                                          'error': str(e), 'at': time.time()})
+                            progress.failed += 1
+                        else:
+                            self._record({'shard': shard.index, 'status': 'done', 'rows': rows,
+                                          'seconds': round(seconds, 3), 'at': time.time()})
+                            progress.advance(rows)
+                        next_shard = next(queue, None)
+                        if next_shard is not None:
+                            in_flight[executor.submit(run_shard, fetcher, next_shard)] = next_shard
+                    progress.report()
+            except BaseException:
+                for future in in_flight:
+                    future.cancel()
+                logger.warning(f"Backfill job {self.id} interrupted; resume it with "
+                               f"`gpm-cli backfill resume {self.id}`")
+                raise
+            finally:
+                executor.shutdown(wait=True, cancel_futures=True)
+            progress.report(force=True)
+            return self.status()
+
+    def records(self):
+        '''
+        Iterate over the records downloaded so far (NDJSON jobs), in shard order.
+        '''
+        if self.manifest['format'] != 'ndjson':
+            raise BackfillJobException("Only NDJSON results can be read back")
+        for shard in self.shards:
+            path = self.result_path(shard)
+            if os.path.exists(path):
+                with open(path, 'r') as file:
+                    for line in file:
+                        yield json.loads(line)
+
+
+class _Progress:
+    '''
+    Shards, rows, throughput and ETA of the current run.
+    '''
+
+    def __init__(self, job_id, total, done, pending):
+        self.job_id = job_id
+        self.total = total
+        self.done = done
+        self.pending = pending
+        self.finished = 0
+        self.failed = 0
+        self.rows = 0
+        self.started = time.monotonic()
+        self._reported = self.started
+
+    def advance(self, rows):
+        self.done += 1
+        self.finished += 1
+        self.rows += rows
+
+    def report(self, force=False):
+        now = time.monotonic()
+        if not force and now - self._reported < PROGRESS_INTERVAL:
+            return
+        self._reported = now
+        elapsed = now - self.started
+        remaining = self.pending - self.finished - self.failed
+        eta = timedelta(seconds=round(elapsed / self.finished * remaining)) if self.finished else None
+        logger.info(
+            f"Backfill job {self.job_id}: {self.done}/{self.total} shards "
+            f"({100 * self.done / self.total:.1f}%), {self.rows} rows, "
+            f"{self.rows / elapsed if elapsed else 0:.0f} rows/s, "
+            f"{self.finished / elapsed if elapsed else 0:.2f} shards/s"
+            + (f", {self.failed} failed" if self.failed else '')
+            + (f", ETA {eta}" if eta is not None and remaining else ''))
@@ -0,0 +1,276 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+from .ConfigManager import ConfigManager
+from .Sharding import (DATASOURCE_KEY, DATE_KEY, GROUPING_SECONDS, floor_bucket,
+                       format_date, parse_date, shift_buckets, split_ids,
+                       step_seconds)
+
+logger = logging.getLogger(__name__)
+
+
+class DataListCache:
+    '''
+    On-disk SQLite cache of datalistv2 results.
+    Records are stored per (datasourceId, grouping, granularity,
+    aggregationType, day) bucket. Closed days never expire, while the open
+    ones (today and the last `closed_after`) are refetched once `open_ttl`
+    seconds have passed. The least recently used buckets are evicted when
+    the cache grows beyond `max_bytes`.
+    Only whole buckets come from the cache: the buckets cut by the query
+    range are downloaded as asked, and groupings coarser than a day
+    bypass the cache.
+    '''
+
+    def __init__(self, prefix='gpm', path=None, max_bytes=512 * 1024 ** 2,
+                 open_ttl=900, closed_after=timedelta(hours=6)):
+        self.path = path or os.path.join(ConfigManager.base_config_dir,
+                                         f'{prefix}_cache.sqlite')
+        self.max_bytes = max_bytes
+        self.open_ttl = open_ttl
+        self.closed_after = closed_after
+        self._lock = threading.Lock()
+        self._conn = None
+
+    @property
+    def conn(self):
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.executescript('''
+                CREATE TABLE IF NOT EXISTS buckets (
+                    datasource_id INTEGER NOT NULL,
+                    grouping TEXT NOT NULL,
+                    granularity INTEGER NOT NULL,
+                    aggregation_type INTEGER NOT NULL,
+                    bucket TEXT NOT NULL,
+                    payload BLOB NOT NULL,
+                    size INTEGER NOT NULL,
+                    closed INTEGER NOT NULL,
+                    fetched_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL,
+                    PRIMARY KEY (datasource_id, grouping, granularity,
+                                 aggregation_type, bucket)
+                );
+                CREATE INDEX IF NOT EXISTS buckets_accessed ON buckets (accessed_at);
+                CREATE TABLE IF NOT EXISTS counters (
+                    name TEXT PRIMARY KEY,
+                    value INTEGER NOT NULL
+                );
+            ''')
+        return self._conn
+
+    @staticmethod
+    def query_key(params):
+        return (
+            (params.get('grouping') or 'raw').lower(),
+            int(params.get('granularity') or 0),
+            int(params.get('aggregationType') or 0),
+        )
+
+    def is_closed(self, day, now=None):
+        now = now or datetime.now()
+        return datetime.combine(day, datetime.min.time()) + timedelta(days=1) + self.closed_after <= now
+
+    def fetch(self, consumer, params):
+        '''
+        Return the records of a datalistv2 query, downloading only the
+        buckets that are missing or expired.
+        '''
+        ids = split_ids(params['dataSourceIds'])
+        start = parse_date(params['startDate'])
+        end = parse_date(params['endDate'])
+        key = self.query_key(params)
+        grouping, granularity = key[0], key[1]
+        if grouping != 'raw' and step_seconds(grouping, granularity) > GROUPING_SECONDS['day']:
+            # Their buckets span several days, which are cached one by one
+            logger.debug(f"Cache bypassed for {granularity} {grouping} buckets")
+            return list(consumer.datalistv2_sharded(params))
+
+        records = []
+        if grouping == 'raw':
+            # Dates are given to the second, so [start, end] is [first, last)
+            first, last = start, end + timedelta(seconds=1)
+            days = self._days(start.date(), end.date())
+        else:
+            # The API aggregates the buckets cut by the range over the part
+            # inside it, so only the whole buckets in [first, last) are cached
+            first = floor_bucket(start, grouping, granularity)
+            if first < start:
+                first = shift_buckets(first, grouping, granularity)
+            last = floor_bucket(end, grouping, granularity)
+            if first >= last:
+                return list(consumer.datalistv2_sharded(params))
+            if start < first:
+                records += [record for record in self._direct(consumer, params, start, first)
+                            if parse_date(record[DATE_KEY]) < first]
+            records += self._direct(consumer, params, last, end)
+            days = self._days(first.date(), (last - timedelta(seconds=1)).date())
+
+        cached, missing = self._lookup(key, ids, days)
+        consumer.client.emit('cache', hits=len(cached),
+                             misses=sum(len(v) for v in missing.values()))
+        for range_ids, first_day, last_day in self._missing_ranges(missing):
+            self._download(consumer, params, key, range_ids, first_day, last_day, cached)
+
+        records += [record for bucket in cached.values() for record in bucket
+                    if first <= parse_date(record[DATE_KEY]) < last]
+        records.sort(key=lambda record: (parse_date(record[DATE_KEY]), record[DATASOURCE_KEY]))
+        self.evict()
+        return records
+
+    @staticmethod
+    def _days(first_day, last_day):
+        return [first_day + timedelta(days=d) for d in range((last_day - first_day).days + 1)]
+
+    @staticmethod
+    def _direct(consumer, params, start, end):
+        '''
+        Download [start, end] without going through the cache.
+        '''
+        range_params = dict(params, startDate=format_date(start), endDate=format_date(end))
+        return list(consumer.datalistv2_sharded(range_params))
+
+    def _lookup(self, key, ids, days):
+        cached, missing = {}, {}
+        now = time.time()
+        hits = 0
+        with self._lock:
+            for datasource_id in ids:
+                rows = self.conn.execute(
+                    'SELECT bucket, payload, closed, fetched_at FROM buckets '
+                    'WHERE datasource_id=? AND grouping=? AND granularity=? '
+                    'AND aggregation_type=? AND bucket BETWEEN ? AND ?',
+                    (datasource_id, *key, days[0].isoformat(), days[-1].isoformat()),
+                ).fetchall()
+                found = {}
+                for bucket, payload, closed, fetched_at in rows:
+                    if closed or now - fetched_at < self.open_ttl:
+                        found[bucket] = payload
+                for day in days:
+                    payload = found.get(day.isoformat())
+                    if payload is None:
+                        missing.setdefault(day, []).append(datasource_id)
+                    else:
+                        cached[(datasource_id, day)] = json.loads(payload)
+                        hits += 1
+                if found:
+                    self.conn.execute(
+                        'UPDATE buckets SET accessed_at=? WHERE datasource_id=? AND grouping=? '
+                        'AND granularity=? AND aggregation_type=? AND bucket BETWEEN ? AND ?',
+                        (now, datasource_id, *key, days[0].isoformat(), days[-1].isoformat()),
+                    )
+            self._count('hits', hits)
+            self._count('misses', sum(len(v) for v in missing.values()))
+            self.conn.commit()
+        return cached, missing
+
+    @staticmethod
+    def _missing_ranges(missing):
+        '''
+        Group consecutive days missing the same datasources into one request.
+        '''
+        ranges = []
+        for day in sorted(missing):
+            ids = tuple(sorted(missing[day]))
+            if ranges and ranges[-1][0] == ids and ranges[-1][2] + timedelta(days=1) == day:
+                ranges[-1][2] = day
+            else:
+                ranges.append([ids, day, day])
+        return ranges
+
+    def _download(self, consumer, params, key, ids, first_day, last_day, cached):
+        range_params = dict(params)
+        range_params['dataSourceIds'] = (','.join(str(v) for v in ids)
+                                         if isinstance(params['dataSourceIds'], str) else list(ids))
+        range_params['startDate'] = format_date(datetime.combine(first_day, datetime.min.time()))
+        range_params['endDate'] = format_date(datetime.combine(last_day, datetime.max.time()).replace(microsecond=0))
+        logger.debug(f"Cache miss: downloading {len(ids)} datasources from {first_day} to {last_day}")
+
+        buckets = {(datasource_id, first_day + timedelta(days=d)): []
+                   for datasource_id in ids
+                   for d in range((last_day - first_day).days + 1)}
+        for record in consumer.datalistv2_sharded(range_params):
+            bucket = (record[DATASOURCE_KEY], parse_date(record[DATE_KEY]).date())
+            if bucket in buckets:
+                buckets[bucket].append(record)
+
+        now = time.time()
+        rows = []
+        for (datasource_id, day), records in buckets.items():
+            payload = json.dumps(records, separators=(',', ':'))
+            rows.append((datasource_id, *key, day.isoformat(), payload, len(payload),
+                         int(self.is_closed(day)), now, now))
+            cached[(datasource_id, day)] = records
+        with self._lock:
+            self.conn.executemany('INSERT OR REPLACE INTO buckets VALUES (?,?,?,?,?,?,?,?,?,?)', rows)
+            self.conn.commit()
+
+    def _count(self, name, amount):
+        if amount:
+            self.conn.execute(
+                'INSERT INTO counters (name, value) VALUES (?, ?) '
+                'ON CONFLICT(name) DO UPDATE SET value = value + excluded.value',
+                (name, amount),
+            )
+
+    def evict(self):
+        '''
+        Drop the least recently used buckets until the cache fits in `max_bytes`.
+        '''
+        with self._lock:
+            total = self.conn.execute('SELECT COALESCE(SUM(size), 0) FROM buckets').fetchone()[0]
+            evicted = 0
+            while total > self.max_bytes:
+                rows = self.conn.execute(
+                    'SELECT rowid, size FROM buckets ORDER BY accessed_at LIMIT 256').fetchall()
+                if not rows:
+                    break
+                for rowid, size in rows:
+                    self.conn.execute('DELETE FROM buckets WHERE rowid=?', (rowid,))
+                    total -= size
+                    evicted += 1
+                    if total <= self.max_bytes:
+                        break
+            self._count('evictions', evicted)
+            self.conn.commit()
+        return evicted
+
+    def stats(self):
+        '''
+        Return the size of the cache and its hit/miss counters.
+        '''
+        with self._lock:
+            buckets, size = self.conn.execute(
+                'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM buckets').fetchone()
+            counters = dict(self.conn.execute('SELECT name, value FROM counters').fetchall())
+        hits, misses = counters.get('hits', 0), counters.get('misses', 0)
+        return {
+            'path': self.path,
+            'buckets': buckets,
+            'bytes': size,
+            'max_bytes': self.max_bytes,
+            'hits': hits,
+            'misses': misses,
+            'evictions': counters.get('evictions', 0),
+            'hit_rate': round(hits / (hits + misses), 4) if hits + misses else None,
+        }
+
+    def clear(self):
+        '''
+        Remove every cached bucket and reset the counters.
+        '''
+        with self._lock:
+            self.conn.execute('DELETE FROM buckets')
+            self.conn.execute('DELETE FROM counters')
+            self.conn.commit()
+            self.conn.execute('VACUUM')
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
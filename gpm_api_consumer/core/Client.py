@@ -1,32 +1,342 @@
-import json, os, requests
+import json, os, requests, time
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from requests.adapters import HTTPAdapter
+from urllib3.util import make_headers
+from urllib3.util.retry import Retry
+from gpm_api_consumer.utils.compact import DELTA_MEDIA_TYPE, decode_datalist, iter_decoded
+from gpm_api_consumer.utils import profiling
+from gpm_api_consumer.utils.jsonstream import iter_json_array
+from .RateLimiter import LimiterChain
+
+# Limiter added to the requests sent from the current context (see APIClient.scope)
+_scoped_limiter = ContextVar('gpm_scoped_limiter', default=None)
+# Hooks added to the requests sent from the current context (see APIClient.hooked)
+_scoped_hooks = ContextVar('gpm_scoped_hooks', default=())
+
+
+def accept_encoding():
+    '''
+    Content codings this environment can decode: gzip and deflate, plus br
+    and zstd when brotli and zstandard are installed.
+    '''
+    return make_headers(accept_encoding=True)['accept-encoding']
+
+
+def capped_retry(backoff_max, **options):
+    '''
+    urllib3 Retry whose backoff never exceeds `backoff_max` seconds.
+    urllib3 2.x takes it as an argument; 1.26 only has a class attribute
+    (DEFAULT_BACKOFF_MAX, BACKOFF_MAX before 1.26.9), so a subclass carries
+    it there and keeps it through Retry.new().
+    '''
+    try:
+        return Retry(backoff_max=backoff_max, **options)
+    except TypeError:
+        attribute = 'DEFAULT_BACKOFF_MAX' if 'DEFAULT_BACKOFF_MAX' in vars(Retry) else 'BACKOFF_MAX'
+        return type('CappedRetry', (Retry,), {attribute: backoff_max})(**options)
 
 
 class APIClient:
-    def __init__(self, base_url):
+    '''
+    HTTP client for the GPM API.
+    Keeps a pooled keep-alive session so consecutive calls reuse the same
+    TCP+TLS connections, with connect/read timeouts and a retry policy
+    for throttled (429) and server error (5xx) responses to GETs and to
+    the login.
+    Compressed responses are negotiated and decoded while streaming, and
+    delta-encoded DataList responses (utils.compact) are expanded.
+    '''
+
+    # Status codes worth retrying: throttling and transient server errors
+    retry_status = (429, 500, 502, 503, 504)
+
+    # POST endpoints safe to replay on those; other POSTs are sent once
+    replayable_posts = ('/api/Account/Token',)
+
+    # Hooks applied to every client, e.g. installed once by the CLI
+    global_hooks = []
+
+    def __init__(self, base_url, pool_size=10, timeout=(5, 60),
+                 max_retries=3, backoff_factor=0.5, backoff_max=60,
+                 limiter=None, compression=True):
+        '''
+        `limiter` is an optional RequestLimiter shared by every request of
+        this client (and any other client it is given to).
+        `compression=False` asks the server for uncompressed bodies.
+        '''
         self.base_url = base_url
+        self.limiter = limiter
+        # Callables hook(event, data); see core.Metrics
+        self.hooks = []
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.backoff_max = backoff_max
+        self.compression = compression
+        self._session = None
 
-    def get(self, endpoint, headers=None, params=None):
-        response = requests.get(f"{self.base_url}{endpoint}",
-                                    headers=headers, params=params)
+    @property
+    def session(self):
+        '''
+        The underlying requests session, created on first use.
+        '''
+        if self._session is None:
+            self._session = self._build_session()
+        return self._session
 
-        response.raise_for_status()
+    def _retry(self, methods):
+        return capped_retry(
+            self.backoff_max,
+            total=self.max_retries,
+            connect=self.max_retries,
+            read=self.max_retries,
+            status=self.max_retries,
+            status_forcelist=self.retry_status,
+            allowed_methods=frozenset(methods),
+            backoff_factor=self.backoff_factor,
+            respect_retry_after_header=True,
+            # Return the last response so raise_for_status gives an HTTPError
+            raise_on_status=False,
+        )
+
+    def _build_session(self):
+        adapter = HTTPAdapter(pool_connections=self.pool_size,
+                              pool_maxsize=self.pool_size,
+                              max_retries=self._retry({'GET'}))
+        session = requests.Session()
+        session.headers['Accept-Encoding'] = accept_encoding() if self.compression else 'identity'
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        # Only these POSTs are replayed; the longest mounted prefix wins
+        replay = HTTPAdapter(pool_connections=1, pool_maxsize=1,
+                             max_retries=self._retry({'GET', 'POST'}))
+        for endpoint in self.replayable_posts:
+            session.mount(f"{self.base_url}{endpoint}", replay)
+        return session
+
+    @staticmethod
+    @contextmanager
+    def scope(limiter=None):
+        '''
+        Gate the requests sent from the current context with `limiter` too,
+        on top of each client's own limiter, until the block exits. Worker
+        threads keep the scope when their tasks are wrapped with
+        utils.bind_context.
+        '''
+        if limiter is None:
+            yield
+            return
+        token = _scoped_limiter.set(LimiterChain(_scoped_limiter.get(), limiter))
         try:
-            # Attempt to parse the response as JSON
-            return response.json()
-        except json.JSONDecodeError:
-            # May be not content
-            return None
-
-    def post(self, endpoint, json=None, headers=None):
-        response = requests.post(f"{self.base_url}{endpoint}",
-                                    json=json, headers=headers)
+            yield
+        finally:
+            _scoped_limiter.reset(token)
+
+    @staticmethod
+    @contextmanager
+    def hooked(*hooks):
+        '''
+        Send the events of the requests made from the current context to
+        `hooks` too, until the block exits; unlike global_hooks, other
+        threads and commands don't see them. Worker threads keep them when
+        their tasks are wrapped with utils.bind_context.
+        '''
+        token = _scoped_hooks.set(_scoped_hooks.get() + hooks)
+        try:
+            yield
+        finally:
+            _scoped_hooks.reset(token)
+
+    def _slot(self):
+        scoped = _scoped_limiter.get()
+        if scoped is not None:
+            return LimiterChain(self.limiter, scoped).slot()
+        return self.limiter.slot() if self.limiter is not None else nullcontext()
+
+    # Bytes read from the socket at a time in streaming mode
+    stream_chunk_size = 64 * 1024
+
+    @property
+    def active_hooks(self):
+        scoped = _scoped_hooks.get()
+        if not (APIClient.global_hooks or scoped):
+            return self.hooks
+        return self.hooks + APIClient.global_hooks + list(scoped)
+
+    def emit(self, event, **data):
+        '''
+        Send an event to the hooks of this client (see core.Metrics).
+        '''
+        for hook in self.active_hooks:
+            hook(event, data)
+
+    def _request(self, method, endpoint, timeout=None, **kwargs):
+        '''
+        Send a request through the limiter. When hooks are installed, returns
+        the event describing it so the caller can complete and emit it.
+        '''
+        if not (self.hooks or APIClient.global_hooks or _scoped_hooks.get()):
+            with self._slot():
+                return self.session.request(method, f"{self.base_url}{endpoint}",
+                                            timeout=timeout or self.timeout, **kwargs), None
+        start = time.perf_counter()
+        with self._slot():
+            waited = time.perf_counter() - start
+            try:
+                response = self.session.request(method, f"{self.base_url}{endpoint}",
+                                                timeout=timeout or self.timeout, **kwargs)
+            except Exception as e:
+                self.emit('request', method=method, endpoint=endpoint, status=None,
+                          seconds=time.perf_counter() - start, error=type(e).__name__)
+                raise
+        retries = getattr(getattr(response.raw, 'retries', None), 'history', ()) or ()
+        return response, {
+            'method': method,
+            'endpoint': endpoint,
+            'status': response.status_code,
+            'start': start,
+            'queued': waited,
+            'headers': response.elapsed.total_seconds(),
+            'retries': len(retries),
+            'throttled': sum(1 for attempt in retries if attempt.status == 429),
+        }
+
+    def _finish(self, event, response, decode_start=None, size=None):
+        if event is None:
+            return
+        now = time.perf_counter()
+        event['decode'] = now - decode_start if decode_start is not None else 0.0
+        event['bytes'] = size if size is not None else len(response.content or b'')
+        event['wire_bytes'] = _wire_bytes(response, event['bytes'])
+        event['seconds'] = now - event.pop('start')
+        self.emit('request', **event)
+
+    def _decode(self, response, event):
+        decode_start = time.perf_counter() if event is not None else None
+        with profiling.stage('json_decode'):
+            try:
+                # Attempt to parse the response as JSON
+                data = response.json()
+            except ValueError:
+                # May be not content
+                data = None
+            if data is not None and _is_delta(response):
+                data = decode_datalist(data)
+        self._finish(event, response, decode_start)
+        return data
+
+    def _raise_for_status(self, response, event):
+        if response.status_code >= 400:
+            self._finish(event, response)
         response.raise_for_status()
+
+    def get(self, endpoint, headers=None, params=None, timeout=None, stream=False):
+        '''
+        GET an endpoint and decode its JSON body.
+        With `stream=True` the body is parsed incrementally and an iterator
+        over the items of the top-level array is returned instead.
+        '''
+        response, event = self._request('GET', endpoint, headers=headers, params=params,
+                                        timeout=timeout, stream=stream)
+        self._raise_for_status(response, event)
+        if stream:
+            return self._iter_items(response, event)
+        return self._decode(response, event)
+
+    def get_bytes(self, endpoint, headers=None, params=None, timeout=None):
+        '''
+        GET an endpoint without decoding its body.
+        Returns (content, delta): the body bytes and whether they hold the
+        delta-encoded DataList representation (utils.compact).
+        '''
+        response, event = self._request('GET', endpoint, headers=headers, params=params,
+                                        timeout=timeout)
+        self._raise_for_status(response, event)
+        content = response.content
+        self._finish(event, response)
+        return content, _is_delta(response)
+
+    def get_conditional(self, endpoint, headers=None, params=None, etag=None, timeout=None):
+        '''
+        GET with ETag revalidation.
+        Returns (data, etag, modified); data is None when the server answers
+        304 Not Modified to the `etag` sent in If-None-Match.
+        '''
+        headers = dict(headers or {})
+        if etag:
+            headers['If-None-Match'] = etag
+        response, event = self._request('GET', endpoint, headers=headers, params=params,
+                                        timeout=timeout)
+        if response.status_code == 304:
+            self._finish(event, response)
+            return None, etag, False
+        self._raise_for_status(response, event)
+        return self._decode(response, event), response.headers.get('ETag'), True
+
+    def post(self, endpoint, json=None, headers=None, timeout=None):
+        response, event = self._request('POST', endpoint, json=json, headers=headers,
+                                        timeout=timeout)
+        self._raise_for_status(response, event)
+        return self._decode(response, event)
+
+    def _iter_items(self, response, event=None):
+        chunks = response.iter_content(self.stream_chunk_size)
+        if event is not None:
+            counter = _ByteCounter(chunks)
+            chunks = counter
         try:
-            # Attempt to parse the response as JSON
-            return response.json()
-        except json.JSONDecodeError:
-            # May be not content
-            return None
+            items = iter_json_array(chunks)
+            yield from iter_decoded(items) if _is_delta(response) else items
+        finally:
+            # Return the connection to the pool even if the caller stops early
+            response.close()
+            if event is not None:
+                self._finish(event, response, event['start'] + event['headers'], size=counter.size)
+
+    def close(self):
+        '''
+        Close the session and release the pooled connections.
+        '''
+        if self._session is not None:
+            self._session.close()
+            self._session = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
 
     def __str__(self):
         return f"APIClient with base URL: {self.base_url}"
+
+
+def _is_delta(response):
+    return response.headers.get('Content-Type', '').startswith(DELTA_MEDIA_TYPE)
+
+
+def _wire_bytes(response, default):
+    '''
+    Body bytes read from the socket, before content decoding.
+    '''
+    try:
+        return int(response.raw.tell())
+    except (AttributeError, TypeError, ValueError):
+        return default
+
+
+class _ByteCounter:
+    '''
+    Iterator wrapper counting the bytes of a streamed body.
+    '''
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.size = 0
+
+    def __iter__(self):
+        for chunk in self.chunks:
+            self.size += len(chunk)
+            yield chunk
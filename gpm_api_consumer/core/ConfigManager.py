@@ -1,5 +1,4 @@
 import json, os
-from dotenv import load_dotenv, dotenv_values
 
 class ConfigManager:
     """
@@ -15,22 +14,32 @@ class ConfigManager:
         self._config = self._load_config()
         self.env_path = os.path.join(self.base_config_dir, env_path)
         self._env_loaded = False
-        self._env = {}
-        self._load_env()
+        self._env_values = None
+
+    @property
+    def _env(self):
+        # Loaded on first use, so config-only commands never touch dotenv
+        if self._env_values is None:
+            self._env_values = {}
+            self._load_env()
+        return self._env_values
 
     def _load_env(self):
         if os.path.exists(self.env_path):
+            self._env_mtime = os.path.getmtime(self.env_path)
+            from dotenv import load_dotenv, dotenv_values
             load_dotenv(dotenv_path=self.env_path, override=True)
-            self._env = dotenv_values(self.env_path)
+            self._env_values = dotenv_values(self.env_path)
             self._env_loaded = True
 
     def print_credentials(self):
         '''
         Might be temporal
         '''
+        env = self._env
         if self._env_loaded:
             print("\nEnvironment Variables:")
-            for key, value in self._env.items():
+            for key, value in env.items():
                 print(f"\t{key}:\t{value}")
             print("\n")
         else:
@@ -53,15 +62,29 @@ class ConfigManager:
 
     def _load_config(self):
         if os.path.exists(self.path):
+            self._mtime = os.path.getmtime(self.path)
             with open(self.path, 'r') as file:
                 return json.load(file)
         else:
             return self._create_default_config()
 
+    def reload(self):
+        '''
+        Read the config file again if it changed since it was loaded,
+        e.g. by another process while this one is long-running.
+        '''
+        mtime = os.path.getmtime(self.path) if os.path.exists(self.path) else None
+        if mtime != getattr(self, '_mtime', None):
+            self._config = self._load_config()
+        if self._env_values is not None and os.path.exists(self.env_path):
+            if os.path.getmtime(self.env_path) != getattr(self, '_env_mtime', None):
+                self._env_values = None
+
     def _create_default_config(self):
         default_config = {key: None for key, value in self.config_keys.items()}
         with open(self.path, 'w') as file:
             json.dump(default_config, file, indent=4)
+        self._mtime = os.path.getmtime(self.path)
         return default_config
 
     def get(self, key, default=None):
@@ -95,6 +118,7 @@ class ConfigManager:
     def _save_config(self):
         with open(self.path, 'w') as file:
             json.dump(self._config, file, indent=4)
+        self._mtime = os.path.getmtime(self.path)
 
     def _reset_config(self, keys=None):
         if keys is not None:
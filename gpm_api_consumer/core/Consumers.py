@@ -1,5 +1,10 @@
 from .Client import APIClient
-from .ConfigManager import ConfigManager
+from .Memo import RequestMemo
+from .Sharding import ShardedDataList
+from .settings import GPM_CONFIG_KEYS, gpm_config_manager
+from .TokenManager import TokenManager
+from gpm_api_consumer.utils import chunked_iterable
+from gpm_api_consumer.utils.compact import DELTA_ACCEPT
 from gpm_api_consumer.utils.decorators import handle_authentication
 
 
@@ -8,51 +13,110 @@ class GPMConsumer:
     API Consumer for GPM (Green Power Monitor) API.
     '''
 
-    configKeys = {
-        # query parameters for datalistv2 endpoint
-        'api_token': str,
-        'plant_id': int,
-        'plant_name': str,
-        'element_id': int,
-        'startDate': str,
-        'endDate': str,
-        'dataSourceIds': (list, int),
-        'grouping': str,
-        'granularity': int,
-        'aggregationType': int,
-        'signals': (list, str),
-        'table': str,
-    }
-
-    def __init__(self, prefix='gpm'):
-        self.config_manager = ConfigManager(
-            prefix = prefix,
-            config_path=f'{prefix}_config.json',
-            env_path=f'{prefix}.env',
-            config_keys=GPMConsumer.configKeys
-        )
-        self.client = APIClient(self.config_manager._env['API_BASE_URL'])
+    configKeys = GPM_CONFIG_KEYS
 
-    @handle_authentication
-    def get(self, endpoint, params=None):
+    def __init__(self, prefix='gpm', cache=None, auto_refresh=False, memoize=True,
+                 compact=False, adaptive=False, **client_options):
+        '''
+        `client_options` are forwarded to APIClient to tune the session
+        (pool_size, timeout, max_retries, backoff_factor, backoff_max,
+        compression).
+        `cache` is an optional DataListCache used by datalistv2_cached.
+        `auto_refresh` refreshes the token in the background before it expires.
+        `memoize` shares plant/element/datasource GETs within the process
+        (True for the default TTLs, or a RequestMemo).
+        `compact` asks for delta-encoded DataList responses where the server
+        supports them; results are decoded to the usual records.
+        `adaptive` (True or an AdaptiveController) adjusts the requests in
+        flight and the sharded window sizes to the server's responses.
+        '''
+        self.config_manager = gpm_config_manager(prefix)
+        self.client = APIClient(self.config_manager._env['API_BASE_URL'],
+                                **client_options)
+        self.cache = cache
+        self.tokens = TokenManager(self, background=auto_refresh)
+        self.memo = RequestMemo() if memoize is True else (memoize or None)
+        self.compact = compact
+        self.adaptive = None
+        if adaptive:
+            from .Adaptive import AdaptiveController
+            controller = AdaptiveController() if adaptive is True else adaptive
+            self.adaptive = controller.attach(self.client)
+
+    @property
+    def session(self):
         '''
-        Get data from the GPM API.
+        The pooled HTTP session shared by every call of this consumer.
+        '''
+        return self.client.session
+
+    def close(self):
+        '''
+        Release the pooled connections of the underlying client.
+        '''
+        self.client.close()
+        self.tokens.stop()
+        if self.cache is not None:
+            self.cache.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def get(self, endpoint, params=None, stream=False):
         '''
-        token = self.config_manager.get('api_token')
+        Get data from the GPM API.
+        With `stream=True` returns an iterator over the items of the response.
+        Idempotent metadata GETs are served from the memo when enabled.
+        '''
+        if stream or self.memo is None:
+            return self._get(endpoint, params=params, stream=stream)
+        return self.memo.get_or_fetch(endpoint, params,
+                                      lambda: self._get(endpoint, params=params),
+                                      emit=self.client.emit)
+
+    @handle_authentication
+    def _get(self, endpoint, params=None, stream=False):
+        token = self.tokens.get_token()
         headers = { 'Authorization': f'Bearer {token}' }
-        response = self.client.get(endpoint, headers=headers, params=params)
+        if self.compact and endpoint.startswith('/api/DataList'):
+            headers['Accept'] = DELTA_ACCEPT
+        response = self.client.get(endpoint, headers=headers, params=params,
+                                   stream=stream)
         return response
 
+    @handle_authentication
+    def get_conditional(self, endpoint, params=None, etag=None):
+        '''
+        Get data from the GPM API revalidating a previous ETag.
+        Returns (data, etag, modified).
+        '''
+        token = self.tokens.get_token()
+        headers = { 'Authorization': f'Bearer {token}' }
+        return self.client.get_conditional(endpoint, headers=headers,
+                                           params=params, etag=etag)
+
     @handle_authentication
     def post(self, endpoint, data=None):
         '''
         Post data to the GPM API.
         '''
-        token = self.config_manager.get('api_token')
+        token = self.tokens.get_token()
         headers = { 'Authorization': f'Bearer {token}' }
         response = self.client.post(endpoint, json=data, headers=headers)
         return response
 
+    def invalidate(self, endpoint=None, prefix=None):
+        '''
+        Forget memoized responses: one endpoint, everything under a prefix
+        (e.g. '/api/Plant/4'), or everything when called without arguments.
+        '''
+        if self.memo is None:
+            return 0
+        return self.memo.invalidate(endpoint=endpoint, prefix=prefix)
+
     def login(self):
         '''
         Login to the API and get a token.
@@ -75,11 +139,90 @@ class GPMConsumer:
         '''
         return self.get('/api/Account/Ping')
 
-    def datalistv2(self, params=None):
+    def datalistv2(self, params=None, stream=False, chunk_size=None):
         '''
         Get the list of data from the API.
+        With `stream=True` records are yielded while the response is being
+        downloaded; with `chunk_size` they are yielded in lists of that size.
+        '''
+        if not stream:
+            return self.get('/api/DataList/v2', params=params)
+        records = self.get('/api/DataList/v2', params=params, stream=True)
+        return chunked_iterable(records, chunk_size) if chunk_size else records
+
+    @handle_authentication
+    def datalistv2_bytes(self, params=None):
+        '''
+        Get the list of data as the undecoded response body, so it can be
+        decoded in another process. Returns (content, delta), see
+        APIClient.get_bytes.
+        '''
+        token = self.tokens.get_token()
+        headers = { 'Authorization': f'Bearer {token}' }
+        if self.compact:
+            headers['Accept'] = DELTA_ACCEPT
+        return self.client.get_bytes('/api/DataList/v2', headers=headers, params=params)
+
+    def datalistv2_sharded(self, params=None, planner=None, max_workers=None):
+        '''
+        Get the list of data splitting the query into datasource and time shards.
+        Returns a generator of records ordered by date.
+        With an adaptive consumer the shard sizes adapt too and the adaptive
+        limit, not `max_workers`, decides the requests in flight.
+        '''
+        planner, max_workers = self._shard_options(planner, max_workers)
+        return ShardedDataList(self, planner=planner, max_workers=max_workers).run(params)
+
+    def _shard_options(self, planner, max_workers):
+        if self.adaptive is None:
+            return planner, max_workers or 4
+        if planner is None:
+            from .Adaptive import AdaptivePlanner
+            planner = AdaptivePlanner(client=self.client)
+        return planner, max_workers or self.adaptive.max_limit
+
+    def datalistv2_frame(self, params=None, sharded=False, stream=False, chunk_size=50000):
+        '''
+        Get the list of data decoded into a columnar DataListFrame.
+        With `stream=True` the response is decoded in column chunks of
+        `chunk_size` records, so the full list of dicts never exists in memory.
+        '''
+        # numpy is optional and slow to import, so only load it when needed
+        from .Frames import DataListFrame
+        if stream:
+            return DataListFrame.concat(self.datalistv2_frames(params, chunk_size))
+        records = self.datalistv2_sharded(params) if sharded else self.datalistv2(params)
+        return DataListFrame.from_records(list(records))
+
+    def datalistv2_frames(self, params=None, chunk_size=50000):
+        '''
+        Stream the list of data as DataListFrame column chunks.
+        '''
+        from .Frames import DataListFrame
+        for chunk in self.datalistv2(params, stream=True, chunk_size=chunk_size):
+            yield DataListFrame.from_records(chunk)
+
+    def datalistv2_processed(self, params, transform, planner=None, max_workers=None,
+                             processes=None):
+        '''
+        Get the list of data window by window and run the CPU-bound
+        `transform` (e.g. Pipeline.WideTable) over each window on a process
+        pool while the next windows download. Yields one result per window.
+        '''
+        from .Pipeline import processed_datalist
+        planner, max_workers = self._shard_options(planner, max_workers)
+        return processed_datalist(self, params, transform, planner=planner,
+                                  max_workers=max_workers, processes=processes)
+
+    def datalistv2_cached(self, params=None):
+        '''
+        Get the list of data through the local cache, downloading only the
+        datasource/day buckets that are missing or expired.
         '''
-        return self.get('/api/DataList/v2', params=params)
+        if self.cache is None:
+            from .Cache import DataListCache
+            self.cache = DataListCache(prefix=self.config_manager.prefix)
+        return self.cache.fetch(self, params)
 
     def plant(self, plant_id=None, params=None):
         '''
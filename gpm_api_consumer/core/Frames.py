@@ -0,0 +1,274 @@
+import json
+from gpm_api_consumer.utils.compact import decode_datalist
+from .Sharding import DATASOURCE_KEY, DATE_KEY, VALUE_KEY, parse_date
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - optional dependency
+    np = None
+
+
+def require_numpy():
+    if np is None:
+        raise ImportError("numpy is required for DataListFrame. "
+                          "Install it with `pip install gpm_api_consumer[numpy]`.")
+
+
+def _has_offset(date):
+    '''
+    Whether an ISO date string ends with 'Z' or a UTC offset (+HH:MM/+HHMM),
+    or a datetime is timezone aware.
+    '''
+    if not isinstance(date, str):
+        return getattr(date, 'tzinfo', None) is not None
+    return date.endswith('Z') or (len(date) > 19 and (date[-6] in '+-' or date[-5] in '+-'))
+
+
+def parse_timestamps(dates):
+    '''
+    Convert GPM date strings into int64 epoch seconds.
+    Dates are plant local time, so like Sharding.parse_date the wall clock is
+    kept and any UTC offset or 'Z' suffix is ignored (not shifted to UTC).
+    '''
+    require_numpy()
+    if any(_has_offset(d) for d in dates):
+        # numpy would convert these to UTC, parse them one by one instead
+        return np.array([parse_date(d) for d in dates], dtype='datetime64[s]').astype(np.int64)
+    return np.array(dates, dtype='datetime64[s]').astype(np.int64)
+
+
+class DataListFrame:
+    '''
+    Columnar datalistv2 result.
+    Samples are stored in contiguous arrays sorted by datasource and time:
+    `timestamps` (int64 epoch seconds), `values` (float64, NaN when missing)
+    and `mask` (True where the value is missing). The samples of
+    `datasource_ids[i]` are the slice `offsets[i]:offsets[i + 1]`.
+    '''
+
+    # Reductions supported by resample/aggregate
+    reductions = ('mean', 'sum', 'sum_nonzero', 'min', 'max', 'count', 'first', 'last')
+
+    def __init__(self, datasource_ids, offsets, timestamps, values, mask=None):
+        require_numpy()
+        self.datasource_ids = np.asarray(datasource_ids, dtype=np.int64)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.timestamps = np.asarray(timestamps, dtype=np.int64)
+        self.values = np.asarray(values, dtype=np.float64)
+        self.mask = np.isnan(self.values) if mask is None else np.asarray(mask, dtype=bool)
+        self._index = None
+
+    @classmethod
+    def from_columns(cls, datasource_ids, timestamps, values):
+        '''
+        Build a frame from unsorted per-sample columns.
+        Duplicated (datasource, timestamp) samples keep the last value.
+        '''
+        require_numpy()
+        datasource_ids = np.asarray(datasource_ids, dtype=np.int64)
+        timestamps = np.asarray(timestamps, dtype=np.int64)
+        values = np.asarray(values, dtype=np.float64)
+        if len(datasource_ids) == 0:
+            return cls.empty()
+
+        order = np.lexsort((np.arange(len(timestamps)), timestamps, datasource_ids))
+        datasource_ids, timestamps, values = datasource_ids[order], timestamps[order], values[order]
+        # Drop duplicates, keeping the last occurrence of each key
+        keep = np.ones(len(timestamps), dtype=bool)
+        keep[:-1] = (datasource_ids[1:] != datasource_ids[:-1]) | (timestamps[1:] != timestamps[:-1])
+        datasource_ids, timestamps, values = datasource_ids[keep], timestamps[keep], values[keep]
+
+        unique_ids, starts = np.unique(datasource_ids, return_index=True)
+        offsets = np.append(starts, len(datasource_ids))
+        return cls(unique_ids, offsets, timestamps, values)
+
+    @classmethod
+    def from_records(cls, records):
+        '''
+        Decode a datalistv2 payload (list of DataSourceId/Date/Value dicts).
+        '''
+        require_numpy()
+        records = records or []
+        datasource_ids = np.fromiter((r[DATASOURCE_KEY] for r in records), dtype=np.int64, count=len(records))
+        timestamps = parse_timestamps([r[DATE_KEY] for r in records])
+        values = np.array([r.get(VALUE_KEY) for r in records], dtype=np.float64)
+        return cls.from_columns(datasource_ids, timestamps, values)
+
+    @classmethod
+    def from_json(cls, content, delta=False):
+        '''
+        Decode a raw datalistv2 response body, delta-encoded (utils.compact)
+        when `delta` is set.
+        '''
+        records = json.loads(content) if content else None
+        if records and delta:
+            records = decode_datalist(records)
+        return cls.from_records(records)
+
+    @classmethod
+    def empty(cls):
+        require_numpy()
+        return cls(np.empty(0, np.int64), np.zeros(1, np.int64),
+                   np.empty(0, np.int64), np.empty(0, np.float64))
+
+    @classmethod
+    def concat(cls, frames):
+        '''
+        Merge several frames (e.g. shards or stream chunks) into one.
+        '''
+        frames = [frame for frame in frames if len(frame)]
+        if not frames:
+            return cls.empty()
+        if len(frames) == 1:
+            return frames[0]
+        return cls.from_columns(
+            np.concatenate([frame.sample_datasource_ids() for frame in frames]),
+            np.concatenate([frame.timestamps for frame in frames]),
+            np.concatenate([frame.values for frame in frames]),
+        )
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def __contains__(self, datasource_id):
+        return datasource_id in self.index
+
+    def __repr__(self):
+        return f"DataListFrame({len(self.datasource_ids)} datasources, {len(self)} samples)"
+
+    @property
+    def index(self):
+        '''
+        Mapping datasource ID -> position in `datasource_ids`.
+        '''
+        if self._index is None:
+            self._index = {int(v): i for i, v in enumerate(self.datasource_ids)}
+        return self._index
+
+    def series(self, datasource_id):
+        '''
+        Return the (timestamps, values) views of one datasource.
+        '''
+        i = self.index[datasource_id]
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return self.timestamps[start:end], self.values[start:end]
+
+    def sample_datasource_ids(self):
+        '''
+        Datasource ID of every sample (expanded from the offsets).
+        '''
+        return np.repeat(self.datasource_ids, np.diff(self.offsets))
+
+    def _reduce(self, group_starts, how):
+        '''
+        Reduce contiguous groups of samples starting at `group_starts`.
+        '''
+        if how not in self.reductions:
+            raise ValueError(f"Unknown reduction '{how}', expected one of {self.reductions}")
+        if len(group_starts) == 0:
+            return np.empty(0, np.float64)
+        values = self.values
+        valid = ~self.mask
+        if how == 'sum_nonzero':
+            valid = valid & (values != 0)
+        counts = np.add.reduceat(valid.astype(np.int64), group_starts)
+        if how == 'count':
+            return counts.astype(np.float64)
+        if how in ('first', 'last'):
+            ends = np.append(group_starts[1:], len(values))
+            picks = group_starts if how == 'first' else ends - 1
+            return values[picks]
+        if how in ('min', 'max'):
+            fill = np.inf if how == 'min' else -np.inf
+            ufunc = np.minimum if how == 'min' else np.maximum
+            result = ufunc.reduceat(np.where(valid, values, fill), group_starts)
+        else:
+            result = np.add.reduceat(np.where(valid, values, 0.0), group_starts)
+            if how == 'mean':
+                with np.errstate(invalid='ignore', divide='ignore'):
+                    result = result / counts
+        result[counts == 0] = np.nan
+        return result
+
+    def resample(self, step, how='mean', origin=0):
+        '''
+        Resample every datasource into buckets of `step` seconds aligned to
+        `origin` (epoch seconds). Buckets are labelled by their start.
+        '''
+        if not len(self):
+            return DataListFrame.empty()
+        return self.reduce_buckets((self.timestamps - origin) // step * step + origin, how)
+
+    def reduce_buckets(self, buckets, how='mean'):
+        '''
+        Reduce the samples of every datasource sharing the same label in
+        `buckets` (one int64 per sample, e.g. bucket start epoch seconds).
+        '''
+        if not len(self):
+            return DataListFrame.empty()
+        buckets = np.asarray(buckets, dtype=np.int64)
+        sample_ids = self.sample_datasource_ids()
+        frame = self
+        if len(buckets) > 1 and np.any((buckets[1:] < buckets[:-1]) & (sample_ids[1:] == sample_ids[:-1])):
+            # Labels going backwards within a datasource (e.g. a DST fall-back):
+            # regroup with a stable sort so equal labels become contiguous
+            order = np.lexsort((np.arange(len(buckets)), buckets, sample_ids))
+            buckets, sample_ids = buckets[order], sample_ids[order]
+            frame = DataListFrame(self.datasource_ids, self.offsets, self.timestamps[order],
+                                  self.values[order], self.mask[order])
+        # Samples are sorted by datasource then label, so groups are contiguous
+        change = np.ones(len(buckets), dtype=bool)
+        change[1:] = (buckets[1:] != buckets[:-1]) | (sample_ids[1:] != sample_ids[:-1])
+        group_starts = np.flatnonzero(change)
+        values = frame._reduce(group_starts, how)
+        group_ids = sample_ids[group_starts]
+        unique_ids, starts = np.unique(group_ids, return_index=True)
+        return DataListFrame(unique_ids, np.append(starts, len(group_ids)),
+                             buckets[group_starts], values)
+
+    def aggregate(self, how='mean'):
+        '''
+        Reduce each datasource to a single value. Returns {datasource ID: value}.
+        '''
+        starts = self.offsets[:-1][np.diff(self.offsets) > 0]
+        ids = self.datasource_ids[np.diff(self.offsets) > 0]
+        return dict(zip(ids.tolist(), self._reduce(starts, how).tolist()))
+
+    def to_numpy(self):
+        '''
+        Return the underlying arrays (no copy, except the expanded datasource IDs).
+        '''
+        return {
+            'datasource_id': self.sample_datasource_ids(),
+            'timestamp': self.timestamps,
+            'value': self.values,
+            'mask': self.mask,
+        }
+
+    def to_arrow(self):
+        '''
+        Export to a pyarrow Table. Timestamp and value columns share memory
+        with the frame; missing values are kept as NaN.
+        '''
+        try:
+            import pyarrow as pa
+        except ImportError:
+            raise ImportError("pyarrow is required for DataListFrame.to_arrow. "
+                              "Install it with `pip install gpm_api_consumer[arrow]`.")
+        return pa.table({
+            'datasource_id': pa.array(self.sample_datasource_ids()),
+            'timestamp': pa.array(self.timestamps.view('datetime64[s]')),
+            'value': pa.array(self.values),
+        })
+
+    def to_records(self):
+        '''
+        Convert back to the datalistv2 list of dicts.
+        '''
+        dates = self.timestamps.astype('datetime64[s]').astype(str)
+        values = np.where(self.mask, None, self.values)
+        return [
+            { DATASOURCE_KEY: ds, DATE_KEY: date, VALUE_KEY: value }
+            for ds, date, value in zip(self.sample_datasource_ids().tolist(),
+                                       dates.tolist(), values.tolist())
+        ]
@@ -0,0 +1,138 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from .Metrics import endpoint_template
+
+# Seconds each GET endpoint stays memoized; endpoints not listed are never memoized
+DEFAULT_TTLS = {
+    '/api/Plant': 300,
+    '/api/Plant/{id}': 300,
+    '/api/Plant/{id}/Element': 300,
+    '/api/Plant/{id}/Element/{id}': 300,
+    '/api/Plant/{id}/Datasource': 300,
+    '/api/Plant/{id}/Element/{id}/Datasource': 300,
+}
+
+
+class RequestMemo:
+    '''
+    In-process memoization of idempotent GETs, keyed on endpoint + params.
+    Entries live in a bounded LRU with per-endpoint TTLs, and identical
+    requests in flight at the same time share a single response.
+    A fetch in flight when its endpoint is invalidated still answers its
+    callers, but its result is not memoized.
+    Callers get their own copy of the cached data.
+    '''
+
+    def __init__(self, max_entries=512, ttls=None):
+        self.max_entries = max_entries
+        self.ttls = dict(DEFAULT_TTLS if ttls is None else ttls)
+        self._entries = OrderedDict()
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.shared = 0
+
+    def ttl(self, endpoint):
+        return self.ttls.get(endpoint_template(endpoint), 0)
+
+    @staticmethod
+    def key(endpoint, params):
+        return endpoint, tuple(sorted((params or {}).items(), key=lambda item: item[0]))
+
+    def get_or_fetch(self, endpoint, params, fetch, emit=None):
+        '''
+        Return the memoized response of `endpoint` or call fetch() once for it.
+        `emit(event, **data)` is told whether it was a hit, miss or shared.
+        '''
+        ttl = self.ttl(endpoint)
+        if ttl <= 0:
+            return fetch()
+        try:
+            key = self.key(endpoint, params)
+            hash(key)
+        except TypeError:
+            # Unhashable params (e.g. lists): don't memoize
+            return fetch()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            hit = entry is not None and entry[0] > time.monotonic()
+            if hit:
+                self._entries.move_to_end(key)
+                self.hits += 1
+            else:
+                future = self._in_flight.get(key)
+                owner = future is None
+                if owner:
+                    future = self._in_flight[key] = Future()
+                    self.misses += 1
+                else:
+                    self.shared += 1
+
+        if hit:
+            if emit is not None:
+                emit('memo', endpoint=endpoint, hits=1)
+            return copy.deepcopy(entry[1])
+        if emit is not None:
+            emit('memo', endpoint=endpoint, **({'misses': 1} if owner else {'shared': 1}))
+        if not owner:
+            return copy.deepcopy(future.result())
+
+        try:
+            data = fetch()
+        except BaseException as e:
+            future.set_exception(e)
+            with self._lock:
+                if self._in_flight.get(key) is future:
+                    del self._in_flight[key]
+            raise
+        with self._lock:
+            # invalidate() drops the fetches in flight: their data may predate it
+            if self._in_flight.get(key) is future:
+                del self._in_flight[key]
+                self._entries[key] = (time.monotonic() + ttl, data)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        future.set_result(data)
+        return copy.deepcopy(data)
+
+    def invalidate(self, endpoint=None, prefix=None):
+        '''
+        Drop one endpoint (any params), every endpoint under `prefix`, or everything.
+        `prefix` matches whole path segments: '/api/Plant/1' covers
+        '/api/Plant/1/Element' but not '/api/Plant/10'.
+        Returns the number of entries removed.
+        '''
+        if prefix is not None:
+            prefix = prefix.rstrip('/')
+        with self._lock:
+            if endpoint is None and prefix is None:
+                removed = len(self._entries)
+                self._entries.clear()
+                self._in_flight.clear()
+                return removed
+            for key in [key for key in self._in_flight if self._matches(key, endpoint, prefix)]:
+                del self._in_flight[key]
+            keys = [key for key in self._entries if self._matches(key, endpoint, prefix)]
+            for key in keys:
+                del self._entries[key]
+            return len(keys)
+
+    @staticmethod
+    def _matches(key, endpoint, prefix):
+        return key[0] == endpoint or (prefix is not None and (
+            key[0] == prefix or key[0].startswith(prefix + '/')))
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'shared': self.shared,
+            }
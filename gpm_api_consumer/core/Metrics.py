@@ -0,0 +1,202 @@
+import json
+import logging
+import re
+import threading
+import time
+import uuid
+from bisect import bisect_left
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_ID_PATTERN = re.compile(r'/\d+')
+
+
+def endpoint_template(endpoint):
+    '''
+    '/api/Plant/4/Element/447' -> '/api/Plant/{id}/Element/{id}'
+    '''
+    return _ID_PATTERN.sub('/{id}', endpoint)
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        '''
+        Upper bound of the bucket holding the q-quantile.
+        '''
+        if not self.count:
+            return None
+        target = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            seen += count
+            if seen >= target:
+                return bound
+        return float('inf')
+
+
+class EndpointStats:
+    def __init__(self):
+        self.latency = Histogram()
+        self.errors = 0
+        self.bytes = 0
+        self.wire_bytes = 0
+        self.decode_seconds = 0.0
+        self.headers_seconds = 0.0
+        self.queued_seconds = 0.0
+        self.retries = 0
+
+
+class MetricsCollector:
+    '''
+    Hook aggregating APIClient events: per-endpoint latency histograms,
+    payload sizes (decoded and on the wire), decode and queueing time,
+    retries, re-login and cache counters, and gauges such as the adaptive
+    limits. Export with to_prometheus() or summary().
+
+        collector = MetricsCollector()
+        APIClient.global_hooks.append(collector)
+    '''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.endpoints = {}
+        self.counters = {}
+        self.gauges = {}
+        self.started = time.time()
+
+    def __call__(self, event, data):
+        with self._lock:
+            if event == 'request':
+                key = (data['method'], endpoint_template(data['endpoint']))
+                stats = self.endpoints.get(key)
+                if stats is None:
+                    stats = self.endpoints[key] = EndpointStats()
+                stats.latency.observe(data.get('seconds', 0.0))
+                if data.get('status') is None or data['status'] >= 400:
+                    stats.errors += 1
+                stats.bytes += data.get('bytes', 0)
+                stats.wire_bytes += data.get('wire_bytes', data.get('bytes', 0))
+                stats.decode_seconds += data.get('decode', 0.0)
+                stats.headers_seconds += data.get('headers', 0.0)
+                stats.queued_seconds += data.get('queued', 0.0)
+                stats.retries += data.get('retries', 0)
+            elif event == 'gauge':
+                # Current values (e.g. adaptive limits): keep the last one
+                self.gauges.update(data)
+            else:
+                # Counter events: relogin, cache, memo, ... with numeric fields
+                for name, value in data.items():
+                    if isinstance(value, (int, float)) and not isinstance(value, bool):
+                        counter = f'{event}_{name}'
+                        self.counters[counter] = self.counters.get(counter, 0) + value
+                self.counters[f'{event}_events'] = self.counters.get(f'{event}_events', 0) + 1
+
+    def summary(self):
+        '''
+        JSON-serializable summary of everything recorded.
+        '''
+        with self._lock:
+            endpoints = {}
+            for (method, endpoint), stats in sorted(self.endpoints.items()):
+                count = stats.latency.count
+                endpoints[f'{method} {endpoint}'] = {
+                    'requests': count,
+                    'errors': stats.errors,
+                    'retries': stats.retries,
+                    'seconds_total': round(stats.latency.sum, 4),
+                    'seconds_mean': round(stats.latency.sum / count, 4) if count else None,
+                    'seconds_p50_le': stats.latency.quantile(0.5),
+                    'seconds_p99_le': stats.latency.quantile(0.99),
+                    'headers_seconds_total': round(stats.headers_seconds, 4),
+                    'decode_seconds_total': round(stats.decode_seconds, 4),
+                    'queued_seconds_total': round(stats.queued_seconds, 4),
+                    'bytes_total': stats.bytes,
+                    'wire_bytes_total': stats.wire_bytes,
+                }
+            return {
+                'elapsed_seconds': round(time.time() - self.started, 3),
+                'endpoints': endpoints,
+                'counters': dict(sorted(self.counters.items())),
+                'gauges': dict(sorted(self.gauges.items())),
+            }
+
+    def to_json(self):
+        return json.dumps(self.summary(), indent=4)
+
+    def to_prometheus(self):
+        '''
+        Prometheus text exposition format.
+        '''
+        lines = []
+
+        def metric(name, kind, help_text):
+            lines.append(f'# HELP gpm_{name} {help_text}')
+            lines.append(f'# TYPE gpm_{name} {kind}')
+
+        with self._lock:
+            items = sorted(self.endpoints.items())
+            metric('request_duration_seconds', 'histogram', 'GPM API request latency')
+            for (method, endpoint), stats in items:
+                labels = f'method="{method}",endpoint="{endpoint}"'
+                cumulative = 0
+                for bound, count in zip(stats.latency.buckets, stats.latency.counts):
+                    cumulative += count
+                    lines.append(f'gpm_request_duration_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+                lines.append(f'gpm_request_duration_seconds_bucket{{{labels},le="+Inf"}} {stats.latency.count}')
+                lines.append(f'gpm_request_duration_seconds_sum{{{labels}}} {stats.latency.sum}')
+                lines.append(f'gpm_request_duration_seconds_count{{{labels}}} {stats.latency.count}')
+            for name, attribute, help_text in (
+                    ('request_errors_total', 'errors', 'Requests that failed or returned >= 400'),
+                    ('request_retries_total', 'retries', 'Transport-level retries'),
+                    ('response_bytes_total', 'bytes', 'Response body bytes'),
+                    ('response_wire_bytes_total', 'wire_bytes', 'Response body bytes on the wire (compressed)'),
+                    ('decode_seconds_total', 'decode_seconds', 'Time spent downloading and decoding bodies'),
+                    ('queued_seconds_total', 'queued_seconds', 'Time waiting on the rate limiter')):
+                metric(name, 'counter', help_text)
+                for (method, endpoint), stats in items:
+                    lines.append(f'gpm_{name}{{method="{method}",endpoint="{endpoint}"}} {getattr(stats, attribute)}')
+            for counter, value in sorted(self.counters.items()):
+                metric(f'{counter}_total', 'counter', f'{counter} events')
+                lines.append(f'gpm_{counter}_total {value}')
+            for gauge, value in sorted(self.gauges.items()):
+                metric(gauge, 'gauge', f'Current {gauge}')
+                lines.append(f'gpm_{gauge} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+class RequestTracer:
+    '''
+    Hook writing one JSON span per request (and per counter event) to a
+    file-like object, for per-request tracing.
+    '''
+
+    def __init__(self, stream, trace_id=None):
+        self.stream = stream
+        self.trace_id = trace_id or uuid.uuid4().hex
+        self._lock = threading.Lock()
+
+    def __call__(self, event, data):
+        span = {
+            'trace_id': self.trace_id,
+            'span_id': uuid.uuid4().hex[:16],
+            'name': event if event != 'request' else f"{data.get('method')} {endpoint_template(data.get('endpoint', ''))}",
+            'time': time.time(),
+            'attributes': data,
+        }
+        with self._lock:
+            self.stream.write(json.dumps(span, default=str) + '\n')
+            self.stream.flush()
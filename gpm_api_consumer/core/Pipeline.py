@@ -0,0 +1,320 @@
+import logging
+import multiprocessing
+import os
+from collections import deque
+from concurrent.futures import CancelledError, ProcessPoolExecutor
+from multiprocessing import shared_memory
+from gpm_api_consumer.utils import normalize_name, profiling
+from .Frames import DataListFrame, np, parse_timestamps, require_numpy
+from .Sharding import DATASOURCE_KEY, ShardedDataList
+from .Topology import ID_KEYS, NAME_KEYS, SIGNAL_KEYS, first
+
+logger = logging.getLogger(__name__)
+
+# Arrays are placed in shared memory blocks at multiples of this many bytes
+_ALIGN = 64
+
+# Transform of a worker process, set once when the worker starts
+_worker_transform = None
+
+
+def share_arrays(arrays):
+    '''
+    Copy a dict of numpy arrays into a new shared memory block.
+    Returns the block and its layout [(name, dtype, shape, offset)].
+    '''
+    arrays = {name: np.ascontiguousarray(array) for name, array in arrays.items()}
+    layout, size = [], 0
+    for name, array in arrays.items():
+        layout.append((name, array.dtype.str, array.shape, size))
+        size += -(-array.nbytes // _ALIGN) * _ALIGN
+    block = shared_memory.SharedMemory(create=True, size=max(size, _ALIGN))
+    for (name, dtype, shape, offset), array in zip(layout, arrays.values()):
+        np.ndarray(shape, dtype, buffer=block.buf, offset=offset)[...] = array
+    return block, layout
+
+
+def view_arrays(block, layout):
+    '''
+    numpy views over the arrays of a shared memory block.
+    The views must be released before the block is closed.
+    '''
+    return {name: np.ndarray(shape, dtype, buffer=block.buf, offset=offset)
+            for name, dtype, shape, offset in layout}
+
+
+def _frame_arrays(frame):
+    return {
+        'datasource_ids': frame.datasource_ids,
+        'offsets': frame.offsets,
+        'timestamps': frame.timestamps,
+        'values': frame.values,
+        'mask': frame.mask,
+    }
+
+
+def _init_worker(transform):
+    global _worker_transform
+    _worker_transform = transform
+
+
+def _share_result(result):
+    '''
+    Put the arrays of a transform result in a new block.
+    Other result items are pickled.
+    '''
+    shared = {k: v for k, v in result.items() if isinstance(v, np.ndarray)}
+    extra = {k: v for k, v in result.items() if k not in shared}
+    output, output_layout = share_arrays(shared)
+    output.close()
+    return output.name, output_layout, extra
+
+
+def _process(name, layout):
+    '''
+    Worker side: run the transform over the frame in block `name` and put
+    the arrays of its result in a new block.
+    '''
+    block = shared_memory.SharedMemory(name=name)
+    try:
+        arrays = view_arrays(block, layout)
+        frame = DataListFrame(**{key: arrays[key] for key in
+                                 ('datasource_ids', 'offsets', 'timestamps', 'values', 'mask')})
+        output = _share_result(_worker_transform(frame))
+        # Views into the input block must go before closing it
+        del arrays, frame
+        return output
+    finally:
+        block.close()
+
+
+def _process_bodies(shards, bodies):
+    '''
+    Worker side: decode the raw bodies of the shards of one window, keep
+    the samples each shard owns (see Shard.contains) and run the transform
+    over them. Returns None when the window has no samples.
+    '''
+    frames = []
+    for shard, (content, delta) in zip(shards, bodies):
+        frame = DataListFrame.from_json(content, delta)
+        end = parse_timestamps([shard.end])[0]
+        keep = frame.timestamps <= end if shard.last else frame.timestamps < end
+        frames.append(DataListFrame.from_columns(frame.sample_datasource_ids()[keep],
+                                                 frame.timestamps[keep], frame.values[keep]))
+    frame = DataListFrame.concat(frames)
+    if not len(frame):
+        return None
+    return _share_result(_worker_transform(frame))
+
+
+def _collect(output):
+    '''
+    Parent side: copy a worker result out of shared memory and free it.
+    '''
+    if output is None:
+        return None
+    name, layout, extra = output
+    block = shared_memory.SharedMemory(name=name)
+    try:
+        result = {key: view.copy() for key, view in view_arrays(block, layout).items()}
+    finally:
+        block.close()
+        block.unlink()
+    result.update(extra)
+    return result
+
+
+def table_columns(datasources, elements=None):
+    '''
+    Map datasource IDs to normalized table column names,
+    '<element name>_<signal>' when the elements are given.
+    '''
+    with profiling.stage('table_columns'):
+        element_names = {first(element, ID_KEYS): first(element, NAME_KEYS)
+                         for element in elements or []}
+        columns = {}
+        for datasource in datasources:
+            signal = str(first(datasource, SIGNAL_KEYS, datasource[DATASOURCE_KEY]))
+            element = element_names.get(datasource.get('ElementId'))
+            name = f'{element}_{signal}' if element else signal
+            columns[datasource[DATASOURCE_KEY]] = normalize_name(name).lower()
+    return columns
+
+
+class WideTable:
+    '''
+    Transform pivoting a frame into one row per timestamp and one column per
+    table column. Datasources mapped to the same column share it; the ones
+    not in `columns` are dropped.
+    Returns {'timestamp': (rows,), 'values': (rows, columns), 'columns': names}.
+    '''
+
+    def __init__(self, columns=None, datasources=None, elements=None):
+        '''
+        `columns` maps datasource IDs to column names. Without it they are
+        built from the topology `datasources` and `elements` with
+        table_columns on first use, i.e. once in each worker process.
+        '''
+        self.columns = dict(columns) if columns is not None else None
+        self.datasources = datasources
+        self.elements = elements
+
+    def __call__(self, frame):
+        if self.columns is None:
+            self.columns = table_columns(self.datasources or [], self.elements)
+        names = list(dict.fromkeys(self.columns.values()))
+        position = {name: i for i, name in enumerate(names)}
+        ids = np.fromiter(self.columns, dtype=np.int64, count=len(self.columns))
+        targets = np.array([position[self.columns[i]] for i in self.columns.keys()], dtype=np.int64)
+        order = np.argsort(ids)
+        ids, targets = ids[order], targets[order]
+
+        sample_ids = frame.sample_datasource_ids()
+        found = np.searchsorted(ids, sample_ids).clip(0, max(len(ids) - 1, 0))
+        known = ids[found] == sample_ids if len(ids) else np.zeros(len(sample_ids), dtype=bool)
+        timestamps, rows = np.unique(frame.timestamps[known], return_inverse=True)
+        table = np.full((len(timestamps), len(names)), np.nan)
+        table[rows, targets[found[known]]] = frame.values[known]
+        return {'timestamp': timestamps, 'values': table, 'columns': names}
+
+
+class RawShards(ShardedDataList):
+    '''
+    ShardedDataList handing back the undecoded body of every shard, so the
+    records are decoded and merged by the workers of a ProcessingStage
+    (see ProcessingStage.map_windows) instead of this process.
+    Each window is yielded as a list of (shard, (content, delta)) pairs.
+    '''
+
+    def download(self, shard, params):
+        return self.consumer.datalistv2_bytes(params=shard.params(params))
+
+    @staticmethod
+    def rows(result):
+        # Counted without decoding: one DataSourceId per record in plain
+        # JSON, about two commas per sample in the delta encoding
+        content, delta = result
+        return content.count(b',') // 2 if delta else content.count(b'"DataSourceId"')
+
+    @staticmethod
+    def merge(shards, results):
+        return list(zip(shards, results))
+
+
+class ProcessingStage:
+    '''
+    Run a CPU-bound frame transform on a process pool.
+    Frames go to the workers through shared memory blocks instead of
+    pickled record lists, or as raw response bodies decoded by the workers
+    themselves (map_windows), and up to `max_pending` of them are kept in
+    the pool while the caller keeps producing (downloading) the next ones.
+    `transform(frame)` must be picklable (a module-level function or an
+    object like WideTable) and return a dict; it is sent once to each
+    worker, and the numpy arrays of its results come back through shared
+    memory.
+    Workers are started from a fork server by default: forking the process
+    directly while download threads hold locks could deadlock them.
+    '''
+
+    def __init__(self, transform, max_workers=None, max_pending=None, mp_context=None):
+        require_numpy()
+        if mp_context is None:
+            methods = multiprocessing.get_all_start_methods()
+            mp_context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+        self.transform = transform
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.max_pending = max_pending or 2 * self.max_workers
+        self.executor = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=mp_context,
+                                            initializer=_init_worker, initargs=(transform,))
+
+    def submit(self, frame):
+        '''
+        Send one frame to the pool. Returns (future, block); release the
+        block with _release once the future is done.
+        '''
+        block, layout = share_arrays(_frame_arrays(frame))
+        try:
+            return self.executor.submit(_process, block.name, layout), block
+        except Exception:
+            self._release(block)
+            raise
+
+    def submit_bodies(self, window):
+        '''
+        Send the (shard, (content, delta)) pairs of one window to the pool.
+        Returns (future, None).
+        '''
+        shards = [shard for shard, _ in window]
+        bodies = [body for _, body in window]
+        return self.executor.submit(_process_bodies, shards, bodies), None
+
+    @staticmethod
+    def _release(block):
+        if block is not None:
+            block.close()
+            block.unlink()
+
+    def _result(self, future, block):
+        try:
+            return _collect(future.result())
+        finally:
+            self._release(block)
+
+    def map(self, frames):
+        '''
+        Transform an iterable of frames, yielding the results in order.
+        '''
+        return self._map((frame for frame in frames if len(frame)), self.submit)
+
+    def map_windows(self, windows):
+        '''
+        Decode, merge and transform the raw windows of RawShards.run_windows
+        in the workers, yielding the results of the non-empty ones in order.
+        '''
+        return self._map(windows, self.submit_bodies)
+
+    def _map(self, items, submit):
+        pending = deque()
+        try:
+            for item in items:
+                pending.append(submit(item))
+                while len(pending) >= self.max_pending or (pending and pending[0][0].done()):
+                    result = self._result(*pending.popleft())
+                    if result is not None:
+                        yield result
+            while pending:
+                result = self._result(*pending.popleft())
+                if result is not None:
+                    yield result
+        finally:
+            # Stopped early or failed: free what is still in flight
+            for future, block in pending:
+                future.cancel()
+                try:
+                    _collect(future.result())
+                except (Exception, CancelledError):
+                    pass
+                self._release(block)
+
+    def close(self):
+        self.executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def processed_datalist(consumer, params, transform, planner=None, max_workers=4,
+                       processes=None):
+    '''
+    Download a datalistv2 query window by window and run `transform` over
+    each window on a process pool, so the transforms of the downloaded
+    windows overlap with the downloads of the next ones. The responses are
+    decoded by the workers too.
+    Yields one transform result per non-empty window, in time order.
+    '''
+    windows = RawShards(consumer, planner=planner, max_workers=max_workers).run_windows(params)
+    with ProcessingStage(transform, max_workers=processes) as stage:
+        yield from stage.map_windows(windows)
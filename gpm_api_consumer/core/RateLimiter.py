@@ -0,0 +1,78 @@
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+
+
+class TokenBucket:
+    '''
+    Thread-safe token bucket: `rate` requests per second on average with
+    bursts of up to `burst` requests.
+    '''
+
+    def __init__(self, rate, burst=None):
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.rate = float(rate)
+        self.burst = float(burst or max(1, rate))
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens=1):
+        '''
+        Block until `tokens` are available and take them.
+        Returns the seconds spent waiting.
+        '''
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return waited
+                delay = (tokens - self._tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+
+class RequestLimiter:
+    '''
+    Combined request gate: a token bucket for the request rate and a
+    semaphore capping the requests in flight against the host.
+    Either limit may be None.
+    '''
+
+    def __init__(self, rate=None, burst=None, max_in_flight=None):
+        self.bucket = TokenBucket(rate, burst) if rate else None
+        self.semaphore = threading.BoundedSemaphore(max_in_flight) if max_in_flight else None
+
+    @contextmanager
+    def slot(self):
+        if self.semaphore is not None:
+            self.semaphore.acquire()
+        try:
+            if self.bucket is not None:
+                self.bucket.acquire()
+            yield
+        finally:
+            if self.semaphore is not None:
+                self.semaphore.release()
+
+
+class LimiterChain:
+    '''
+    Several limiters gating the same requests: a slot is taken from each
+    of them in order.
+    '''
+
+    def __init__(self, *limiters):
+        self.limiters = [limiter for limiter in limiters if limiter is not None]
+
+    @contextmanager
+    def slot(self):
+        with ExitStack() as stack:
+            for limiter in self.limiters:
+                stack.enter_context(limiter.slot())
+            yield
@@ -0,0 +1,315 @@
+import json
+import logging
+import os
+import time
+from contextlib import contextmanager
+from datetime import date, datetime
+from gpm_api_consumer.utils import atomic_write
+from .ConfigManager import ConfigManager
+from .exceptions import ResultStoreException
+from .Frames import DataListFrame, np, parse_timestamps, require_numpy
+from .Sharding import split_ids
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+DAY_SECONDS = 86400
+
+# Column file layout (little-endian):
+#   0  magic     8s    b'GPMCOL\x00\x01'
+#   8  version   u4
+#  12  step      u4    seconds between slots
+#  16  day       i8    epoch seconds of the first slot (plant local midnight)
+#  24  datasource i8
+#  32  slots     u4
+#  40  seq       u8    seqlock: odd while a write is in progress
+#  48  filled    u4    slots holding a value or a null
+#  64  values    f8[slots]   NaN when null or empty
+#  ..  state     u1[slots]   EMPTY, VALUE or NULL
+MAGIC = b'GPMCOL\x00\x01'
+VERSION = 1
+HEADER_SIZE = 64
+_HEADER = [('magic', 'S8'), ('version', '<u4'), ('step', '<u4'), ('day', '<i8'),
+           ('datasource', '<i8'), ('slots', '<u4'), ('_pad', '<u4'), ('seq', '<u8'),
+           ('filled', '<u4'), ('_reserved', 'S12')]
+
+EMPTY, VALUE, NULL = 0, 1, 2
+
+
+def _day_start(day):
+    return int((np.datetime64(day, 'D') - np.datetime64(0, 's')) // np.timedelta64(1, 's'))
+
+
+def _parse_day(value):
+    if isinstance(value, (date, datetime)):
+        return value.strftime('%Y-%m-%d')
+    return str(value)[:10]
+
+
+class DayColumn:
+    '''
+    One datasource over one plant-local day at a fixed step, memory-mapped.
+
+    `values` and `state` are views into the mapped file, shared with every
+    process that has it open: no copy and no parsing. Slots only go from
+    EMPTY to VALUE/NULL and a slot's value is stored before its state, so a
+    view can be used as it is while new slots are appended. A refetch may
+    rewrite slots that were already filled; readers that need a consistent
+    copy across such rewrites use snapshot(), which retries around the
+    header sequence counter.
+    '''
+
+    def __init__(self, path, writable=False):
+        require_numpy()
+        self.path = path
+        self._map = np.memmap(path, dtype=np.uint8, mode='r+' if writable else 'r')
+        header = self._map[:HEADER_SIZE].view(np.dtype(_HEADER))
+        if header['magic'][0] != MAGIC:
+            raise ResultStoreException(f"{path} is not a result store column file")
+        self.step = int(header['step'][0])
+        self.day = int(header['day'][0])
+        self.datasource_id = int(header['datasource'][0])
+        slots = int(header['slots'][0])
+        # Views of the header fields that change
+        self._seq = header['seq']
+        self._filled = header['filled']
+        self.values = self._map[HEADER_SIZE:HEADER_SIZE + 8 * slots].view('<f8')
+        self.state = self._map[HEADER_SIZE + 8 * slots:HEADER_SIZE + 9 * slots]
+
+    @staticmethod
+    def create(path, datasource_id, day, step):
+        '''
+        Write an empty column file. It appears at `path` fully formed.
+        '''
+        require_numpy()
+        slots = DAY_SECONDS // step
+        header = np.zeros(1, dtype=np.dtype(_HEADER))
+        header['magic'] = MAGIC
+        header['version'] = VERSION
+        header['step'] = step
+        header['day'] = _day_start(day)
+        header['datasource'] = datasource_id
+        header['slots'] = slots
+        with atomic_write(path, 'wb') as file:
+            file.write(header.tobytes())
+            file.write(np.full(slots, np.nan, dtype='<f8').tobytes())
+            file.write(bytes(slots))
+
+    def __len__(self):
+        return len(self.values)
+
+    @property
+    def seq(self):
+        return int(self._seq[0])
+
+    @property
+    def filled(self):
+        return int(self._filled[0])
+
+    def timestamps(self):
+        '''
+        Epoch seconds (plant local time) of every slot.
+        '''
+        return self.day + self.step * np.arange(len(self.values), dtype=np.int64)
+
+    def snapshot(self, timeout=1.0):
+        '''
+        Consistent copy of (values, state): retried while a write is in
+        progress or when one happened during the copy.
+        '''
+        deadline = time.monotonic() + timeout
+        while True:
+            before = self.seq
+            if not before % 2:
+                values, state = self.values.copy(), self.state.copy()
+                if self.seq == before:
+                    return values, state
+            if time.monotonic() > deadline:
+                raise ResultStoreException(f"{self.path} stayed locked for more than {timeout}s")
+            time.sleep(0.0005)
+
+    def write(self, slots, values, nulls):
+        '''
+        Store values at slot positions (NaN where `nulls`). Only one
+        writer may run at a time; ResultStore holds the plant lock.
+        '''
+        self._seq[0] += 1
+        try:
+            self.values[slots] = values
+            self.state[slots] = np.where(nulls, NULL, VALUE)
+            self._filled[0] = np.count_nonzero(self.state)
+        finally:
+            self._seq[0] += 1
+        self._map.flush()
+
+    def close(self):
+        '''
+        Drop this object's references; the mapping goes away with the
+        last view still held by the caller.
+        '''
+        self._map = self.values = self.state = self._seq = self._filled = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class ResultStore:
+    '''
+    Downloaded datalistv2 series kept as memory-mapped column files, one
+    per plant / step / datasource / day, so other processes can read them
+    as numpy views instead of querying the API or parsing JSON again:
+
+        <root>/plant_<id>/index.json                 {step: {datasource: [days]}}
+        <root>/plant_<id>/<step>s/<datasource>/<YYYY-MM-DD>.col
+
+    Days are plant local days with DAY_SECONDS / step fixed slots, so the
+    step must divide a day (raw, minute and hour groupings, or one day).
+    Writers of a plant are serialized by a lock file; readers never lock.
+    '''
+
+    def __init__(self, root=None):
+        require_numpy()
+        self.root = root or os.path.join(ConfigManager.base_config_dir, 'results')
+
+    def plant_dir(self, plant_id):
+        return os.path.join(self.root, f'plant_{plant_id}')
+
+    def path(self, plant_id, datasource_id, day, step):
+        return os.path.join(self.plant_dir(plant_id), f'{step}s', str(datasource_id),
+                            f'{_parse_day(day)}.col')
+
+    @staticmethod
+    def check_step(step):
+        step = int(step)
+        if step <= 0 or DAY_SECONDS % step:
+            raise ResultStoreException(f"A step of {step}s doesn't divide a day into fixed slots")
+        return step
+
+    def index(self, plant_id):
+        '''
+        {step: {datasource ID: [days]}} of what the plant has stored.
+        '''
+        path = os.path.join(self.plant_dir(plant_id), 'index.json')
+        if not os.path.exists(path):
+            return {}
+        with open(path, 'r') as file:
+            index = json.load(file)
+        return {int(step): {int(ds): days for ds, days in datasources.items()}
+                for step, datasources in index.items()}
+
+    def days(self, plant_id, datasource_id, step):
+        return self.index(plant_id).get(int(step), {}).get(int(datasource_id), [])
+
+    @contextmanager
+    def _plant_lock(self, plant_id):
+        os.makedirs(self.plant_dir(plant_id), exist_ok=True)
+        if fcntl is None:
+            yield
+            return
+        with open(os.path.join(self.plant_dir(plant_id), 'lock'), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _save_index(self, plant_id, index):
+        path = os.path.join(self.plant_dir(plant_id), 'index.json')
+        with atomic_write(path) as file:
+            json.dump({str(step): {str(ds): days for ds, days in datasources.items()}
+                       for step, datasources in index.items()}, file)
+
+    def write(self, plant_id, records, step):
+        '''
+        Store datalistv2 records (or a DataListFrame) taken at `step` seconds.
+        Samples off the slot grid are skipped. Returns the samples stored.
+        '''
+        step = self.check_step(step)
+        frame = records if isinstance(records, DataListFrame) else DataListFrame.from_records(records)
+        if not len(frame):
+            return 0
+        stored = 0
+        with self._plant_lock(plant_id):
+            index = self.index(plant_id)
+            datasources = index.setdefault(step, {})
+            for datasource_id in frame.datasource_ids.tolist():
+                i = frame.index[datasource_id]
+                start, end = frame.offsets[i], frame.offsets[i + 1]
+                timestamps = frame.timestamps[start:end]
+                on_grid = timestamps % step == 0
+                if not on_grid.all():
+                    logger.warning(f"Datasource {datasource_id}: {np.count_nonzero(~on_grid)} "
+                                   f"samples off the {step}s grid not stored")
+                timestamps = timestamps[on_grid]
+                values = frame.values[start:end][on_grid]
+                mask = frame.mask[start:end][on_grid]
+                day_index = timestamps // DAY_SECONDS
+                days = datasources.setdefault(datasource_id, [])
+                for day_number in np.unique(day_index).tolist():
+                    in_day = day_index == day_number
+                    day = str(np.datetime64(day_number, 'D'))
+                    path = self.path(plant_id, datasource_id, day, step)
+                    if not os.path.exists(path):
+                        os.makedirs(os.path.dirname(path), exist_ok=True)
+                        DayColumn.create(path, datasource_id, day, step)
+                    with DayColumn(path, writable=True) as column:
+                        slots = (timestamps[in_day] - column.day) // step
+                        column.write(slots, values[in_day], mask[in_day])
+                    if day not in days:
+                        days.append(day)
+                    stored += int(np.count_nonzero(in_day))
+                days.sort()
+            self._save_index(plant_id, index)
+        return stored
+
+    def tee(self, plant_id, batches, step):
+        '''
+        Store each batch of records while passing it on (e.g. to a sink).
+        '''
+        for batch in batches:
+            self.write(plant_id, batch, step)
+            yield batch
+
+    def open(self, plant_id, datasource_id, day, step):
+        '''
+        Memory-map one stored day as a DayColumn (read-only).
+        '''
+        path = self.path(plant_id, datasource_id, day, self.check_step(step))
+        if not os.path.exists(path):
+            raise ResultStoreException(f"Datasource {datasource_id} of plant {plant_id} has "
+                                       f"nothing stored for {_parse_day(day)} at {step}s")
+        return DayColumn(path)
+
+    def frame(self, plant_id, datasource_ids, start, end, step):
+        '''
+        DataListFrame of the stored samples in [start, end), from consistent
+        snapshots of the day files. Empty slots are left out.
+        '''
+        step = self.check_step(step)
+        start_ts, end_ts = parse_timestamps([start, end]).tolist()
+        days = [str(np.datetime64(n, 'D'))
+                for n in range(start_ts // DAY_SECONDS, (end_ts - 1) // DAY_SECONDS + 1)]
+        ids, timestamps, values = [], [], []
+        for datasource_id in split_ids(datasource_ids):
+            for day in days:
+                path = self.path(plant_id, datasource_id, day, step)
+                if not os.path.exists(path):
+                    continue
+                with DayColumn(path) as column:
+                    day_values, state = column.snapshot()
+                    day_timestamps = column.timestamps()
+                keep = (state != EMPTY) & (day_timestamps >= start_ts) & (day_timestamps < end_ts)
+                ids.append(np.full(np.count_nonzero(keep), datasource_id, dtype=np.int64))
+                timestamps.append(day_timestamps[keep])
+                values.append(day_values[keep])
+        if not ids:
+            return DataListFrame.empty()
+        return DataListFrame.from_columns(np.concatenate(ids), np.concatenate(timestamps),
+                                          np.concatenate(values))
@@ -0,0 +1,306 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from gpm_api_consumer.utils import bind_context, chunked_iterable
+from .exceptions import DataRetrievalException
+
+logger = logging.getLogger(__name__)
+
+DATE_FORMAT = '%Y-%m-%dT%H:%M:%S'
+# Keys of each record returned by /api/DataList/v2
+DATE_KEY = 'Date'
+DATASOURCE_KEY = 'DataSourceId'
+VALUE_KEY = 'Value'
+
+# Seconds covered by one unit of each grouping. Months are counted as 31 days
+# to size requests; their windows follow the calendar (see floor_bucket)
+GROUPING_SECONDS = {
+    'minute': 60,
+    'hour': 3600,
+    'day': 86400,
+    'week': 7 * 86400,
+    'month': 31 * 86400,
+}
+EPOCH = datetime(1970, 1, 1)
+# Monday, where week buckets start
+WEEK_ORIGIN = datetime(1970, 1, 5)
+
+
+def parse_date(value):
+    '''
+    Parse a GPM date string into a naive datetime (plant local time).
+    '''
+    if isinstance(value, datetime):
+        return value.replace(tzinfo=None)
+    if value.endswith('Z'):
+        value = value[:-1]
+    return datetime.fromisoformat(value).replace(tzinfo=None)
+
+
+def format_date(value):
+    return value.strftime(DATE_FORMAT)
+
+
+def split_ids(datasource_ids):
+    '''
+    Accept datasource IDs as a list or as a comma separated string.
+    '''
+    if isinstance(datasource_ids, str):
+        return [int(v) for v in datasource_ids.split(',') if v.strip()]
+    return [int(v) for v in datasource_ids]
+
+
+def step_seconds(grouping, granularity=None, raw_interval=60):
+    '''
+    Seconds between two consecutive samples for a grouping/granularity pair.
+    '''
+    grouping = (grouping or 'raw').lower()
+    if grouping == 'raw':
+        return raw_interval
+    if grouping not in GROUPING_SECONDS:
+        raise ValueError(f"Unknown grouping '{grouping}'")
+    return GROUPING_SECONDS[grouping] * (granularity or 1)
+
+
+def floor_bucket(date, grouping, granularity=None):
+    '''
+    Start of the datalistv2 bucket holding `date`: minute and hour buckets
+    restart at midnight, days count from the epoch, weeks start on Monday
+    and months follow the calendar. Raw dates are returned as they are.
+    '''
+    grouping = (grouping or 'raw').lower()
+    granularity = int(granularity or 1)
+    if grouping == 'raw':
+        return date
+    if grouping == 'month':
+        months = (date.year * 12 + date.month - 1) // granularity * granularity
+        return datetime(months // 12, months % 12 + 1, 1)
+    step = timedelta(seconds=step_seconds(grouping, granularity))
+    midnight = datetime(date.year, date.month, date.day)
+    if grouping == 'week':
+        return WEEK_ORIGIN + (midnight - WEEK_ORIGIN) // step * step
+    if grouping == 'day':
+        return EPOCH + (midnight - EPOCH) // step * step
+    return midnight + (date - midnight) // step * step
+
+
+def shift_buckets(date, grouping, granularity=None, count=1):
+    '''
+    Start of the bucket `count` buckets after the one starting at `date`.
+    '''
+    grouping = (grouping or 'raw').lower()
+    granularity = int(granularity or 1)
+    if grouping == 'month':
+        months = date.year * 12 + date.month - 1 + count * granularity
+        return datetime(months // 12, months % 12 + 1, 1)
+    return date + count * timedelta(seconds=step_seconds(grouping, granularity))
+
+
+@dataclass(frozen=True)
+class Shard:
+    '''
+    One datalistv2 request: a chunk of datasources over a time window.
+    The window is [start, end); the last window of a query also keeps `end`.
+    Windows past the first start on a bucket boundary.
+    '''
+    index: int
+    window: int
+    datasource_ids: tuple
+    start: datetime
+    end: datetime
+    last: bool = False
+
+    def params(self, base_params):
+        params = dict(base_params)
+        ids = base_params.get('dataSourceIds')
+        if isinstance(ids, str):
+            params['dataSourceIds'] = ','.join(str(v) for v in self.datasource_ids)
+        else:
+            params['dataSourceIds'] = list(self.datasource_ids)
+        params['startDate'] = format_date(self.start)
+        params['endDate'] = format_date(self.end)
+        return params
+
+    def contains(self, date):
+        '''
+        Whether a record dated `date` belongs to this shard. Records are dated
+        with the start of their bucket, so the first bucket of a query may be
+        dated before `start`; the bucket starting at `end` belongs to the next
+        window.
+        '''
+        return date < self.end or (self.last and date == self.end)
+
+
+class ShardPlanner:
+    '''
+    Split a datalistv2 query into (datasource chunk x time window) shards,
+    sized so that each shard returns about `max_rows` records.
+    '''
+
+    def __init__(self, max_rows=50000, max_datasources=100, raw_interval=60):
+        self.max_rows = max_rows
+        self.max_datasources = max_datasources
+        self.raw_interval = raw_interval
+
+    def window_size(self, params, n_datasources):
+        step = step_seconds(params.get('grouping'), params.get('granularity'),
+                            self.raw_interval)
+        steps = max(1, self.max_rows // max(1, n_datasources))
+        return timedelta(seconds=step * steps)
+
+    def plan(self, params):
+        '''
+        Every shard of the query, numbered in order.
+        '''
+        return [shard for window in self.iter_windows(params) for shard in window]
+
+    def iter_windows(self, params):
+        '''
+        Yield the shards of each time window in order. The size of each
+        window is decided when it is reached, so subclasses may adapt it.
+        Grouped queries are cut on bucket boundaries, so that no bucket is
+        split between two windows.
+        '''
+        ids = split_ids(params['dataSourceIds'])
+        start = parse_date(params['startDate'])
+        end = parse_date(params['endDate'])
+        if end < start:
+            raise ValueError("endDate must not be earlier than startDate")
+
+        grouping = (params.get('grouping') or 'raw').lower()
+        granularity = params.get('granularity')
+        step = timedelta(seconds=step_seconds(grouping, granularity, self.raw_interval))
+
+        chunk_size = min(len(ids), self.max_datasources) or 1
+        index = 0
+        w = 0
+        window_start = start
+        while True:
+            size = self.window_size(params, chunk_size)
+            if grouping == 'raw':
+                window_end = window_start + size
+            else:
+                window_end = shift_buckets(floor_bucket(window_start, grouping, granularity),
+                                           grouping, granularity, max(1, size // step))
+            window_end = min(window_end, end)
+            last = window_end >= end
+            shards = []
+            for chunk in chunked_iterable(ids, chunk_size):
+                shards.append(Shard(index, w, tuple(chunk), window_start, window_end, last=last))
+                index += 1
+            yield shards
+            if last:
+                return
+            window_start = window_end
+            w += 1
+
+    def observe(self, shard, rows, seconds, error=None):
+        '''
+        Called after each shard download; fixed-size planners ignore it.
+        '''
+
+
+class ShardedDataList:
+    '''
+    Run a datalistv2 query as shards on a worker pool and stream back the
+    records de-duplicated and ordered by date and datasource.
+    Each shard is retried on its own, so a failure never restarts the job.
+    '''
+
+    def __init__(self, consumer, planner=None, max_workers=4, max_attempts=3,
+                 backoff=1.0):
+        self.consumer = consumer
+        self.planner = planner or ShardPlanner()
+        self.max_workers = max_workers
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+
+    def fetch_shard(self, shard, params):
+        '''
+        Fetch one shard, retrying it with exponential backoff.
+        '''
+        for attempt in range(1, self.max_attempts + 1):
+            start = time.perf_counter()
+            try:
+                result = self.download(shard, params)
+            except Exception as e:
+                self.planner.observe(shard, 0, time.perf_counter() - start, error=e)
+                if attempt == self.max_attempts:
+                    raise DataRetrievalException(
+                        f"Shard {shard.index} ({format_date(shard.start)} - "
+                        f"{format_date(shard.end)}) failed after {attempt} attempts: {e}"
+                    ) from e
+                delay = self.backoff * 2 ** (attempt - 1)
+                logger.warning(f"Shard {shard.index} failed (attempt {attempt}), retrying in {delay}s")
+                time.sleep(delay)
+            else:
+                self.planner.observe(shard, self.rows(result), time.perf_counter() - start)
+                return result
+
+    def download(self, shard, params):
+        '''
+        Records of one shard; subclasses may return them in another form.
+        '''
+        return self.consumer.datalistv2(params=shard.params(params)) or []
+
+    @staticmethod
+    def rows(result):
+        return len(result)
+
+    @staticmethod
+    def merge(shards, results):
+        '''
+        Merge the records of the shards of one window.
+        '''
+        merged = {}
+        for shard, records in zip(shards, results):
+            for record in records:
+                date = parse_date(record[DATE_KEY])
+                if shard.contains(date):
+                    merged[(date, record[DATASOURCE_KEY])] = record
+        return [merged[key] for key in sorted(merged)]
+
+    def run(self, params):
+        '''
+        Yield the records of the whole query in time order.
+        '''
+        for records in self.run_windows(params):
+            yield from records
+
+    def run_windows(self, params):
+        '''
+        Yield the merged records of each time window, in time order, while
+        the next windows are still downloading.
+        '''
+        # Windows are planned as they are submitted, so an adaptive planner
+        # sizes each one with what the previous downloads measured
+        windows = self.planner.iter_windows(params)
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            # Keep a bounded number of windows in flight ahead of the consumer
+            pending = []
+            lookahead = max(1, self.max_workers)
+
+            def submit_next():
+                window_shards = next(windows, None)
+                if window_shards is None:
+                    return
+                futures = [executor.submit(bind_context(self.fetch_shard), shard, params)
+                           for shard in window_shards]
+                pending.append((window_shards, futures))
+
+            for _ in range(lookahead):
+                submit_next()
+            while pending:
+                window_shards, futures = pending.pop(0)
+                try:
+                    results = [future.result() for future in futures]
+                except Exception:
+                    for _, others in pending:
+                        for future in others:
+                            future.cancel()
+                    raise
+                submit_next()
+                yield self.merge(window_shards, results)
@@ -0,0 +1,272 @@
+import csv
+import json
+import logging
+import os
+import sys
+import uuid
+from .Sharding import DATASOURCE_KEY, DATE_KEY, VALUE_KEY
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ('ndjson', 'csv', 'parquet')
+EXTENSIONS = {
+    '.ndjson': 'ndjson',
+    '.jsonl': 'ndjson',
+    '.csv': 'csv',
+    '.parquet': 'parquet',
+}
+
+
+class AtomicWriter:
+    '''
+    Base writer: data goes to a temp file next to `path` and is renamed over
+    it on commit(), so readers never see a partially written file.
+    '''
+
+    mode = 'w'
+
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self.tmp_path = os.path.join(directory, f'.{os.path.basename(path)}.{uuid.uuid4().hex}.tmp')
+        self.rows = 0
+        self._file = None
+
+    def open(self):
+        kwargs = {'newline': ''} if 'b' not in self.mode else {}
+        return open(self.tmp_path, self.mode, **kwargs)
+
+    def write_batch(self, records):
+        # Empty batches (e.g. sync ranges without data) write nothing, so the
+        # first non-empty one decides the layout
+        if not records:
+            return
+        if self._file is None:
+            self._file = self.open()
+        self._write(records)
+        self.rows += len(records)
+
+    def _write(self, records):
+        raise NotImplementedError
+
+    def _close_file(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def commit(self):
+        if self._file is None and not os.path.exists(self.tmp_path):
+            # Nothing written: still publish an empty file
+            self._file = self.open()
+        self._close_file()
+        if os.path.exists(self.tmp_path):
+            os.replace(self.tmp_path, self.path)
+
+    def abort(self):
+        self._close_file()
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+
+class NDJSONWriter(AtomicWriter):
+    '''
+    One JSON document per line.
+    '''
+
+    def _write(self, records):
+        self._file.writelines(json.dumps(record, separators=(',', ':')) + '\n' for record in records)
+
+
+class CSVWriter(AtomicWriter):
+    '''
+    CSV with the columns of the first non-empty batch; nested values are JSON encoded.
+    '''
+
+    def __init__(self, path):
+        super().__init__(path)
+        self._writer = None
+
+    def _write(self, records):
+        if self._writer is None:
+            fieldnames = list(records[0].keys())
+            self._writer = csv.DictWriter(self._file, fieldnames=fieldnames, extrasaction='ignore')
+            self._writer.writeheader()
+        self._writer.writerows(
+            {key: json.dumps(value) if isinstance(value, (dict, list)) else value
+             for key, value in record.items()}
+            for record in records
+        )
+
+
+class ParquetWriter(AtomicWriter):
+    '''
+    Parquet file with one row group per batch. Requires pyarrow.
+    The schema is inferred from the first batch, except for the datalist
+    columns, which have fixed types, and columns that are all null there,
+    which become strings. Later batches are cast to it.
+    '''
+
+    def __init__(self, path):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError("pyarrow is required for Parquet output. "
+                              "Install it with `pip install gpm_api_consumer[arrow]`.")
+        self._pa = pyarrow
+        self._pq = pyarrow.parquet
+        super().__init__(path)
+        self._schema = None
+
+    def open(self):
+        # The ParquetWriter is created with the first batch; without rows
+        # there is no schema and no file
+        return None
+
+    def write_batch(self, records):
+        if not records:
+            return
+        table = self._pa.Table.from_pylist(records)
+        if self._file is None:
+            self._schema = self._schema_of(table)
+            self._file = self._pq.ParquetWriter(self.tmp_path, self._schema)
+        self._file.write_table(self._conform(table))
+        self.rows += len(records)
+
+    def _schema_of(self, table):
+        pa = self._pa
+        datalist_types = {DATASOURCE_KEY: pa.int64(), DATE_KEY: pa.string(), VALUE_KEY: pa.float64()}
+        fields = []
+        for field in table.schema:
+            if field.name in datalist_types:
+                field = field.with_type(datalist_types[field.name])
+            elif pa.types.is_null(field.type):
+                field = field.with_type(pa.string())
+            fields.append(field)
+        return pa.schema(fields)
+
+    def _conform(self, table):
+        '''
+        Cast a batch to the file schema; missing columns are null, extra ones dropped.
+        '''
+        columns = []
+        for field in self._schema:
+            if field.name not in table.column_names:
+                columns.append(self._pa.nulls(len(table), field.type))
+                continue
+            column = table[field.name]
+            columns.append(column if column.type == field.type else column.cast(field.type))
+        return self._pa.Table.from_arrays(columns, schema=self._schema)
+
+
+WRITERS = {
+    'ndjson': NDJSONWriter,
+    'csv': CSVWriter,
+    'parquet': ParquetWriter,
+}
+
+
+class StdoutNDJSONWriter:
+    '''
+    NDJSON to standard output, for `--output -`.
+    '''
+
+    def __init__(self):
+        self.path = '-'
+        self.rows = 0
+
+    def write_batch(self, records):
+        for record in records:
+            sys.stdout.write(json.dumps(record, separators=(',', ':')) + '\n')
+        self.rows += len(records)
+
+    def commit(self):
+        sys.stdout.flush()
+
+    def abort(self):
+        sys.stdout.flush()
+
+
+class PartitionedSink:
+    '''
+    Write batches of records under `root`, partitioned by plant and date:
+    root/plant=<id>/date=<YYYY-MM-DD>/part-<run>.<format>
+    Records without a date go to the plant partition. Every file is written
+    atomically when the sink is closed; on error nothing is published.
+    '''
+
+    def __init__(self, root, fmt='ndjson', plant_id=None, date_key=DATE_KEY):
+        if fmt not in WRITERS:
+            raise ValueError(f"Unknown output format '{fmt}', expected one of {FORMATS}")
+        self.root = root
+        self.fmt = fmt
+        self.plant_id = plant_id
+        self.date_key = date_key
+        self.run_id = uuid.uuid4().hex[:12]
+        self._writers = {}
+
+    def _partition(self, record):
+        parts = [self.root]
+        if self.plant_id is not None:
+            parts.append(f'plant={self.plant_id}')
+        date = record.get(self.date_key) if isinstance(record, dict) else None
+        if date:
+            parts.append(f'date={str(date)[:10]}')
+        return os.path.join(*parts)
+
+    def write_batch(self, records):
+        partitions = {}
+        for record in records:
+            partitions.setdefault(self._partition(record), []).append(record)
+        for partition, batch in partitions.items():
+            writer = self._writers.get(partition)
+            if writer is None:
+                path = os.path.join(partition, f'part-{self.run_id}.{self.fmt}')
+                writer = self._writers[partition] = WRITERS[self.fmt](path)
+            writer.write_batch(batch)
+
+    @property
+    def rows(self):
+        return sum(writer.rows for writer in self._writers.values())
+
+    @property
+    def paths(self):
+        return [writer.path for writer in self._writers.values()]
+
+    def commit(self):
+        for writer in self._writers.values():
+            writer.commit()
+
+    def abort(self):
+        for writer in self._writers.values():
+            writer.abort()
+
+
+def open_sink(output, fmt=None, plant_id=None):
+    '''
+    Build the sink for an `--output` target.
+    `-` writes NDJSON to stdout, a path with a known extension is a single
+    file, and anything else is a directory partitioned by plant and date.
+    '''
+    if output == '-':
+        return StdoutNDJSONWriter()
+    extension = os.path.splitext(output)[1].lower()
+    if extension in EXTENSIONS:
+        return WRITERS[fmt or EXTENSIONS[extension]](output)
+    return PartitionedSink(output, fmt=fmt or 'ndjson', plant_id=plant_id)
+
+
+def write_batches(sink, batches):
+    '''
+    Write an iterable of record batches to `sink`, committing only if all
+    of them were written. Returns the number of rows written.
+    '''
+    try:
+        for batch in batches:
+            sink.write_batch(batch)
+    except BaseException:
+        sink.abort()
+        raise
+    sink.commit()
+    return sink.rows
@@ -0,0 +1,222 @@
+import json
+import logging
+import os
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from gpm_api_consumer.utils import atomic_write
+from .ConfigManager import ConfigManager
+from .exceptions import SyncException
+from .Sharding import (DATASOURCE_KEY, DATE_KEY, floor_bucket, format_date,
+                       parse_date, step_seconds)
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+class WatermarkStore:
+    '''
+    JSON file with the high-water mark and pending gaps of every datasource.
+    Watermarks are kept per query (grouping, granularity, aggregationType).
+    A sync holds locked() from loading the watermarks to saving them, so
+    overlapping runs don't overwrite each other's progress.
+    '''
+
+    def __init__(self, prefix='gpm', path=None):
+        self.path = path or os.path.join(ConfigManager.base_config_dir,
+                                         f'{prefix}_watermarks.json')
+        self._data = self._load()
+
+    def _load(self):
+        if os.path.exists(self.path):
+            with open(self.path, 'r') as file:
+                return json.load(file)
+        return {}
+
+    def reload(self):
+        '''
+        Drop unsaved changes and read the file again.
+        '''
+        self._data = self._load()
+
+    @contextmanager
+    def locked(self):
+        '''
+        Hold the store's lock file and work on its latest saved state.
+        Raises SyncException if another sync holds it.
+        '''
+        if fcntl is None:
+            self.reload()
+            yield self
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with open(f'{self.path}.lock', 'a') as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                raise SyncException(f"Another sync is using {self.path}")
+            try:
+                self.reload()
+                yield self
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def save(self):
+        # Write to a temp file first so a crash never leaves a truncated file
+        with atomic_write(self.path) as file:
+            json.dump(self._data, file, indent=4)
+
+    def get(self, query_key, datasource_id):
+        return self._data.get(query_key, {}).get(str(datasource_id), {
+            'watermark': None,
+            'gaps': [],
+        })
+
+    def set(self, query_key, datasource_id, state):
+        self._data.setdefault(query_key, {})[str(datasource_id)] = state
+
+    def reset(self, query_key=None, datasource_ids=None):
+        if query_key is None:
+            self._data = {}
+        elif datasource_ids is None:
+            self._data.pop(query_key, None)
+        else:
+            for datasource_id in datasource_ids:
+                self._data.get(query_key, {}).pop(str(datasource_id), None)
+        self.save()
+
+
+class IncrementalSync:
+    '''
+    Incremental datalistv2 sync on top of GPMConsumer.
+    Each run fetches, per datasource, only what is newer than its watermark
+    minus `overlap` (to pick up late values), records holes in the returned
+    series as gaps and backfills them on the following runs.
+    '''
+
+    def __init__(self, consumer, store=None, grouping='minute', granularity=5,
+                 aggregationType=1, overlap=timedelta(minutes=30),
+                 initial_lookback=timedelta(days=1), max_gap_attempts=3):
+        self.consumer = consumer
+        self.store = store or WatermarkStore(prefix=consumer.config_manager.prefix)
+        self.query = {
+            'grouping': grouping,
+            'granularity': granularity,
+            'aggregationType': aggregationType,
+        }
+        self.step = timedelta(seconds=step_seconds(grouping, granularity))
+        self.overlap = overlap
+        self.initial_lookback = initial_lookback
+        self.max_gap_attempts = max_gap_attempts
+
+    @property
+    def query_key(self):
+        return f"{self.query['grouping']}:{self.query['granularity']}:{self.query['aggregationType']}"
+
+    def _floor(self, date):
+        return floor_bucket(date, self.query['grouping'], self.query['granularity'])
+
+    def plan(self, datasource_ids, end):
+        '''
+        Group the datasources into ranges that can share a request.
+        Returns a dict {(start, end, is_gap): [datasource ids]}.
+        '''
+        ranges = {}
+        for datasource_id in datasource_ids:
+            state = self.store.get(self.query_key, datasource_id)
+            if state['watermark']:
+                start = parse_date(state['watermark']) - self.overlap
+            else:
+                start = end - self.initial_lookback
+            ranges.setdefault((start, end, False), []).append(datasource_id)
+            for gap_start, gap_end, _ in state['gaps']:
+                ranges.setdefault((parse_date(gap_start), parse_date(gap_end), True), []).append(datasource_id)
+        return ranges
+
+    def find_gaps(self, dates):
+        '''
+        Return the (start, end) holes between consecutive sample dates.
+        '''
+        gaps = []
+        for previous, current in zip(dates, dates[1:]):
+            if current - previous > self.step:
+                gaps.append((previous + self.step, current - self.step))
+        return gaps
+
+    def run(self, datasource_ids, end=None, sink=None, commit=None):
+        '''
+        Sync every datasource up to `end` (now by default).
+        `sink` is called with each batch of records and `commit` once they
+        have all been handed over. The watermarks only move after commit()
+        returns: if any range or the commit fails nothing is saved, and the
+        next run fetches the same ranges again.
+        Returns a summary per datasource.
+        '''
+        with self.store.locked():
+            try:
+                summary = self._run(datasource_ids, end, sink)
+                if commit is not None:
+                    commit()
+            except BaseException:
+                self.store.reload()
+                raise
+            self.store.save()
+        return summary
+
+    def _run(self, datasource_ids, end, sink):
+        end = self._floor(end or datetime.now())
+        summary = {datasource_id: {'records': 0} for datasource_id in datasource_ids}
+
+        for (start, range_end, is_gap), ids in sorted(self.plan(datasource_ids, end).items()):
+            if start > range_end:
+                continue
+            params = dict(self.query, dataSourceIds=','.join(str(v) for v in ids),
+                          startDate=format_date(start), endDate=format_date(range_end))
+            logger.info(f"Syncing {len(ids)} datasources from {params['startDate']} "
+                        f"to {params['endDate']}{' (gap)' if is_gap else ''}")
+            records = list(self.consumer.datalistv2_sharded(params))
+            if sink is not None:
+                sink(records)
+
+            dates = {datasource_id: [] for datasource_id in ids}
+            for record in records:
+                dates.setdefault(record[DATASOURCE_KEY], []).append(parse_date(record[DATE_KEY]))
+            for datasource_id in ids:
+                ds_dates = sorted(dates[datasource_id])
+                summary[datasource_id]['records'] += len(ds_dates)
+                if is_gap:
+                    # The samples around the gap are known, so pad with them
+                    ds_dates = [start - self.step, *ds_dates, range_end + self.step]
+                self._update(datasource_id, start, range_end, ds_dates, is_gap)
+
+        for datasource_id in datasource_ids:
+            state = self.store.get(self.query_key, datasource_id)
+            summary[datasource_id].update(watermark=state['watermark'], gaps=len(state['gaps']))
+        return summary
+
+    def _update(self, datasource_id, start, end, dates, is_gap):
+        state = self.store.get(self.query_key, datasource_id)
+        old_gaps = [(parse_date(g[0]), parse_date(g[1]), g[2]) for g in state['gaps']]
+
+        # Gaps inside the fetched range are replaced by the holes found now
+        gaps = [gap for gap in old_gaps if not (start <= gap[0] and gap[1] <= end)]
+        for gap_start, gap_end in self.find_gaps(dates):
+            attempts = next((g[2] + 1 for g in old_gaps
+                             if g[0] <= gap_start and gap_end <= g[1]), 0)
+            if attempts >= self.max_gap_attempts:
+                logger.warning(f"Giving up on gap {format_date(gap_start)} - {format_date(gap_end)} "
+                               f"of datasource {datasource_id}")
+                continue
+            gaps.append((gap_start, gap_end, attempts))
+
+        watermark = state['watermark']
+        if not is_gap and dates and (watermark is None or dates[-1] > parse_date(watermark)):
+            watermark = format_date(dates[-1])
+
+        self.store.set(self.query_key, datasource_id, {
+            'watermark': watermark,
+            'gaps': [[format_date(s), format_date(e), a] for s, e, a in sorted(gaps)],
+        })
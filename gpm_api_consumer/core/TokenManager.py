@@ -0,0 +1,198 @@
+import base64
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from gpm_api_consumer.utils import atomic_write
+from .ConfigManager import ConfigManager
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+def _claims(token):
+    try:
+        payload = token.split('.')[1]
+        payload += '=' * (-len(payload) % 4)
+        claims = json.loads(base64.urlsafe_b64decode(payload))
+    except (AttributeError, IndexError, TypeError, ValueError):
+        return {}
+    return claims if isinstance(claims, dict) else {}
+
+
+def token_expiry(token):
+    '''
+    Expiry (epoch seconds) of a JWT access token, or None if it can't be read.
+    '''
+    try:
+        return float(_claims(token)['exp'])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def token_lifetime(token):
+    '''
+    Seconds between the issue (iat) and the expiry of a JWT access token,
+    or None if it can't be read.
+    '''
+    claims = _claims(token)
+    try:
+        return float(claims['exp']) - float(claims['iat'])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+class TokenManager:
+    '''
+    Proactive lifecycle of the API token.
+    The token is refreshed `refresh_margin` seconds before its expiry (at
+    most half its lifetime, so short-lived tokens get used), by a
+    background timer when `background` is set or by the first caller that
+    finds it expiring. Only one refresh runs at a time: other threads wait
+    on a lock, and other processes on an exclusive lock of the token cache
+    file, then pick up the token it wrote instead of logging in again.
+    '''
+
+    def __init__(self, consumer, path=None, refresh_margin=300, background=False,
+                 login=None):
+        '''
+        `login` is the blocking call returning a new token, consumer.login
+        by default.
+        '''
+        self.consumer = consumer
+        self.login = login or consumer.login
+        self.path = path or os.path.join(ConfigManager.base_config_dir,
+                                         f'{consumer.config_manager.prefix}_token.json')
+        self.refresh_margin = refresh_margin
+        self.background = background
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._timer = None
+        self.token, self.expires_at, self.lifetime = self._read_cache()
+        if self.token is None:
+            self.token = consumer.config_manager.get('api_token')
+            self.expires_at = token_expiry(self.token)
+            self.lifetime = token_lifetime(self.token)
+        self._schedule()
+
+    def _read_cache(self):
+        try:
+            with open(self.path, 'r') as file:
+                data = json.load(file)
+            token = data.get('token')
+            return token, data.get('expires_at'), data.get('lifetime', token_lifetime(token))
+        except (OSError, ValueError):
+            return None, None, None
+
+    def _write_cache(self):
+        with atomic_write(self.path) as file:
+            json.dump({'token': self.token, 'expires_at': self.expires_at,
+                       'lifetime': self.lifetime}, file)
+
+    @contextmanager
+    def _file_lock(self):
+        if fcntl is None:
+            yield
+            return
+        with open(f'{self.path}.lock', 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def margin(self, lifetime):
+        '''
+        Seconds before expiry when a token of `lifetime` seconds is refreshed.
+        '''
+        if lifetime is None:
+            return self.refresh_margin
+        return min(self.refresh_margin, lifetime / 2)
+
+    def _fresh(self, token, expires_at, lifetime):
+        '''
+        Whether a token can still be used without refreshing it.
+        Tokens with unknown expiry are trusted until the API rejects them.
+        '''
+        if not token:
+            return False
+        return expires_at is None or expires_at - self.margin(lifetime) > time.time()
+
+    def is_valid(self):
+        '''
+        Whether the current token is known to be valid (no round-trip needed).
+        '''
+        return (bool(self.token) and self.expires_at is not None
+                and self._fresh(self.token, self.expires_at, self.lifetime))
+
+    def get_token(self):
+        '''
+        Return a usable token, refreshing it first if it is about to expire.
+        '''
+        token = self.token
+        if not self._fresh(token, self.expires_at, self.lifetime):
+            token = self.refresh(stale_token=token)
+        self._local.token = token
+        return token
+
+    @property
+    def used_token(self):
+        '''
+        The token last handed out to the current thread.
+        '''
+        return getattr(self._local, 'token', self.token)
+
+    def refresh(self, stale_token=None):
+        '''
+        Replace `stale_token`, unless another thread or process already did.
+        '''
+        with self._lock:
+            if self.token != stale_token and self._fresh(self.token, self.expires_at, self.lifetime):
+                return self.token
+            with self._file_lock():
+                token, expires_at, lifetime = self._read_cache()
+                if token != stale_token and self._fresh(token, expires_at, lifetime):
+                    logger.debug("Using token refreshed by another process")
+                else:
+                    logger.info("Refreshing API token...")
+                    token = self.login()
+                    self.consumer.client.emit('login', count=1)
+                    expires_at = token_expiry(token)
+                    lifetime = token_lifetime(token)
+                    if lifetime is None and expires_at is not None:
+                        lifetime = expires_at - time.time()
+                self.token, self.expires_at, self.lifetime = token, expires_at, lifetime
+                self._write_cache()
+            if self.consumer.config_manager.get('api_token') != token:
+                self.consumer.config_manager.set('api_token', token)
+            self._schedule()
+            return token
+
+    def _schedule(self):
+        if not self.background or self.expires_at is None:
+            return
+        if self._timer is not None:
+            self._timer.cancel()
+        delay = max(0, self.expires_at - self.margin(self.lifetime) - time.time())
+        stale_token = self.token
+        self._timer = threading.Timer(delay, self._background_refresh, args=(stale_token,))
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _background_refresh(self, stale_token):
+        try:
+            self.refresh(stale_token=stale_token)
+        except Exception as e:
+            # The next call will retry synchronously
+            logger.warning(f"Background token refresh failed: {e}")
+
+    def stop(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
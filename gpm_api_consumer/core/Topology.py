@@ -0,0 +1,255 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from gpm_api_consumer.utils import atomic_write, bind_context, normalize_name, profiling
+from .ConfigManager import ConfigManager
+from .exceptions import PlantNotFoundException
+from .Sharding import DATASOURCE_KEY
+
+logger = logging.getLogger(__name__)
+
+# Candidate keys of the GPM objects, in order of preference
+ID_KEYS = ('Id', 'PlantId', 'ElementId')
+NAME_KEYS = ('Name', 'PlantName', 'ElementName')
+ELEMENT_TYPE_KEYS = ('Type', 'ElementType', 'TypeName')
+SIGNAL_KEYS = ('Signal', 'SignalName', 'DataSourceName', 'Name')
+
+
+def first(obj, keys, default=None):
+    '''
+    Value of the first of `keys` set in a GPM object, e.g. first(plant, ID_KEYS).
+    '''
+    for key in keys:
+        if obj.get(key) is not None:
+            return obj[key]
+    return default
+
+
+def _fingerprint(data):
+    payload = json.dumps(data, sort_keys=True, separators=(',', ':')).encode()
+    return hashlib.sha1(payload).hexdigest()
+
+
+def _key(value):
+    return normalize_name(str(value)).lower()
+
+
+class TopologyStore:
+    '''
+    Persistent plant -> element -> datasource hierarchy.
+    Each plant is crawled once and kept for `ttl` seconds. After that it is
+    revalidated with the element list only (ETag when the server sends one,
+    a content fingerprint otherwise) and fully crawled again only if it
+    changed. Lookups by plant, safe name, element type and signal are
+    in-memory dictionary accesses.
+    '''
+
+    def __init__(self, consumer=None, prefix='gpm', path=None, ttl=3600, max_workers=8):
+        if consumer is not None:
+            prefix = consumer.config_manager.prefix
+        self.consumer = consumer
+        self.path = path or os.path.join(ConfigManager.base_config_dir,
+                                         f'{prefix}_topology.json')
+        self.ttl = ttl
+        self.max_workers = max_workers
+        self._lock = threading.RLock()
+        self._data = self._load()
+        self._build_index()
+
+    def _load(self):
+        self._mtime = os.path.getmtime(self.path) if os.path.exists(self.path) else None
+        if self._mtime is not None:
+            with open(self.path, 'r') as file:
+                return json.load(file)
+        return {'plants': {}, 'plant_list': None}
+
+    def reload(self):
+        '''
+        Read the store again if another process saved it since it was loaded.
+        '''
+        mtime = os.path.getmtime(self.path) if os.path.exists(self.path) else None
+        with self._lock:
+            if mtime != self._mtime:
+                self._data = self._load()
+                self._build_index()
+
+    def save(self):
+        with atomic_write(self.path) as file:
+            json.dump(self._data, file)
+        self._mtime = os.path.getmtime(self.path)
+
+    def _build_index(self):
+        '''
+        Rebuild the in-memory indexes from the stored topology.
+        '''
+        self._by_safe_name = {}
+        self._by_type = {}
+        self._by_signal = {}
+        self._by_type_signal = {}
+        self._datasources = {}
+        for plant_list_item in (self._data.get('plant_list') or {}).get('plants', []):
+            name = first(plant_list_item, NAME_KEYS)
+            if name is not None:
+                self._by_safe_name[_key(name)] = first(plant_list_item, ID_KEYS)
+        for plant_id, entry in self._data['plants'].items():
+            self._index_plant(plant_id, entry)
+
+    def _index_plant(self, plant_id, entry):
+        # Name normalization and datasource mapping of the plant
+        with profiling.stage('topology_index'):
+            name = first(entry['plant'] or {}, NAME_KEYS)
+            if name is not None:
+                self._by_safe_name[_key(name)] = int(plant_id)
+            by_type, by_signal, by_type_signal, datasources = {}, {}, {}, []
+            elements = {str(first(e, ID_KEYS)): e for e in entry['elements']}
+            for element_id, element_datasources in entry['datasources'].items():
+                element = elements.get(element_id, {})
+                element_type = _key(first(element, ELEMENT_TYPE_KEYS, 'unknown'))
+                for datasource in element_datasources:
+                    item = dict(datasource, element_id=int(element_id),
+                                element_name=first(element, NAME_KEYS),
+                                element_type=element_type)
+                    datasources.append(item)
+                    by_type.setdefault(element_type, []).append(item)
+                    signal = first(datasource, SIGNAL_KEYS)
+                    if signal is not None:
+                        by_signal.setdefault(_key(signal), []).append(item)
+                        by_type_signal.setdefault((element_type, _key(signal)), []).append(item)
+            self._datasources[str(plant_id)] = datasources
+            self._by_type[str(plant_id)] = by_type
+            self._by_signal[str(plant_id)] = by_signal
+            self._by_type_signal[str(plant_id)] = by_type_signal
+
+    def _require_consumer(self):
+        if self.consumer is None:
+            raise RuntimeError("A GPMConsumer is required to fetch the topology.")
+        return self.consumer
+
+    def plants(self, force=False):
+        '''
+        Return the list of plants, refreshing it after `ttl` seconds.
+        '''
+        with self._lock:
+            cached = self._data.get('plant_list')
+            if cached and not force and time.time() - cached['fetched_at'] < self.ttl:
+                return cached['plants']
+            plants = self._require_consumer().plant() or []
+            self._data['plant_list'] = {'fetched_at': time.time(), 'plants': plants}
+            self._build_index()
+            self.save()
+            return plants
+
+    def resolve_plant(self, plant):
+        '''
+        Resolve a plant ID or name (any spelling with the same safe name) into its ID.
+        '''
+        if isinstance(plant, int) or str(plant).isdigit():
+            return int(plant)
+        plant_id = self._by_safe_name.get(_key(plant))
+        if plant_id is None and self.consumer is not None:
+            self.plants(force=True)
+            plant_id = self._by_safe_name.get(_key(plant))
+        if plant_id is None:
+            raise PlantNotFoundException(safe_name=normalize_name(str(plant)))
+        return int(plant_id)
+
+    def ensure(self, plant, force=False):
+        '''
+        Make sure the topology of a plant is fresh and return its entry.
+        '''
+        plant_id = self.resolve_plant(plant)
+        with self._lock:
+            entry = self._data['plants'].get(str(plant_id))
+            if entry is not None and not force:
+                if time.time() - entry['fetched_at'] < self.ttl:
+                    return entry
+                if self.consumer is None:
+                    logger.warning(f"Topology of plant {plant_id} is stale and cannot be revalidated")
+                    return entry
+                if self._revalidate(plant_id, entry):
+                    return entry
+            return self.refresh(plant_id)
+
+    def _revalidate(self, plant_id, entry):
+        consumer = self._require_consumer()
+        elements, etag, modified = consumer.get_conditional(
+            f'/api/Plant/{plant_id}/Element', etag=entry.get('etag'))
+        if modified and _fingerprint(elements) != entry.get('fingerprint'):
+            logger.info(f"Topology of plant {plant_id} changed, refreshing")
+            return False
+        logger.debug(f"Topology of plant {plant_id} is still valid")
+        entry['fetched_at'] = time.time()
+        entry['etag'] = etag or entry.get('etag')
+        self.save()
+        return True
+
+    def refresh(self, plant):
+        '''
+        Crawl the plant, its elements and their datasources and store them.
+        '''
+        plant_id = self.resolve_plant(plant)
+        consumer = self._require_consumer()
+        logger.info(f"Fetching topology of plant {plant_id}")
+        # A refresh must see the API, not responses memoized in this process
+        if hasattr(consumer, 'invalidate'):
+            consumer.invalidate(prefix=f'/api/Plant/{plant_id}')
+        plant_data = consumer.plant(plant_id)
+        elements, etag, _ = consumer.get_conditional(f'/api/Plant/{plant_id}/Element')
+        elements = elements or []
+        element_ids = [first(element, ID_KEYS) for element in elements]
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            datasources = list(executor.map(
+                bind_context(lambda element_id: consumer.datasources(plant_id, element_id) or []),
+                element_ids))
+        entry = {
+            'fetched_at': time.time(),
+            'etag': etag,
+            'fingerprint': _fingerprint(elements),
+            'plant': plant_data,
+            'elements': elements,
+            'datasources': {str(e): d for e, d in zip(element_ids, datasources)},
+        }
+        with self._lock:
+            self._data['plants'][str(plant_id)] = entry
+            self._index_plant(plant_id, entry)
+            self.save()
+        return entry
+
+    def invalidate(self, plant=None):
+        '''
+        Forget one plant (or everything) so it is crawled again on next use.
+        '''
+        with self._lock:
+            if plant is None:
+                self._data = {'plants': {}, 'plant_list': None}
+            else:
+                self._data['plants'].pop(str(self.resolve_plant(plant)), None)
+            self._build_index()
+            self.save()
+
+    def element_types(self, plant):
+        plant_id = str(self.resolve_plant(plant))
+        self.ensure(plant_id)
+        return sorted(self._by_type.get(plant_id, {}))
+
+    def lookup(self, plant, element_type=None, signal=None):
+        '''
+        Datasources of a plant, optionally filtered by element type and signal.
+        e.g. lookup('My Plant', element_type='inverter', signal='active_power')
+        '''
+        plant_id = str(self.resolve_plant(plant))
+        self.ensure(plant_id)
+        if element_type is not None and signal is not None:
+            return list(self._by_type_signal[plant_id].get((_key(element_type), _key(signal)), []))
+        if element_type is not None:
+            return list(self._by_type[plant_id].get(_key(element_type), []))
+        if signal is not None:
+            return list(self._by_signal[plant_id].get(_key(signal), []))
+        return list(self._datasources[plant_id])
+
+    def datasource_ids(self, plant, element_type=None, signal=None):
+        return [ds[DATASOURCE_KEY] for ds in self.lookup(plant, element_type, signal)]
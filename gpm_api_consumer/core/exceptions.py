@@ -35,4 +35,19 @@ class PlantNotFoundException(GPMException):
 class DataRetrievalException(GPMException):
     """Exception for errors during data retrieval from GPM API."""
     def __init__(self, message="Error retrieving data from GPM API"):
-        super().__init__(message)
\ No newline at end of file
+        super().__init__(message)
+
+class BackfillJobException(GPMException):
+    """Exception for backfill jobs that don't exist or can't run."""
+    def __init__(self, message="Backfill job error"):
+        super().__init__(message)
+
+class ResultStoreException(GPMException):
+    """Exception for result store data that is missing or can't be stored."""
+    def __init__(self, message="Result store error"):
+        super().__init__(message)
+
+class SyncException(GPMException):
+    """Exception for incremental syncs that can't run."""
+    def __init__(self, message="Sync error"):
+        super().__init__(message)
@@ -0,0 +1,31 @@
+from .ConfigManager import ConfigManager
+
+# Config keys of the GPM consumer and their expected types.
+# Kept apart from Consumers so config commands don't import the HTTP stack.
+GPM_CONFIG_KEYS = {
+    # query parameters for datalistv2 endpoint
+    'api_token': str,
+    'plant_id': int,
+    'plant_name': str,
+    'element_id': int,
+    'startDate': str,
+    'endDate': str,
+    'dataSourceIds': (list, int),
+    'grouping': str,
+    'granularity': int,
+    'aggregationType': int,
+    'signals': (list, str),
+    'table': str,
+}
+
+
+def gpm_config_manager(prefix='gpm'):
+    '''
+    ConfigManager with the GPM config keys and the files of `prefix`.
+    '''
+    return ConfigManager(
+        prefix = prefix,
+        config_path=f'{prefix}_config.json',
+        env_path=f'{prefix}.env',
+        config_keys=GPM_CONFIG_KEYS
+    )
@@ -0,0 +1,335 @@
+"""
+`gpm-cli serve`: a long-running process answering CLI commands over a Unix
+socket, so each command reuses an authenticated consumer, its connection
+pool and its in-memory metadata instead of starting cold.
+
+Protocol: the client sends one JSON line, either {"args": {...}} with the
+parsed CLI arguments or {"control": "ping" | "stop"}. The daemon answers
+with JSON lines {"out": text} / {"err": text} while the command runs and a
+final {"exit": code}.
+"""
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+# Unix socket paths are limited to about 108 bytes
+_MAX_SOCKET_PATH = 100
+
+logger = logging.getLogger(__name__)
+
+
+def socket_path(prefix='gpm'):
+    '''
+    Socket of the daemon serving `prefix`: $GPM_SOCKET, or <config dir>/<prefix>.sock
+    (moved to a private directory of the temp dir when that path is too long
+    for a Unix socket).
+    '''
+    if os.environ.get('GPM_SOCKET'):
+        return os.environ['GPM_SOCKET']
+    from gpm_api_consumer.core.ConfigManager import ConfigManager
+    path = os.path.join(ConfigManager.base_config_dir, f'{prefix}.sock')
+    if len(path) > _MAX_SOCKET_PATH:
+        import hashlib
+        import tempfile
+        digest = hashlib.sha1(path.encode()).hexdigest()[:12]
+        directory = _private_dir(os.path.join(tempfile.gettempdir(), f'gpm-{os.getuid()}'))
+        path = os.path.join(directory, f'{digest}.sock')
+    return path
+
+
+def _private_dir(path):
+    '''
+    Create `path` readable by this user only, refusing one that another
+    user could have planted in a shared directory.
+    '''
+    import stat
+    try:
+        os.mkdir(path, 0o700)
+    except FileExistsError:
+        pass
+    info = os.lstat(path)
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid():
+        raise RuntimeError(f"{path} is not a directory owned by this user")
+    if stat.S_IMODE(info.st_mode) & 0o077:
+        os.chmod(path, 0o700)
+    return path
+
+
+def _connect(path, timeout=None):
+    if not os.path.exists(path):
+        return None
+    import socket
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.settimeout(timeout)
+    try:
+        client.connect(path)
+    except OSError:
+        # Stale socket of a daemon that is gone
+        client.close()
+        return None
+    return client
+
+
+def _request(client, message, out=None, err=None):
+    '''
+    Send one message and relay the answer. Returns the exit code.
+    '''
+    out = out or sys.stdout
+    err = err or sys.stderr
+    client.sendall(json.dumps(message).encode() + b'\n')
+    with client.makefile('r', encoding='utf-8') as answers:
+        for line in answers:
+            frame = json.loads(line)
+            if 'out' in frame:
+                out.write(frame['out'])
+            elif 'err' in frame:
+                err.write(frame['err'])
+            elif 'exit' in frame:
+                out.flush()
+                return frame['exit']
+    raise ConnectionError("The daemon closed the connection before answering")
+
+
+def forward(args, path=None):
+    '''
+    Run a parsed command on the daemon if one is listening.
+    Returns its exit code, or None when there is no daemon to forward to.
+    '''
+    client = _connect(path or socket_path())
+    if client is None:
+        return None
+    try:
+        return _request(client, {'args': vars(args)})
+    finally:
+        client.close()
+
+
+def control(command, path=None):
+    '''
+    Send 'ping' or 'stop' to the daemon. Returns its answer, or None if none runs.
+    '''
+    client = _connect(path or socket_path(), timeout=5)
+    if client is None:
+        return None
+    try:
+        client.sendall(json.dumps({'control': command}).encode() + b'\n')
+        with client.makefile('r', encoding='utf-8') as answers:
+            line = answers.readline()
+        return json.loads(line) if line else None
+    finally:
+        client.close()
+
+
+class _ThreadStream:
+    '''
+    sys.stdout / sys.stderr replacement writing to the stream of the
+    command running in the current thread, or to the daemon's own.
+    '''
+
+    def __init__(self, default):
+        self.default = default
+        self._local = threading.local()
+
+    @property
+    def target(self):
+        return getattr(self._local, 'target', None) or self.default
+
+    @target.setter
+    def target(self, target):
+        self._local.target = target
+
+    def write(self, text):
+        return self.target.write(text)
+
+    def flush(self):
+        self.target.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.default, name)
+
+
+class _FrameWriter:
+    '''
+    File-like object sending what is written as {"<key>": text} lines.
+    '''
+
+    def __init__(self, connection, key, lock):
+        self.connection = connection
+        self.key = key
+        self.lock = lock
+
+    def write(self, text):
+        if text:
+            data = json.dumps({self.key: text}).encode() + b'\n'
+            with self.lock:
+                self.connection.sendall(data)
+        return len(text)
+
+    def flush(self):
+        pass
+
+    def isatty(self):
+        return False
+
+
+class Daemon:
+    '''
+    Unix socket server running CLI commands in this process, one thread
+    per connection. Objects created through cli.shared() (the operator,
+    consumers, topology) stay warm between commands; their config files
+    are re-read when another process changed them.
+    Output of the threads a command starts (e.g. download pools) and
+    process-wide settings such as the log level are shared by the commands
+    running at the same time; --metrics and --trace hooks are not.
+    '''
+
+    def __init__(self, path=None, idle_timeout=None):
+        self.path = path or socket_path()
+        self.idle_timeout = idle_timeout
+        self.started = time.time()
+        self.commands = 0
+        self.active = 0
+        self._last_activity = time.monotonic()
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._server = None
+
+    def serve_forever(self):
+        import socket
+        from gpm_api_consumer import cli
+        if control('ping', self.path) is not None:
+            raise RuntimeError(f"A daemon is already listening on {self.path}")
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+        cli.WARM = {}
+        sys.stdout = self.stdout = _ThreadStream(sys.stdout)
+        sys.stderr = self.stderr = _ThreadStream(sys.stderr)
+        logging.basicConfig(stream=self.stderr, force=True,
+                            format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        # Created owner-only, so no other user can connect in between
+        umask = os.umask(0o077)
+        try:
+            server.bind(self.path)
+        finally:
+            os.umask(umask)
+        server.listen(64)
+        server.settimeout(1.0)
+        self._server = server
+        logger.info(f"gpm-cli daemon listening on {self.path}")
+        try:
+            while not self._stopping.is_set():
+                try:
+                    connection, _ = server.accept()
+                except socket.timeout:
+                    self._check_idle()
+                    continue
+                threading.Thread(target=self._handle, args=(connection,), daemon=True).start()
+        finally:
+            server.close()
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            self._close_warm(cli.WARM)
+            cli.WARM = None
+            logger.info("gpm-cli daemon stopped")
+
+    def stop(self):
+        self._stopping.set()
+
+    def _check_idle(self):
+        if not self.idle_timeout:
+            return
+        with self._lock:
+            idle = not self.active and time.monotonic() - self._last_activity > self.idle_timeout
+        if idle:
+            logger.info(f"No commands for {self.idle_timeout}s, stopping")
+            self.stop()
+
+    def status(self):
+        with self._lock:
+            return {
+                'pid': os.getpid(),
+                'socket': self.path,
+                'uptime_seconds': round(time.time() - self.started, 1),
+                'commands': self.commands,
+                'active': self.active,
+            }
+
+    def _handle(self, connection):
+        lock = threading.Lock()
+        try:
+            with connection, connection.makefile('r', encoding='utf-8') as requests:
+                line = requests.readline()
+                if not line:
+                    return
+                message = json.loads(line)
+                if 'control' in message:
+                    answer = self.status()
+                    if message['control'] == 'stop':
+                        self.stop()
+                        answer['stopping'] = True
+                    connection.sendall(json.dumps(answer).encode() + b'\n')
+                    return
+                code = self._run(message['args'], connection, lock)
+                connection.sendall(json.dumps({'exit': code}).encode() + b'\n')
+        except (BrokenPipeError, ConnectionResetError):
+            logger.warning("Client went away before its command finished")
+        except Exception:
+            logger.exception("Daemon request failed")
+
+    def _run(self, arguments, connection, lock):
+        import argparse
+        import traceback
+        from gpm_api_consumer import cli
+        with self._lock:
+            self.active += 1
+            self.commands += 1
+        self.stdout.target = _FrameWriter(connection, 'out', lock)
+        self.stderr.target = _FrameWriter(connection, 'err', lock)
+        try:
+            args = argparse.Namespace(**arguments)
+            loglevel = getattr(logging, args.loglevel.upper(), logging.INFO)
+            logging.getLogger().setLevel(loglevel)
+            self._reload(cli.WARM)
+            code = cli.run(args, cli.build_parser())
+            return code if isinstance(code, int) else 0
+        except SystemExit as e:
+            return e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+        except Exception:
+            sys.stderr.write(traceback.format_exc())
+            return 1
+        finally:
+            self.stdout.target = None
+            self.stderr.target = None
+            with self._lock:
+                self.active -= 1
+                self._last_activity = time.monotonic()
+
+    @staticmethod
+    def _reload(warm):
+        '''
+        Pick up the config, credentials and topology files other processes
+        changed since the warm objects read them.
+        '''
+        for obj in list(warm.values()):
+            consumer = getattr(obj, 'consumer', obj)
+            for target in (obj, getattr(consumer, 'config_manager', None)):
+                reload = getattr(target, 'reload', None)
+                if callable(reload):
+                    reload()
+
+    @staticmethod
+    def _close_warm(warm):
+        for obj in (warm or {}).values():
+            target = getattr(obj, 'consumer', obj)
+            close = getattr(target, 'close', None)
+            if callable(close):
+                try:
+                    close()
+                except Exception:
+                    pass
@@ -1,7 +1,29 @@
-from .utils import normalize_name, set_logger_level, chunked_iterable
+import importlib
 
 __all__ = [
     "normalize_name",
     "set_logger_level",
     "chunked_iterable",
+    "atomic_write",
+    "bind_context",
+    "iter_json_array",
 ]
+
+# Exports are imported on first access, so the CLI can import submodules
+# such as utils.profiling without paying for unicodedata and the JSON stream.
+_lazy_names = {
+    "normalize_name": "gpm_api_consumer.utils.utils",
+    "set_logger_level": "gpm_api_consumer.utils.utils",
+    "chunked_iterable": "gpm_api_consumer.utils.utils",
+    "atomic_write": "gpm_api_consumer.utils.utils",
+    "bind_context": "gpm_api_consumer.utils.utils",
+    "iter_json_array": "gpm_api_consumer.utils.jsonstream",
+}
+
+
+def __getattr__(name):
+    if name in _lazy_names:
+        value = getattr(importlib.import_module(_lazy_names[name]), name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
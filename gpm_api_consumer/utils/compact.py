@@ -0,0 +1,119 @@
+import heapq
+from datetime import datetime, timedelta
+from operator import itemgetter
+
+# Media type of the delta-encoded datalistv2 representation
+DELTA_MEDIA_TYPE = 'application/vnd.gpm.datalist-delta+json'
+
+# Accept header asking for it, with plain JSON as the fallback
+DELTA_ACCEPT = f'{DELTA_MEDIA_TYPE}, application/json;q=0.9'
+
+# Values are sent as integers of 1 / DELTA_SCALE units when lossless
+DELTA_SCALE = 1000
+
+
+def _scaled(values, scale):
+    '''
+    Values as integers of 1/scale units, or None when that would lose precision.
+    '''
+    scaled = []
+    for value in values:
+        if value is None:
+            scaled.append(None)
+            continue
+        units = round(value * scale)
+        if units / scale != value:
+            return None
+        scaled.append(units)
+    return scaled
+
+
+def encode_datalist(records, scale=DELTA_SCALE):
+    """
+    Encode datalistv2 records as one series per datasource:
+
+        {"DataSourceId": 101, "Start": "2024-01-01T00:00:00",
+         "Times": [0, 300, 300, ...], "Scale": 1000,
+         "Values": [1250, 3, -7, ...], "Nulls": [4, 9]}
+
+    `Times` are seconds since the previous sample (the first one since
+    `Start`) and `Values` the difference with the previous value in
+    1/`Scale` units. Missing values are listed in `Nulls` and encoded as a
+    zero difference. When the values don't fit the scale `Scale` is null and
+    `Values` holds them as they are.
+    Records keep their order within each datasource.
+    """
+    series = {}
+    for record in records:
+        series.setdefault(record['DataSourceId'], []).append(record)
+    encoded = []
+    for datasource_id, items in series.items():
+        dates = [datetime.fromisoformat(item['Date']) for item in items]
+        times = [0] + [int((b - a).total_seconds()) for a, b in zip(dates, dates[1:])]
+        values = [item.get('Value') for item in items]
+        nulls = [i for i, value in enumerate(values) if value is None]
+        scaled = _scaled(values, scale)
+        if scaled is not None:
+            deltas, previous = [], 0
+            for units in scaled:
+                if units is None:
+                    deltas.append(0)
+                    continue
+                deltas.append(units - previous)
+                previous = units
+            values = deltas
+        encoded.append({
+            'DataSourceId': datasource_id,
+            'Start': items[0]['Date'],
+            'Times': times,
+            'Scale': scale if scaled is not None else None,
+            'Values': values,
+            'Nulls': nulls,
+        })
+    return encoded
+
+
+def _iter_series(series):
+    '''
+    Yield (date, record) for every sample of one encoded series.
+    '''
+    datasource_id = series['DataSourceId']
+    scale = series.get('Scale')
+    nulls = set(series.get('Nulls') or ())
+    date = datetime.fromisoformat(series['Start'])
+    units = 0
+    for i, (seconds, value) in enumerate(zip(series['Times'], series['Values'])):
+        date += timedelta(seconds=seconds)
+        if scale is not None:
+            units += value
+            value = units / scale
+        yield date, {
+            'DataSourceId': datasource_id,
+            'Date': date.isoformat(),
+            'Value': None if i in nulls else value,
+        }
+
+
+def decode_series(series):
+    '''
+    Expand one encoded series back into datalistv2 records.
+    '''
+    return [record for _, record in _iter_series(series)]
+
+
+def iter_decoded(series):
+    '''
+    Yield the records of an iterable of encoded series in date order, like
+    the plain JSON response: the series are merged by date, and records of
+    the same date keep the order of their series.
+    '''
+    merged = heapq.merge(*(_iter_series(item) for item in series), key=itemgetter(0))
+    for _, record in merged:
+        yield record
+
+
+def decode_datalist(series):
+    '''
+    Decode a delta-encoded datalistv2 response into the usual list of records.
+    '''
+    return list(iter_decoded(series))
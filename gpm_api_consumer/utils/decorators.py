@@ -8,15 +8,24 @@ def handle_authentication(func):
     """
     Decorator to handle authentication for operations.
     Retries the operation if a 401 Unauthorized error occurs.
+    Tokens are normally refreshed ahead of expiry by the consumer's token
+    manager; this is the fallback for revoked or unexpectedly expired ones.
     """
     @wraps(func)
     def wrapper(consumer, *args, **kwargs):
+        tokens = getattr(consumer, 'tokens', None)
         try:
             return func(consumer, *args, **kwargs)
         except HTTPError as e:
             if e.response.status_code == 401:
                 logger.info("Token expired. Re-authenticating...")
-                consumer.login()
+                client = getattr(consumer, 'client', None)
+                if client is not None and hasattr(client, 'emit'):
+                    client.emit('relogin', count=1)
+                if tokens is not None:
+                    tokens.refresh(stale_token=tokens.used_token)
+                else:
+                    consumer.login()
                 logger.info("Re-authentication successful. Retrying operation...")
                 return func(consumer, *args, **kwargs)
             else:
@@ -28,3 +37,30 @@ def handle_authentication(func):
             logger.debug(f"Error: {e}")
             raise e
     return wrapper
+
+def handle_authentication_async(func):
+    """
+    Async version of handle_authentication.
+    Concurrent 401s are coalesced through consumer.refresh_token,
+    so a single login serves every waiting coroutine.
+    """
+    @wraps(func)
+    async def wrapper(consumer, *args, **kwargs):
+        stale_token = consumer.token
+        try:
+            return await func(consumer, *args, **kwargs)
+        except HTTPError as e:
+            if e.response.status_code == 401:
+                logger.info("Token expired. Re-authenticating...")
+                await consumer.refresh_token(stale_token)
+                logger.info("Re-authentication successful. Retrying operation...")
+                return await func(consumer, *args, **kwargs)
+            else:
+                logger.error("Operation failed")
+                logger.debug(f"Error: {e}")
+                raise e
+        except Exception as e:
+            logger.error("Unexpected error occurred")
+            logger.debug(f"Error: {e}")
+            raise e
+    return wrapper
@@ -0,0 +1,71 @@
+import codecs
+import json
+
+_WHITESPACE = ' \t\n\r'
+
+
+def iter_json_array(chunks):
+    """
+    Incrementally decode a JSON document arriving as byte chunks.
+    If the top-level value is an array its items are yielded one by one as
+    soon as they are complete, so memory stays bounded by the largest item.
+    Any other document is decoded at the end and yielded as a single value.
+    """
+    decoder = json.JSONDecoder()
+    text = codecs.getincrementaldecoder('utf-8')()
+    buffer = ''
+    is_array = None
+    finished = False
+
+    for chunk in chunks:
+        if not chunk:
+            continue
+        buffer += text.decode(chunk)
+        if is_array is None:
+            stripped = buffer.lstrip(_WHITESPACE)
+            if not stripped:
+                continue
+            is_array = stripped[0] == '['
+            buffer = stripped[1:] if is_array else stripped
+        if not is_array or finished:
+            continue
+
+        pos = 0
+        while True:
+            while pos < len(buffer) and buffer[pos] in _WHITESPACE + ',':
+                pos += 1
+            if pos >= len(buffer):
+                break
+            if buffer[pos] == ']':
+                finished = True
+                pos += 1
+                break
+            try:
+                item, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                # Incomplete item, wait for the next chunk
+                break
+            if not isinstance(item, (dict, list, str)) and (
+                    end >= len(buffer) or buffer[end] not in _WHITESPACE + ',]'):
+                # A number or literal may continue in the next chunk
+                break
+            yield item
+            pos = end
+        buffer = buffer[pos:]
+
+    buffer += text.decode(b'', final=True)
+    if is_array is None:
+        return
+    if not is_array:
+        if buffer.strip(_WHITESPACE):
+            yield json.loads(buffer)
+        return
+    if not finished:
+        remaining = buffer.strip(_WHITESPACE + ',')
+        if remaining.endswith(']'):
+            remaining = remaining[:-1].strip(_WHITESPACE + ',')
+            finished = True
+        if remaining:
+            yield from json.loads(f'[{remaining}]')
+        if not finished:
+            raise json.JSONDecodeError("Unterminated JSON array", buffer, len(buffer))
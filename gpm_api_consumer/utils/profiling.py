@@ -0,0 +1,247 @@
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+logger = logging.getLogger(__name__)
+
+# The StageProfiler of the run, None when profiling is off
+PROFILER = None
+
+_OFF = nullcontext()
+
+
+def stage(name):
+    '''
+    Context manager measuring `name` when profiling is on.
+    When it is off this is a global lookup and returns a shared no-op.
+    '''
+    if PROFILER is None:
+        return _OFF
+    return PROFILER.stage(name)
+
+
+def _label(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class _StageStats:
+    '''
+    Totals of every run of one stage.
+    '''
+
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.peak = 0
+        self.allocated = 0
+        self.allocations = {}
+        self.profile = None
+
+    def as_dict(self, top):
+        allocators = sorted(self.allocations.items(), key=lambda item: -item[1][0])[:top]
+        return {
+            'stage': self.name,
+            'calls': self.calls,
+            'wall_seconds': round(self.wall, 6),
+            'cpu_seconds': round(self.cpu, 6),
+            'peak_bytes': self.peak,
+            'allocated_bytes': self.allocated,
+            'top_allocators': [{'location': location, 'size_bytes': size, 'count': count}
+                               for location, (size, count) in allocators],
+            'top_functions': self._top_functions(top),
+        }
+
+    def _top_functions(self, top):
+        if self.profile is None:
+            return []
+        rows = sorted(self.profile.stats.items(), key=lambda item: -item[1][3])[:top]
+        return [{'function': f"{function} ({os.path.basename(filename)}:{line})",
+                 'calls': calls, 'own_seconds': round(own, 6), 'cumulative_seconds': round(cumulative, 6)}
+                for (filename, line, function), (_, calls, own, cumulative, _) in rows]
+
+
+class StageProfiler:
+    '''
+    Per-stage wall time, CPU time (process-wide) and memory of a run, plus
+    a sampling profiler of every thread for flame graphs.
+
+    The outermost stage of each thread runs under cProfile (nested stages
+    show up in its functions), and the stages entered while no other one
+    is open are diffed with tracemalloc snapshots for their top allocators.
+    Memory is traced process-wide: the peak of a stage is the peak of the
+    traced memory while it ran, other threads included.
+
+    Writes to `directory`:
+        profile.json       report of every stage
+        <stage>.prof       cProfile stats (pstats, snakeviz, ...)
+        stacks.collapsed   folded stacks ("frame;frame;frame count") for
+                           flamegraph.pl, speedscope, inferno, ...
+    '''
+
+    def __init__(self, directory, interval=0.005, top=15):
+        import tracemalloc
+        self.directory = directory
+        self.interval = interval
+        self.top = top
+        self.tracemalloc = tracemalloc
+        self.stages = {}
+        self.samples = {}
+        self.started = None
+        self._lock = threading.Lock()
+        self._open = []
+        self._stacks = {}
+        self._running = threading.Event()
+        self._sampler = None
+
+    def start(self):
+        global PROFILER
+        if not self.tracemalloc.is_tracing():
+            self.tracemalloc.start()
+        self.started = (time.perf_counter(), time.process_time())
+        self._running.set()
+        self._sampler = threading.Thread(target=self._sample, name='gpm-profiler', daemon=True)
+        self._sampler.start()
+        PROFILER = self
+        return self
+
+    def stop(self):
+        global PROFILER
+        PROFILER = None
+        self._running.clear()
+        if self._sampler is not None:
+            self._sampler.join()
+        self.tracemalloc.stop()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+        self.write()
+
+    def _fold_peak(self):
+        # tracemalloc has one peak for the process: fold it into every open
+        # stage before it is reset
+        _, peak = self.tracemalloc.get_traced_memory()
+        for run in self._open:
+            run['peak'] = max(run['peak'], peak)
+        self.tracemalloc.reset_peak()
+
+    @contextmanager
+    def stage(self, name):
+        ident = threading.get_ident()
+        stack = self._stacks.setdefault(ident, [])
+        profile = snapshot = None
+        if not self._open:
+            snapshot = self.tracemalloc.take_snapshot()
+        if not stack:
+            import cProfile
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError:
+                # Another profiler is active (e.g. the run is under a debugger)
+                profile = None
+        with self._lock:
+            self._fold_peak()
+            run = {'peak': 0, 'memory': self.tracemalloc.get_traced_memory()[0]}
+            self._open.append(run)
+        stack.append(name)
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+            stack.pop()
+            if profile is not None:
+                profile.disable()
+            with self._lock:
+                self._fold_peak()
+                self._open.remove(run)
+                stats = self.stages.get(name)
+                if stats is None:
+                    stats = self.stages[name] = _StageStats(name)
+                stats.calls += 1
+                stats.wall += wall
+                stats.cpu += cpu
+                stats.peak = max(stats.peak, run['peak'])
+                stats.allocated += max(0, self.tracemalloc.get_traced_memory()[0] - run['memory'])
+            self._merge(stats, profile, snapshot)
+
+    def _merge(self, stats, profile, snapshot):
+        difference = []
+        if snapshot is not None:
+            difference = self.tracemalloc.take_snapshot().compare_to(snapshot, 'lineno')
+        with self._lock:
+            for item in difference:
+                if item.size_diff <= 0:
+                    continue
+                frame = item.traceback[0]
+                location = f"{frame.filename}:{frame.lineno}"
+                size, count = stats.allocations.get(location, (0, 0))
+                stats.allocations[location] = (size + item.size_diff, count + max(0, item.count_diff))
+            if profile is not None:
+                if stats.profile is None:
+                    import pstats
+                    stats.profile = pstats.Stats(profile)
+                else:
+                    stats.profile.add(profile)
+
+    def _sample(self):
+        own = threading.get_ident()
+        names = {}
+        while self._running.is_set():
+            time.sleep(self.interval)
+            if len(names) != threading.active_count():
+                names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                labels = []
+                while frame is not None:
+                    labels.append(_label(frame.f_code))
+                    frame = frame.f_back
+                stages = [f"stage:{name}" for name in self._stacks.get(ident, ())]
+                key = ';'.join([names.get(ident, str(ident))] + stages + labels[::-1])
+                self.samples[key] = self.samples.get(key, 0) + 1
+
+    def report(self):
+        wall = time.perf_counter() - self.started[0]
+        cpu = time.process_time() - self.started[1]
+        return {
+            'wall_seconds': round(wall, 6),
+            'cpu_seconds': round(cpu, 6),
+            'samples': sum(self.samples.values()),
+            'sample_interval': self.interval,
+            'stages': [stats.as_dict(self.top) for stats in
+                       sorted(self.stages.values(), key=lambda stats: -stats.wall)],
+        }
+
+    def write(self):
+        '''
+        Write the report, the cProfile stats of each stage and the folded stacks.
+        Returns the report.
+        '''
+        os.makedirs(self.directory, exist_ok=True)
+        report = self.report()
+        with open(os.path.join(self.directory, 'profile.json'), 'w') as file:
+            json.dump(report, file, indent=4)
+        for stats in self.stages.values():
+            if stats.profile is not None:
+                name = ''.join(c if c.isalnum() or c in '-_' else '_' for c in stats.name)
+                stats.profile.dump_stats(os.path.join(self.directory, f'{name}.prof'))
+        with open(os.path.join(self.directory, 'stacks.collapsed'), 'w') as file:
+            for key, count in sorted(self.samples.items()):
+                file.write(f"{key} {count}\n")
+        for item in report['stages']:
+            logger.info(f"Profile {item['stage']}: {item['calls']} calls, "
+                        f"wall {item['wall_seconds']:.3f}s, cpu {item['cpu_seconds']:.3f}s, "
+                        f"peak {item['peak_bytes'] / 2 ** 20:.1f} MiB")
+        logger.info(f"Profile written to {self.directory}")
+        return report
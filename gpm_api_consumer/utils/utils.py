@@ -1,4 +1,8 @@
+import contextvars
 import logging
+import os
+import threading
+from contextlib import contextmanager
 from functools import wraps
 from itertools import islice
 import unicodedata
@@ -35,4 +39,35 @@ def normalize_name(name: str) -> str:
     ascii_name = "".join([c for c in nfkd if not unicodedata.combining(c)])
     ascii_name = ascii_name.replace(" ", "_").replace("-", "_")
     safe = "".join([c for c in ascii_name if c.isalnum() or c == "_"])
-    return safe
\ No newline at end of file
+    return safe
+
+@contextmanager
+def atomic_write(path, mode='w', **kwargs):
+    """
+    Open a temp file next to `path` and rename it over `path` when the block
+    exits without error, so readers never see a partially written file.
+    The temp name is unique per process and thread, so concurrent writers
+    don't clobber each other's file; the last rename wins.
+    """
+    directory, name = os.path.split(os.path.abspath(path))
+    tmp_path = os.path.join(directory, f'.{name}.{os.getpid()}.{threading.get_ident()}.tmp')
+    try:
+        with open(tmp_path, mode, **kwargs) as file:
+            yield file
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def bind_context(func):
+    """
+    Wrap `func` to run in a copy of the caller's contextvars context, so work
+    handed to a thread pool keeps the caller's scope (e.g. APIClient.scope).
+    """
+    context = contextvars.copy_context()
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        # A context can only be entered by one thread at a time
+        return context.copy().run(func, *args, **kwargs)
+    return wrapper
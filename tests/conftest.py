@@ -0,0 +1,117 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+from gpm_api_consumer.bench.simulator import GPMSimulator, SimulatorConfig
+from gpm_api_consumer.core.ConfigManager import ConfigManager
+
+CREDENTIALS = {'username': 'bench', 'password': 'bench'}
+
+
+class StubServer:
+    '''
+    Local HTTP/1.1 server answering from a script: each
+    (status, headers, body, delay) entry answers one request, in order,
+    and every request after them gets 200 with an empty JSON object.
+    '''
+
+    def __init__(self, script=()):
+        self.script = list(script)
+        self.requests = []
+        self.connections = set()
+        self._lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                self._answer()
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get('Content-Length') or 0))
+                self._answer()
+
+            def _answer(self):
+                with stub._lock:
+                    stub.requests.append((self.command, self.path))
+                    stub.connections.add(self.client_address)
+                    entry = stub.script.pop(0) if stub.script else (200, {}, {}, 0)
+                status, headers, body, delay = entry
+                time.sleep(delay)
+                data = json.dumps(body).encode()
+                try:
+                    self.send_response(status)
+                    for name, value in headers.items():
+                        self.send_header(name, value)
+                    self.send_header('Content-Type', 'application/json')
+                    self.send_header('Content-Length', str(len(data)))
+                    self.end_headers()
+                    self.wfile.write(data)
+                except (BrokenPipeError, ConnectionResetError):
+                    # The client gave up (e.g. a read timeout)
+                    self.close_connection = True
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._server.daemon_threads = True
+        self.base_url = f'http://127.0.0.1:{self._server.server_port}'
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+@pytest.fixture
+def stub_server():
+    '''
+    Factory starting a StubServer with the given script of responses.
+    '''
+    started = []
+
+    def start(*script):
+        server = StubServer(script)
+        started.append(server)
+        return server
+
+    yield start
+    for server in started:
+        server.stop()
+
+
+@pytest.fixture
+def simulator():
+    '''
+    Factory starting a GPMSimulator with the given SimulatorConfig options.
+    '''
+    started = []
+
+    def start(**options):
+        sim = GPMSimulator(SimulatorConfig(**options)).start()
+        started.append(sim)
+        return sim
+
+    yield start
+    for sim in started:
+        sim.stop()
+
+
+@pytest.fixture
+def config_dir(tmp_path, monkeypatch):
+    '''
+    Throwaway config directory; write_env(url) points it at a server.
+    '''
+    monkeypatch.setattr(ConfigManager, 'base_config_dir', str(tmp_path))
+
+    def write_env(url):
+        (tmp_path / 'gpm.env').write_text(
+            f"API_BASE_URL={url}\nAPI_USERNAME={CREDENTIALS['username']}\n"
+            f"API_PASSWORD={CREDENTIALS['password']}\n")
+        return tmp_path
+
+    return write_env
@@ -0,0 +1,61 @@
+"""
+Record DataList fixtures for test_aggregation.py from a real GPM API.
+
+Fetches the raw data of some datasources over a period and the grouped
+views (15 minutes, hour and day, aggregationType 0 and 1) of the same
+query, and writes them to tests/fixtures/datalist/<name>.json. Uses the
+credentials of `gpm-cli config` (prefix gpm).
+
+    python tests/record_datalist.py dst_fall_back --datasources 101,202 \\
+        --start 2024-10-27T00:00:00 --end 2024-10-28T00:00:00 --tz Europe/Madrid
+
+`--tz` is only needed when the raw dates the server returns are UTC; leave
+it out when they are plant local time.
+"""
+import argparse
+import json
+from pathlib import Path
+from gpm_api_consumer.core.Consumers import GPMConsumer
+
+FIXTURES = Path(__file__).parent / 'fixtures' / 'datalist'
+VIEWS = [('minute', 15), ('hour', 1), ('day', 1)]
+
+
+def record(consumer, datasources, start, end, views=VIEWS):
+    query = {'dataSourceIds': datasources, 'startDate': start, 'endDate': end}
+    raw_query = dict(query, grouping='raw')
+    recorded = {'query': raw_query, 'response': consumer.datalistv2(raw_query)}
+    recorded_views = []
+    for grouping, granularity in views:
+        for aggregation_type in (0, 1):
+            view_query = dict(query, grouping=grouping, granularity=granularity,
+                              aggregationType=aggregation_type)
+            recorded_views.append({'query': view_query, 'response': consumer.datalistv2(view_query)})
+    return recorded, recorded_views
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('name', help='Fixture name (file name without .json)')
+    parser.add_argument('--datasources', required=True, help='Comma separated datasource IDs')
+    parser.add_argument('--start', required=True)
+    parser.add_argument('--end', required=True)
+    parser.add_argument('--tz', default=None, help='Plant time zone when raw dates are UTC')
+    parser.add_argument('--description', default='')
+    args = parser.parse_args()
+
+    consumer = GPMConsumer(memoize=False)
+    try:
+        raw, views = record(consumer, args.datasources, args.start, args.end)
+    finally:
+        consumer.close()
+    fixture = {'description': args.description, 'source': 'recorded', 'tz': args.tz,
+               'raw': raw, 'views': views}
+    FIXTURES.mkdir(parents=True, exist_ok=True)
+    path = FIXTURES / f'{args.name}.json'
+    path.write_text(json.dumps(fixture, indent=1))
+    print(f"Wrote {path}: {len(raw['response'])} raw samples, {len(views)} views")
+
+
+if __name__ == '__main__':
+    main()
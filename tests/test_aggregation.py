@@ -0,0 +1,107 @@
+import json
+import math
+import warnings
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+import pytest
+from gpm_api_consumer.core.Aggregation import aggregate, check_derivable, derive
+from gpm_api_consumer.core.Frames import DataListFrame, parse_timestamps
+from gpm_api_consumer.core.Sharding import parse_date
+
+pytest.importorskip('numpy')
+
+FIXTURES = sorted((Path(__file__).parent / 'fixtures' / 'datalist').glob('*.json'))
+
+
+def load(path):
+    return json.loads(path.read_text())
+
+
+def series(records, datasource_ids=None):
+    '''
+    {(datasource, date): value} of a datalistv2 response, None for nulls.
+    '''
+    result = {}
+    for record in records:
+        if datasource_ids is None or record['DataSourceId'] in datasource_ids:
+            value = record['Value']
+            result[(record['DataSourceId'], record['Date'][:19])] = \
+                None if value is None or math.isnan(value) else value
+    return result
+
+
+def assert_same(actual, expected):
+    assert actual.keys() == expected.keys()
+    for key, value in expected.items():
+        if value is None:
+            assert actual[key] is None, key
+        else:
+            assert actual[key] == pytest.approx(value, abs=1e-6), key
+
+
+def views(path):
+    return [pytest.param(path, i, id=f"{path.stem}-{view['query']['grouping']}"
+                         f"{view['query']['granularity']}-type{view['query']['aggregationType']}")
+            for i, view in enumerate(load(path)['views'])]
+
+
+@pytest.mark.parametrize('path,i', [param for path in FIXTURES for param in views(path)])
+def test_aggregate_matches_datalistv2(path, i):
+    fixture = load(path)
+    view = fixture['views'][i]
+    frame = DataListFrame.from_records(fixture['raw']['response'])
+    query = view['query']
+    result = aggregate(frame, query['grouping'], query['granularity'], query['aggregationType'],
+                       tz=fixture['tz'])
+    assert_same(series(result.to_records()), series(view['response']))
+
+
+def derivable_pairs(path):
+    fixture = load(path)
+    for i, source in enumerate(fixture['views']):
+        for j, target in enumerate(fixture['views']):
+            if i == j:
+                continue
+            try:
+                check_derivable(source['query'], target['query'])
+            except ValueError:
+                continue
+            yield pytest.param(path, i, j, id=f"{path.stem}-{i}-to-{j}")
+
+
+@pytest.mark.parametrize('path,i,j', [pair for path in FIXTURES for pair in derivable_pairs(path)])
+def test_derive_matches_datalistv2(path, i, j):
+    fixture = load(path)
+    source, target = fixture['views'][i], fixture['views'][j]
+    frame = DataListFrame.from_records(source['response'])
+    # Grouped dates are already plant local time
+    result = series(derive(frame, source['query'], target['query']).to_records())
+    expected = series(target['response'])
+    if target['query']['aggregationType'] == 1:
+        # Means of means only match the server when every bucket held the
+        # same number of samples: compare the datasources without gaps
+        complete = {record['DataSourceId'] for record in fixture['raw']['response']}
+        complete -= {record['DataSourceId'] for record in fixture['raw']['response']
+                     if record['Value'] is None}
+        result = {key: value for key, value in result.items() if key[0] in complete}
+        expected = {key: value for key, value in expected.items() if key[0] in complete}
+    assert_same(result, expected)
+
+
+def test_derive_refuses_mixed_aggregation_types():
+    with pytest.raises(ValueError):
+        check_derivable({'grouping': 'hour', 'granularity': 1, 'aggregationType': 0},
+                        {'grouping': 'day', 'granularity': 1, 'aggregationType': 1})
+
+
+@pytest.mark.parametrize('dates', [
+    ['2024-03-01T10:00:00Z', '2024-03-01T11:00:00Z'],
+    ['2024-03-01T10:00:00+02:00', '2024-03-01T11:00:00-0500'],
+    [datetime(2024, 3, 1, 10, tzinfo=timezone(timedelta(hours=2))), '2024-03-01T11:00:00'],
+])
+def test_timestamps_keep_the_wall_clock(dates):
+    expected = [int(parse_date(d).replace(tzinfo=timezone.utc).timestamp()) for d in dates]
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        assert parse_timestamps(dates).tolist() == expected
+    assert expected == [1709287200, 1709290800]
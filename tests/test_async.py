@@ -0,0 +1,63 @@
+import asyncio
+import time
+from gpm_api_consumer.core.AsyncConsumers import AsyncGPMConsumer
+
+
+def test_gathered_requests_run_concurrently(simulator, config_dir):
+    sim = simulator(latency=0.2, plants=8)
+    config_dir(sim.base_url)
+
+    async def main():
+        async with AsyncGPMConsumer(max_concurrency=8) as consumer:
+            await consumer.ping()
+            start = time.perf_counter()
+            plants = await asyncio.gather(*(consumer.plant(plant_id) for plant_id in range(1, 9)))
+            return plants, time.perf_counter() - start
+
+    plants, elapsed = asyncio.run(main())
+    assert [plant['Id'] for plant in plants] == list(range(1, 9))
+    assert elapsed < 4 * 0.2
+
+
+def test_concurrent_401s_log_in_once(simulator, config_dir):
+    sim = simulator(latency=0.05)
+    config_dir(sim.base_url)
+
+    async def main():
+        async with AsyncGPMConsumer(max_concurrency=8) as consumer:
+            await consumer.ping()
+            sim.expire_tokens()
+            return await asyncio.gather(*(consumer.plant() for _ in range(8)))
+
+    assert all(asyncio.run(main()))
+    assert sim.stats.unauthorized == 8
+    assert sim.stats.logins == 2
+
+
+def test_close_does_not_block_the_loop(simulator, config_dir):
+    sim = simulator(latency=0.5)
+    config_dir(sim.base_url)
+
+    async def ticker(done):
+        ticks = 0
+        while not done.is_set():
+            await asyncio.sleep(0.01)
+            ticks += 1
+        return ticks
+
+    async def main():
+        consumer = AsyncGPMConsumer()
+        await consumer.ping()
+        request = asyncio.ensure_future(consumer.plant())
+        await asyncio.sleep(0.05)
+        done = asyncio.Event()
+
+        async def close():
+            await consumer.close()
+            done.set()
+
+        _, ticks = await asyncio.gather(close(), ticker(done))
+        await request
+        return ticks
+
+    assert asyncio.run(main()) >= 10
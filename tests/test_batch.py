@@ -0,0 +1,90 @@
+import threading
+from contextlib import contextmanager
+from gpm_api_consumer.core.Adaptive import AdaptiveController
+from gpm_api_consumer.core.Batch import BatchRunner
+from gpm_api_consumer.core.Client import APIClient
+from gpm_api_consumer.core.Sharding import ShardedDataList, ShardPlanner
+
+
+class Recorder:
+    '''
+    Limiter counting the slots taken through it.
+    '''
+
+    def __init__(self):
+        self.slots = 0
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def slot(self):
+        with self._lock:
+            self.slots += 1
+        yield
+
+
+class Consumer:
+    def __init__(self, base_url, limiter=None):
+        self.client = APIClient(base_url, limiter=limiter)
+
+    def datalistv2(self, params):
+        self.client.get('/api/DataList/v2', params=params)
+        return []
+
+
+def batch(consumer, pipeline, **options):
+    runner = BatchRunner(consumer, pipeline, max_workers=2, max_in_flight=4, **options)
+    runner.limiter = Recorder()
+    return runner
+
+
+def test_batch_limiter_gates_the_pipeline_requests(stub_server):
+    own = Recorder()
+    consumer = Consumer(stub_server().base_url, limiter=own)
+    runner = batch(consumer, lambda plant: consumer.client.get(f'/api/Plant/{plant}'))
+    assert all(result.ok for result in runner.run([1, 2, 3]))
+    assert (own.slots, runner.limiter.slots) == (3, 3)
+    assert consumer.client.limiter is own
+
+
+def test_other_requests_skip_the_batch_limiter(stub_server):
+    own = Recorder()
+    consumer = Consumer(stub_server().base_url, limiter=own)
+
+    def pipeline(plant):
+        # Like another daemon command using the same consumer meanwhile
+        other = threading.Thread(target=consumer.client.get, args=('/api/Plant',))
+        other.start()
+        other.join()
+        consumer.client.get(f'/api/Plant/{plant}')
+
+    runner = batch(consumer, pipeline)
+    assert all(result.ok for result in runner.run([1, 2]))
+    consumer.client.get('/api/Plant')
+    assert (own.slots, runner.limiter.slots) == (5, 2)
+
+
+def test_shard_workers_keep_the_batch_limiter(stub_server):
+    consumer = Consumer(stub_server().base_url)
+    params = {'dataSourceIds': '1,2,3', 'startDate': '2024-01-01T00:00:00',
+              'endDate': '2024-01-01T01:00:00'}
+    fetcher = ShardedDataList(consumer, ShardPlanner(max_datasources=1), max_workers=3)
+    runner = batch(consumer, lambda plant: list(fetcher.run(params)))
+    assert all(result.ok for result in runner.run([1]))
+    assert runner.limiter.slots == 3
+
+
+def test_adaptive_controller_is_left_alone(stub_server):
+    consumer = Consumer(stub_server().base_url, limiter=Recorder())
+    controller = AdaptiveController().attach(consumer.client)
+    inner = controller.limiter
+    runner = batch(consumer, lambda plant: consumer.client.get(f'/api/Plant/{plant}'))
+    assert all(result.ok for result in runner.run([1, 2]))
+    assert consumer.client.limiter is controller and controller.limiter is inner
+    assert (inner.slots, runner.limiter.slots) == (2, 2)
+
+
+def test_no_limits_leave_the_client_alone():
+    consumer = Consumer('http://localhost')
+    runner = BatchRunner(consumer, lambda plant: consumer.client.limiter, max_workers=1)
+    assert runner.limiter is None
+    assert [result.result for result in runner.run([1])] == [None]
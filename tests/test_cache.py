@@ -0,0 +1,62 @@
+import pytest
+from gpm_api_consumer.bench.simulator import GPMSimulator
+from gpm_api_consumer.core.Cache import DataListCache
+from gpm_api_consumer.core.Client import APIClient
+from gpm_api_consumer.core.Sharding import ShardedDataList, ShardPlanner
+
+
+class Consumer:
+    def __init__(self):
+        self.client = APIClient('http://localhost')
+        self.simulator = GPMSimulator()
+        self.requests = []
+
+    def datalistv2(self, params):
+        self.requests.append((params['startDate'], params['endDate']))
+        query = {key: [str(value)] for key, value in params.items()}
+        return list(self.simulator.datalist(query))
+
+    def datalistv2_sharded(self, params):
+        return ShardedDataList(self, ShardPlanner(max_datasources=1), max_workers=1).run(params)
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = DataListCache(path=str(tmp_path / 'cache.sqlite'))
+    yield cache
+    cache.close()
+
+
+@pytest.mark.parametrize('grouping,granularity,start,end', [
+    ('raw', 1, '2024-01-01T10:07:00', '2024-01-03T13:00:00'),
+    ('hour', 1, '2024-01-01T10:07:00', '2024-01-03T13:20:00'),
+    ('day', 1, '2024-01-01T10:07:00', '2024-01-05T13:00:00'),
+    ('day', 1, '2024-01-01T00:00:00', '2024-01-05T00:00:00'),
+    ('week', 1, '2024-01-03T06:00:00', '2024-02-20T12:00:00'),
+    ('month', 1, '2024-01-20T06:00:00', '2024-04-10T12:00:00'),
+])
+def test_cached_query_matches_the_api(cache, grouping, granularity, start, end):
+    consumer = Consumer()
+    params = {'dataSourceIds': '101,102', 'grouping': grouping, 'granularity': granularity,
+              'aggregationType': 0, 'startDate': start, 'endDate': end}
+    expected = list(consumer.datalistv2_sharded(params))
+    assert cache.fetch(consumer, params) == expected
+    # The second time the whole buckets come from the cache
+    assert cache.fetch(consumer, params) == expected
+
+
+def test_coarse_groupings_are_not_cached(cache):
+    params = {'dataSourceIds': '101', 'grouping': 'week', 'aggregationType': 0,
+              'startDate': '2024-01-03T06:00:00', 'endDate': '2024-02-20T12:00:00'}
+    cache.fetch(Consumer(), params)
+    assert cache.stats()['buckets'] == 0
+
+
+def test_only_the_edges_are_downloaded_again(cache):
+    params = {'dataSourceIds': '101', 'grouping': 'hour', 'aggregationType': 0,
+              'startDate': '2024-01-01T10:07:00', 'endDate': '2024-01-03T13:20:00'}
+    cache.fetch(Consumer(), params)
+    consumer = Consumer()
+    cache.fetch(consumer, params)
+    assert sorted(consumer.requests) == [('2024-01-01T10:07:00', '2024-01-01T11:00:00'),
+                                         ('2024-01-03T13:00:00', '2024-01-03T13:20:00')]
@@ -0,0 +1,53 @@
+import os
+import sys
+import pytest
+from gpm_api_consumer import cli
+from gpm_api_consumer.cli import build_parser, forwardable
+
+
+def parse(*argv):
+    return build_parser().parse_args(list(argv))
+
+
+@pytest.mark.parametrize('argv', [
+    ('config', 'show'),
+    ('cache', 'stats'),
+    ('serve', '--status'),
+    ('backfill', 'resume', 'job'),
+    ('sync', '1'),
+    ('plant_data_pipeline_batch', '--all'),
+    ('--no_daemon', 'plants'),
+    ('--profile', 'out', 'plants'),
+])
+def test_not_forwarded(argv, monkeypatch):
+    monkeypatch.delenv('GPM_NO_DAEMON', raising=False)
+    assert not forwardable(parse(*argv))
+
+
+@pytest.mark.parametrize('argv', [
+    ('plants',),
+    ('topology', 'types', '1'),
+])
+def test_forwarded(argv, monkeypatch):
+    monkeypatch.delenv('GPM_NO_DAEMON', raising=False)
+    assert forwardable(parse(*argv))
+
+
+def test_local_command_skips_the_daemon(config_dir, monkeypatch, capsys):
+    monkeypatch.delitem(sys.modules, 'gpm_api_consumer.daemon', raising=False)
+    cli.main(['config', 'show'])
+    assert 'gpm_api_consumer.daemon' not in sys.modules
+
+
+def test_long_socket_path_falls_back_to_a_private_dir(tmp_path, monkeypatch):
+    import stat
+    import tempfile
+    from gpm_api_consumer.core.ConfigManager import ConfigManager
+    from gpm_api_consumer.daemon import socket_path
+    monkeypatch.delenv('GPM_SOCKET', raising=False)
+    monkeypatch.setattr(ConfigManager, 'base_config_dir', str(tmp_path / ('x' * 120)))
+    monkeypatch.setattr(tempfile, 'tempdir', str(tmp_path))
+    path = socket_path()
+    directory = tmp_path / os.path.basename(os.path.dirname(path))
+    assert os.path.dirname(path) == str(directory)
+    assert stat.S_IMODE(directory.stat().st_mode) == 0o700
@@ -0,0 +1,90 @@
+import threading
+import time
+import pytest
+import requests
+from urllib3.util.retry import RequestHistory
+from gpm_api_consumer.core.Client import APIClient, capped_retry
+
+LOGIN = '/api/Account/Token'
+
+
+def test_requests_reuse_one_pooled_connection(stub_server):
+    server = stub_server()
+    with APIClient(server.base_url) as client:
+        for _ in range(5):
+            client.get('/api/Plant')
+    assert len(server.requests) == 5
+    assert len(server.connections) == 1
+
+
+def test_server_errors_are_retried_then_raised(stub_server):
+    server = stub_server(*[(500, {}, {}, 0)] * 3)
+    with APIClient(server.base_url, max_retries=2, backoff_factor=0) as client:
+        with pytest.raises(requests.HTTPError) as error:
+            client.get('/api/Plant')
+    assert error.value.response.status_code == 500
+    assert len(server.requests) == 3
+
+
+def test_throttled_request_waits_for_retry_after(stub_server):
+    server = stub_server((429, {'Retry-After': '1'}, {}, 0), (200, {}, [{'Id': 1}], 0))
+    with APIClient(server.base_url, backoff_factor=0) as client:
+        start = time.perf_counter()
+        plants = client.get('/api/Plant')
+    assert plants == [{'Id': 1}]
+    assert len(server.requests) == 2
+    assert time.perf_counter() - start >= 0.9
+
+
+def test_read_timeout(stub_server):
+    server = stub_server((200, {}, {}, 0.5))
+    with APIClient(server.base_url, timeout=(1, 0.1), max_retries=0) as client:
+        with pytest.raises(requests.RequestException):
+            client.get('/api/Plant')
+
+
+def test_capped_retry():
+    retry = capped_retry(3, total=20, backoff_factor=1)
+    history = (RequestHistory('GET', '/', None, 500, None),) * 8
+    assert retry.new(history=history).get_backoff_time() == 3
+
+
+def test_backoff_is_capped():
+    client = APIClient('http://localhost', backoff_factor=1, backoff_max=3, max_retries=20)
+    retry = client.session.get_adapter('http://localhost').max_retries
+    history = (RequestHistory('GET', '/', None, 500, None),) * 8
+    assert retry.new(history=history).get_backoff_time() == 3
+
+
+def test_posts_are_not_replayed(stub_server):
+    server = stub_server((500, {}, {}, 0), (200, {}, {}, 0))
+    with APIClient(server.base_url, backoff_factor=0) as client:
+        with pytest.raises(requests.HTTPError):
+            client.post('/api/Plant/1/Report', json={})
+    assert server.requests == [('POST', '/api/Plant/1/Report')]
+
+
+def test_login_is_replayed(stub_server):
+    server = stub_server((503, {}, {}, 0), (200, {}, {'AccessToken': 't'}, 0))
+    with APIClient(server.base_url, backoff_factor=0) as client:
+        assert client.post(LOGIN, json={}) == {'AccessToken': 't'}
+    assert server.requests == [('POST', LOGIN)] * 2
+
+
+def test_hooks_are_scoped_to_their_context(stub_server):
+    server = stub_server()
+    events = {'a': [], 'b': []}
+
+    def fetch(name, count):
+        with APIClient.hooked(lambda event, data: events[name].append(data['endpoint'])):
+            for _ in range(count):
+                client.get(f'/api/{name}')
+
+    with APIClient(server.base_url) as client:
+        threads = [threading.Thread(target=fetch, args=args) for args in (('a', 3), ('b', 2))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        client.get('/api/c')
+    assert events == {'a': ['/api/a'] * 3, 'b': ['/api/b'] * 2}
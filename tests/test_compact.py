@@ -0,0 +1,34 @@
+from gpm_api_consumer.core.Consumers import GPMConsumer
+from gpm_api_consumer.utils.compact import decode_datalist, encode_datalist, iter_decoded
+
+RECORDS = [
+    {'DataSourceId': 101, 'Date': '2024-01-01T00:00:00', 'Value': 1.5},
+    {'DataSourceId': 202, 'Date': '2024-01-01T00:00:00', 'Value': None},
+    {'DataSourceId': 101, 'Date': '2024-01-01T00:05:00', 'Value': 2.25},
+    {'DataSourceId': 202, 'Date': '2024-01-01T00:05:00', 'Value': 0.1234567},
+    {'DataSourceId': 202, 'Date': '2024-01-01T00:10:00', 'Value': 7.0},
+    {'DataSourceId': 101, 'Date': '2024-01-01T00:15:00', 'Value': -3.0},
+]
+
+
+def test_round_trip_keeps_date_order():
+    encoded = encode_datalist(RECORDS)
+    assert [series['DataSourceId'] for series in encoded] == [101, 202]
+    assert decode_datalist(encoded) == RECORDS
+    assert list(iter_decoded(iter(encoded))) == RECORDS
+
+
+def test_compact_responses_match_plain_json(simulator, config_dir):
+    sim = simulator(compact=True, raw_interval=5)
+    config_dir(sim.base_url)
+    params = {'dataSourceIds': '101,102,201', 'startDate': '2024-06-01T10:00:00',
+              'endDate': '2024-06-01T12:00:00', 'grouping': 'raw'}
+    plain, compact = GPMConsumer(), GPMConsumer(compact=True)
+    try:
+        expected = plain.datalistv2(params)
+        assert compact.datalistv2(params) == expected
+        assert list(compact.datalistv2(params, stream=True)) == expected
+    finally:
+        plain.close()
+        compact.close()
+    assert len(expected) == 3 * 25
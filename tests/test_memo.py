@@ -0,0 +1,47 @@
+import threading
+from gpm_api_consumer.core.Memo import RequestMemo
+
+
+def filled(*endpoints):
+    memo = RequestMemo()
+    for endpoint in endpoints:
+        memo.get_or_fetch(endpoint, None, lambda: endpoint)
+    return memo
+
+
+def test_invalidate_prefix_matches_whole_segments():
+    memo = filled('/api/Plant/1', '/api/Plant/1/Element', '/api/Plant/10', '/api/Plant/10/Element')
+    assert memo.invalidate(prefix='/api/Plant/1') == 2
+    assert memo.get_or_fetch('/api/Plant/10', None, lambda: 'refetched') == '/api/Plant/10'
+    assert memo.get_or_fetch('/api/Plant/1', None, lambda: 'refetched') == 'refetched'
+
+
+def test_invalidate_prefix_with_trailing_slash():
+    memo = filled('/api/Plant/1', '/api/Plant/1/Element', '/api/Plant/12/Element')
+    assert memo.invalidate(prefix='/api/Plant/1/') == 2
+
+
+def test_invalidate_endpoint_and_everything():
+    memo = filled('/api/Plant', '/api/Plant/1')
+    assert memo.invalidate('/api/Plant') == 1
+    assert memo.invalidate() == 1
+
+
+def test_fetch_in_flight_during_invalidate_is_not_memoized():
+    memo = RequestMemo()
+    started, release = threading.Event(), threading.Event()
+
+    def slow_fetch():
+        started.set()
+        release.wait(5)
+        return 'before'
+
+    thread = threading.Thread(target=memo.get_or_fetch, args=('/api/Plant/1', None, slow_fetch))
+    thread.start()
+    started.wait(5)
+    memo.invalidate(prefix='/api/Plant/1')
+    # A request after the invalidation doesn't join the stale fetch
+    assert memo.get_or_fetch('/api/Plant/1', None, lambda: 'after') == 'after'
+    release.set()
+    thread.join()
+    assert memo.get_or_fetch('/api/Plant/1', None, lambda: 'refetched') == 'after'
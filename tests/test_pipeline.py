@@ -0,0 +1,38 @@
+import pytest
+from gpm_api_consumer.core.Consumers import GPMConsumer
+from gpm_api_consumer.core.Sharding import ShardPlanner
+
+np = pytest.importorskip('numpy')
+
+from gpm_api_consumer.core.Pipeline import WideTable, table_columns  # noqa: E402
+
+DATASOURCES = [
+    {'DataSourceId': 101, 'ElementId': 1, 'Signal': 'Active Power'},
+    {'DataSourceId': 102, 'ElementId': 1, 'Signal': 'Irradiance'},
+    {'DataSourceId': 201, 'ElementId': 2, 'Signal': 'Active Power'},
+]
+ELEMENTS = [{'Id': 1, 'Name': 'Inversor Ñ-1'}, {'Id': 2, 'Name': 'Inversor 2'}]
+
+
+@pytest.mark.parametrize('compact', [False, True])
+def test_workers_decode_the_windows(simulator, config_dir, compact):
+    sim = simulator(compact=True, raw_interval=5)
+    config_dir(sim.base_url)
+    params = {'dataSourceIds': '101,102,201', 'startDate': '2024-06-01T10:02:00',
+              'endDate': '2024-06-01T16:00:00', 'grouping': 'minute', 'granularity': 15}
+    transform = WideTable(datasources=DATASOURCES, elements=ELEMENTS)
+    consumer = GPMConsumer(compact=compact)
+    try:
+        results = list(consumer.datalistv2_processed(
+            params, transform, planner=ShardPlanner(max_rows=8, max_datasources=2), processes=2))
+        expected = WideTable(table_columns(DATASOURCES, ELEMENTS))(
+            consumer.datalistv2_frame(params))
+    finally:
+        consumer.close()
+    assert len(results) > 1
+    assert transform.columns is None
+    assert results[0]['columns'] == ['inversor_n_1_active_power', 'inversor_n_1_irradiance',
+                                     'inversor_2_active_power']
+    assert np.array_equal(np.concatenate([r['timestamp'] for r in results]), expected['timestamp'])
+    assert np.array_equal(np.concatenate([r['values'] for r in results]), expected['values'],
+                          equal_nan=True)
@@ -0,0 +1,55 @@
+from datetime import datetime
+import pytest
+from gpm_api_consumer.bench.simulator import GPMSimulator, bucket_start
+from gpm_api_consumer.core.Sharding import (ShardedDataList, ShardPlanner, floor_bucket,
+                                            shift_buckets)
+
+
+class Consumer:
+    def __init__(self):
+        self.simulator = GPMSimulator()
+
+    def datalistv2(self, params):
+        query = {key: [str(value)] for key, value in params.items()}
+        return list(self.simulator.datalist(query))
+
+
+@pytest.mark.parametrize('grouping,granularity', [
+    ('minute', 15), ('hour', 3), ('day', 1), ('day', 2), ('week', 1), ('month', 1), ('month', 3),
+])
+def test_floor_bucket_matches_the_api(grouping, granularity):
+    for date in ('2024-01-01T10:07:00', '2024-02-29T23:59:00', '2024-03-14T10:07:00',
+                 '2023-12-31T00:00:00'):
+        date = datetime.fromisoformat(date)
+        assert floor_bucket(date, grouping, granularity) == bucket_start(date, grouping, granularity)
+
+
+def test_shift_buckets_follows_the_calendar():
+    assert shift_buckets(datetime(2024, 11, 1), 'month', 1, 3) == datetime(2025, 2, 1)
+    assert shift_buckets(datetime(2024, 3, 11), 'week', 1, 2) == datetime(2024, 3, 25)
+
+
+def test_month_windows_are_cut_on_month_boundaries():
+    planner = ShardPlanner(max_rows=2, max_datasources=1)
+    shards = planner.plan({'dataSourceIds': '101', 'grouping': 'month',
+                           'startDate': '2024-01-20T00:00:00', 'endDate': '2024-07-10T00:00:00'})
+    assert [(s.start.date().isoformat(), s.end.date().isoformat()) for s in shards] == [
+        ('2024-01-20', '2024-03-01'), ('2024-03-01', '2024-05-01'),
+        ('2024-05-01', '2024-07-01'), ('2024-07-01', '2024-07-10')]
+
+
+@pytest.mark.parametrize('grouping,granularity,start,end,max_rows', [
+    ('month', 1, '2024-01-20T06:00:00', '2024-04-10T12:00:00', 1),
+    ('week', 1, '2024-01-03T06:00:00', '2024-02-20T12:00:00', 2),
+    ('day', 1, '2024-01-01T10:07:00', '2024-01-06T13:00:00', 4),
+    ('hour', 3, '2024-01-01T10:07:00', '2024-01-02T13:00:00', 6),
+])
+def test_sharded_query_matches_the_whole_query(grouping, granularity, start, end, max_rows):
+    consumer = Consumer()
+    params = {'dataSourceIds': '101,102', 'grouping': grouping, 'granularity': granularity,
+              'aggregationType': 0, 'startDate': start, 'endDate': end}
+    whole = sorted(consumer.datalistv2(params), key=lambda r: (r['Date'], r['DataSourceId']))
+    sharded = list(ShardedDataList(consumer, ShardPlanner(max_rows=max_rows, max_datasources=1),
+                                   max_workers=2).run(params))
+    assert len(ShardPlanner(max_rows=max_rows, max_datasources=1).plan(params)) > 2
+    assert sharded == whole
@@ -0,0 +1,54 @@
+import time
+from datetime import datetime
+import pytest
+import requests
+from gpm_api_consumer.bench.simulator import GPMSimulator, bucket_start
+from gpm_api_consumer.core.Client import APIClient
+from conftest import CREDENTIALS
+
+
+def datalist(sim, **params):
+    query = {key: [str(value)] for key, value in params.items()}
+    return list(sim.datalist(query))
+
+
+@pytest.mark.parametrize('date,grouping,granularity,expected', [
+    ('2024-01-01T10:07:00', 'minute', 15, '2024-01-01T10:00:00'),
+    ('2024-01-01T10:07:00', 'hour', 3, '2024-01-01T09:00:00'),
+    ('2024-03-14T10:07:00', 'day', 1, '2024-03-14T00:00:00'),
+    ('2024-03-14T10:07:00', 'week', 1, '2024-03-11T00:00:00'),
+    ('2024-03-14T10:07:00', 'month', 1, '2024-03-01T00:00:00'),
+    ('2024-03-14T10:07:00', 'month', 3, '2024-01-01T00:00:00'),
+])
+def test_bucket_start(date, grouping, granularity, expected):
+    assert bucket_start(datetime.fromisoformat(date), grouping, granularity).isoformat() == expected
+
+
+def test_buckets_are_aligned_not_stepped_from_start():
+    sim = GPMSimulator()
+    hours = datalist(sim, dataSourceIds=101, startDate='2024-01-01T10:07:00',
+                     endDate='2024-01-01T12:30:00', grouping='hour')
+    assert [r['Date'] for r in hours] == ['2024-01-01T10:00:00', '2024-01-01T11:00:00',
+                                          '2024-01-01T12:00:00']
+    months = datalist(sim, dataSourceIds=101, startDate='2024-01-20T00:00:00',
+                      endDate='2024-03-10T00:00:00', grouping='month', aggregationType=0)
+    assert [r['Date'][:10] for r in months] == ['2024-01-01', '2024-02-01', '2024-03-01']
+
+
+def test_edge_buckets_only_hold_the_queried_samples():
+    sim = GPMSimulator()
+    day = dict(dataSourceIds=101, grouping='day', aggregationType=0)
+    whole = datalist(sim, startDate='2024-01-01T00:00:00', endDate='2024-01-01T23:55:00', **day)
+    halves = (datalist(sim, startDate='2024-01-01T00:00:00', endDate='2024-01-01T11:55:00', **day)
+              + datalist(sim, startDate='2024-01-01T12:00:00', endDate='2024-01-01T23:55:00', **day))
+    assert [r['Date'] for r in halves] == [whole[0]['Date']] * 2
+    assert sum(r['Value'] or 0 for r in halves) == pytest.approx(whole[0]['Value'])
+
+
+def test_client_timeouts_leave_no_traceback(simulator, capfd):
+    sim = simulator(latency=0.3)
+    with APIClient(sim.base_url, timeout=(1, 0.05), max_retries=0) as client:
+        with pytest.raises(requests.RequestException):
+            client.post('/api/Account/Token', json=CREDENTIALS)
+    time.sleep(0.5)
+    assert 'Traceback' not in capfd.readouterr().err
@@ -0,0 +1,58 @@
+import csv
+import json
+import pytest
+from gpm_api_consumer.core.Sinks import open_sink, write_batches
+
+
+def record(value, date='2024-01-01T00:00:00'):
+    return {'DataSourceId': 101, 'Date': date, 'Value': value}
+
+
+def test_ndjson(tmp_path):
+    path = tmp_path / 'out.ndjson'
+    assert write_batches(open_sink(str(path)), [[record(1.5)], [], [record(2)]]) == 2
+    assert [json.loads(line)['Value'] for line in path.read_text().splitlines()] == [1.5, 2]
+
+
+def test_csv_header_comes_from_first_non_empty_batch(tmp_path):
+    path = tmp_path / 'out.csv'
+    write_batches(open_sink(str(path)), [[], [record(1.5)], [], [record(None)]])
+    rows = list(csv.DictReader(path.open()))
+    assert [row['Value'] for row in rows] == ['1.5', '']
+    assert list(rows[0]) == ['DataSourceId', 'Date', 'Value']
+
+
+def test_empty_output_still_publishes_a_file(tmp_path):
+    path = tmp_path / 'out.csv'
+    assert write_batches(open_sink(str(path)), [[]]) == 0
+    assert path.read_text() == ''
+
+
+def test_parquet_null_first_batch(tmp_path):
+    pq = pytest.importorskip('pyarrow.parquet')
+    path = tmp_path / 'out.parquet'
+    batches = [[record(None)], [record(5.5)], [record(3)], [dict(record(None), Extra=None)],
+               [{'DataSourceId': 102, 'Date': '2024-01-01T00:05:00', 'Value': 1.0}]]
+    assert write_batches(open_sink(str(path)), batches) == 5
+    table = pq.read_table(path)
+    assert str(table.schema.field('Value').type) == 'double'
+    assert table['Value'].to_pylist() == [None, 5.5, 3.0, None, 1.0]
+
+
+def test_parquet_null_columns_become_strings(tmp_path):
+    pq = pytest.importorskip('pyarrow.parquet')
+    path = tmp_path / 'out.parquet'
+    write_batches(open_sink(str(path)), [[{'Id': 1, 'Name': None}], [{'Id': 2, 'Name': 'Inverter 1'}]])
+    assert pq.read_table(path)['Name'].to_pylist() == [None, 'Inverter 1']
+
+
+def test_failed_write_publishes_nothing(tmp_path):
+    path = tmp_path / 'out.ndjson'
+
+    def batches():
+        yield [record(1)]
+        raise RuntimeError('download failed')
+
+    with pytest.raises(RuntimeError):
+        write_batches(open_sink(str(path)), batches())
+    assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,79 @@
+import json
+from datetime import datetime, timedelta
+import pytest
+from gpm_api_consumer.core.exceptions import SyncException
+from gpm_api_consumer.core.Sharding import format_date, parse_date
+from gpm_api_consumer.core.Sync import IncrementalSync, WatermarkStore
+
+END = datetime(2024, 1, 2)
+STATE = {'minute:5:1': {'101': {
+    'watermark': '2024-01-01T12:00:00',
+    'gaps': [['2024-01-01T06:00:00', '2024-01-01T07:00:00', 0]],
+}}}
+
+
+class Consumer:
+    '''
+    Answers every range with 5-minute samples, failing on the ones listed.
+    '''
+
+    def __init__(self, fail_on=()):
+        self.fail_on = fail_on
+        self.calls = 0
+
+    def datalistv2_sharded(self, params):
+        self.calls += 1
+        if self.calls in self.fail_on:
+            raise ConnectionError("lost")
+        date, end = parse_date(params['startDate']), parse_date(params['endDate'])
+        records = []
+        while date <= end:
+            records.append({'DataSourceId': 101, 'Date': format_date(date), 'Value': 1.0})
+            date += timedelta(minutes=5)
+        return records
+
+
+@pytest.fixture
+def store_path(tmp_path):
+    path = tmp_path / 'watermarks.json'
+    path.write_text(json.dumps(STATE))
+    return path
+
+
+def sync(consumer, path):
+    return IncrementalSync(consumer, store=WatermarkStore(path=str(path)), overlap=timedelta(0))
+
+
+def test_failed_range_keeps_the_saved_watermarks(store_path):
+    records = []
+    with pytest.raises(ConnectionError):
+        sync(Consumer(fail_on=(2,)), store_path).run([101], end=END, sink=records.extend)
+    assert records  # the first range was handed over, then lost with the run
+    assert json.loads(store_path.read_text()) == STATE
+
+
+def test_failed_commit_keeps_the_saved_watermarks(store_path):
+    def commit():
+        raise OSError("disk full")
+
+    with pytest.raises(OSError):
+        sync(Consumer(), store_path).run([101], end=END, sink=list, commit=commit)
+    assert json.loads(store_path.read_text()) == STATE
+
+
+def test_watermarks_move_after_commit(store_path):
+    committed = []
+    job = sync(Consumer(), store_path)
+    summary = job.run([101], end=END, sink=list,
+                      commit=lambda: committed.append(json.loads(store_path.read_text())))
+    assert committed == [STATE]
+    state = json.loads(store_path.read_text())['minute:5:1']['101']
+    assert state == {'watermark': '2024-01-02T00:00:00', 'gaps': []}
+    assert summary[101]['watermark'] == '2024-01-02T00:00:00'
+
+
+def test_overlapping_runs_are_refused(store_path):
+    store = WatermarkStore(path=str(store_path))
+    with store.locked():
+        with pytest.raises(SyncException):
+            sync(Consumer(), store_path).run([101], end=END)
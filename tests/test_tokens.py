@@ -0,0 +1,31 @@
+import asyncio
+from gpm_api_consumer.core.AsyncConsumers import AsyncGPMConsumer
+from gpm_api_consumer.core.Consumers import GPMConsumer
+
+
+def test_short_lived_tokens_are_used(simulator, config_dir):
+    # Tokens living less than the 300 s refresh margin
+    sim = simulator(token_ttl=120)
+    config_dir(sim.base_url)
+    with GPMConsumer() as consumer:
+        for _ in range(3):
+            consumer.ping()
+        assert consumer.tokens.is_valid()
+        assert 55 <= consumer.tokens.margin(consumer.tokens.lifetime) <= 60
+    assert sim.stats.logins == 1
+
+
+def test_async_consumer_shares_the_token_manager(simulator, config_dir):
+    sim = simulator()
+    config_dir(sim.base_url)
+    with GPMConsumer() as consumer:
+        consumer.ping()
+
+    async def main():
+        async with AsyncGPMConsumer() as consumer:
+            await asyncio.gather(*(consumer.plant() for _ in range(8)))
+            return consumer.tokens.is_valid()
+
+    assert asyncio.run(main())
+    # The token cached by the first consumer is reused
+    assert sim.stats.logins == 1
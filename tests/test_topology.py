@@ -0,0 +1,21 @@
+from gpm_api_consumer.core.Consumers import GPMConsumer
+from gpm_api_consumer.core.Topology import SIGNAL_KEYS, TopologyStore, first
+
+
+def test_lookup_by_type_and_signal(simulator, config_dir):
+    sim = simulator()
+    config_dir(sim.base_url)
+    with GPMConsumer() as consumer:
+        store = TopologyStore(consumer)
+        store.refresh(1)
+        everything = store.lookup(1)
+        for element_type in store.element_types(1):
+            for signal in {first(ds, SIGNAL_KEYS) for ds in everything}:
+                expected = [ds for ds in store.lookup(1, element_type=element_type)
+                            if first(ds, SIGNAL_KEYS) == signal]
+                assert store.lookup(1, element_type=element_type, signal=signal) == expected
+        # The index is rebuilt from the saved store
+        reloaded = TopologyStore(path=store.path)
+        assert reloaded.lookup(1, element_type='Inverter', signal='Active Power') == \
+            store.lookup(1, element_type='inverter', signal='active_power')
+        assert store.lookup(1, element_type='inverter', signal='active_power')
@@ -0,0 +1,47 @@
+import threading
+import pytest
+from gpm_api_consumer.utils import atomic_write
+
+
+def test_atomic_write_replaces_the_file(tmp_path):
+    path = tmp_path / 'state.json'
+    path.write_text('old')
+    with atomic_write(str(path)) as file:
+        file.write('new')
+        assert path.read_text() == 'old'
+    assert path.read_text() == 'new'
+    assert [p.name for p in tmp_path.iterdir()] == ['state.json']
+
+
+def test_atomic_write_keeps_the_old_file_on_error(tmp_path):
+    path = tmp_path / 'state.json'
+    path.write_text('old')
+    with pytest.raises(RuntimeError):
+        with atomic_write(str(path)) as file:
+            file.write('half')
+            raise RuntimeError
+    assert path.read_text() == 'old'
+    assert [p.name for p in tmp_path.iterdir()] == ['state.json']
+
+
+def test_concurrent_writers_use_their_own_temp_file(tmp_path):
+    path = str(tmp_path / 'state.json')
+    inside = threading.Barrier(2)
+    errors = []
+
+    def write(text):
+        try:
+            with atomic_write(path) as file:
+                file.write(text)
+                # Both writers have their temp file open at the same time
+                inside.wait(timeout=5)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=write, args=(text,)) for text in ('a' * 100, 'b' * 100)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
+    assert open(path).read() in ('a' * 100, 'b' * 100)